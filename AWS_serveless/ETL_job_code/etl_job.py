@@ -1,51 +1,893 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
 import boto3
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from io import BytesIO, StringIO
+from urllib.parse import quote
 
-s3 = boto3.client('s3')
+# Shipped next to the job with --extra-py-files (see lambda_code/readme.md).
+import pipeline_metrics
+
+s3 = pipeline_metrics.instrument(boto3.client('s3'))
 bucket = 'raw-data-sc171'
 input_key = 'airbnb_ratings_new.csv'
 output_key = 'processed/airbnb_ratings_new.csv'
+output_prefix = 'processed/'
+manifest_key = 'etl_manifest/manifest.json'
 
-response = s3.get_object(Bucket=bucket, Key=input_key)
-raw_bytes = response['Body'].read()
+READ_OPTIONS = dict(encoding='latin1',
+                    sep=',',
+                    na_values=['', 'NA', 'NaN', 'null'])
 
+# Columns kept at read time (normalized names). Everything the Athena reports,
+# the ML feature query and the RDS tables use, plus identifiers so distinct
+# listings never collapse into duplicates. --columns all keeps every column.
+ETL_COLUMNS = [
+    'listing_id', 'host_id', 'host_response_rate', 'host_is_superhost',
+    'host_total_listings_count', 'city', 'neighbourhood_cleansed', 'state',
+    'latitude', 'longitude', 'property_type', 'room_type', 'accommodates',
+    'bathrooms', 'bedrooms', 'amenities', 'price', 'minimum_nights',
+    'number_of_reviews', 'review_scores_rating', 'review_scores_accuracy',
+    'review_scores_cleanliness', 'review_scores_checkin',
+    'review_scores_communication', 'review_scores_location',
+    'review_scores_value', 'reviews_per_month',
+]
+CATEGORICAL_COLUMNS = ['city', 'state', 'room_type', 'property_type', 'host_is_superhost']
 
-df = pd.read_csv(BytesIO(raw_bytes),
-                 encoding='latin1',
-                 sep=',',
-                 na_values=['', 'NA', 'NaN', 'null'],
-                 low_memory=False)
+# Amenity dictionary: a listing's amenities list containing
+# AMENITY_DICTIONARY[i] sets bit i % 63 of mask column i // 63 (amenity_mask,
+# amenity_mask_1, ...), since a signed BIGINT holds 63 bits. The list is
+# append-only - bits never move - and AMENITY_DICTIONARY_VERSION goes up
+# whenever it grows. Each run publishes it to amenity_dictionary_key for the
+# feature query, which turns its has_* flags into bit masks; the column
+# layout is repeated in lambda_code/amenity_features.py.
+AMENITY_DICTIONARY_VERSION = 1
+AMENITY_DICTIONARY = [
+    'TV', 'Cable TV', 'Internet', 'Wireless Internet', 'Air Conditioning',
+    'Wheelchair Accessible', 'Pool', 'Kitchen', 'Free Parking on Premises',
+    'Paid Parking Off Premises', 'Free Parking on Street', 'Smoking Allowed',
+    'Pets Allowed', 'Doorman', 'Doorman Entry', 'Gym', 'Breakfast',
+    'Indoor Fireplace', 'Buzzer/Wireless Intercom', 'Heating',
+    'Family/Kid Friendly', 'Suitable for Events', 'Washer', 'Dryer',
+    'Washer / Dryer', 'Smoke Detector', 'Carbon Monoxide Detector',
+    'First Aid Kit', 'Safety Card', 'Fire Extinguisher', 'Essentials',
+    'Shampoo', '24-Hour Check-in', 'Hangers', 'Hair Dryer', 'Iron',
+    'Laptop Friendly Workspace', 'Lock on Bedroom Door', 'Elevator in Building',
+    'Elevator', 'Hot Tub', 'Dog(s)', 'Cat(s)', 'Other pet(s)',
+    'Pets live on this property', 'Private Entrance', 'Private Living Room',
+    'Self Check-In', 'Smartlock', 'Keypad', 'Lockbox', 'Hot Water',
+    'Bathtub', 'Crib', 'High Chair', 'Microwave', 'Coffee Maker',
+    'Refrigerator', 'Dishwasher', 'Dishes and Silverware', 'Cooking Basics',
+    'Oven', 'Stove',
+]
+AMENITY_MASK_BITS = 63
+AMENITY_MASK_COLUMNS = ['amenity_mask'] + [
+    f'amenity_mask_{word}' for word in range(1, -(-len(AMENITY_DICTIONARY) // AMENITY_MASK_BITS))]
+AMENITY_BITS = {name: i for i, name in enumerate(AMENITY_DICTIONARY)}
+assert len(AMENITY_BITS) == len(AMENITY_DICTIONARY), "AMENITY_DICTIONARY has a repeated name"
+assert 1 << (AMENITY_MASK_BITS - 1) <= np.iinfo('int64').max, \
+    f"bit {AMENITY_MASK_BITS - 1} overflows a signed BIGINT mask column"
+amenity_dictionary_key = 'etl_manifest/amenity_dictionary.json'
 
+# Added by transform_rows, after the source columns. Mask columns beyond the
+# first go last so a growing dictionary never moves the others.
+DERIVED_COLUMNS = ['price_tier', 'amenity_mask', 'amenity_version'] + AMENITY_MASK_COLUMNS[1:]
 
-df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+PRICE_TIER_BINS = [-np.inf, 50, 150, 300, np.inf]
+PRICE_TIER_LABELS = ['Budget', 'Mid-range', 'Upper Mid-range', 'Luxury']
+HEADER_RANGE_BYTES = 65536
 
+# Parquet output: Hive-style city=/price_tier= partitions under output_prefix,
+# so Athena reads only the columns and partitions a query touches.
+OUTPUT_FORMATS = ['csv', 'parquet']
+PARTITION_COLUMNS = ['city', 'price_tier']
+PARQUET_COMPRESSION = 'snappy'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# t/f flags become real booleans so `host_is_superhost = true` keeps working.
+BOOLEAN_COLUMNS = ['host_is_superhost']
+BOOLEAN_VALUES = {'t': True, 'true': True, '1': True, 'f': False, 'false': False, '0': False}
 
-def clean_airbnb_data(df):
-    df = df.dropna(axis=1, how='all')         
-    df = df.drop_duplicates()                  
+# Chunked mode: rows per pandas chunk and bytes per multipart upload part
+# (S3 requires at least 5 MB for every part but the last).
+DEFAULT_CHUNK_SIZE = 100000
+MIN_PART_SIZE = 8 * 1024 * 1024
+
+# Parallel mode: threads move raw objects and outputs between S3 and local
+# disk while a process pool (one worker per core by default) cleans them.
+DOWNLOAD_THREADS = 4
+WORK_DIR = os.environ.get('ETL_WORK_DIR', tempfile.gettempdir())
+
+
+def normalize_name(name):
+    return name.strip().lower().replace(' ', '_')
+
+
+def normalize_columns(df):
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    return df
+
+
+def read_header(key=input_key):
+    # Ranged GET of the first 64 KB: enough to resolve raw column names for
+    # usecols/dtype before the real read starts.
+    response = s3.get_object(Bucket=bucket, Key=key, Range=f'bytes=0-{HEADER_RANGE_BYTES - 1}')
+    first_line = response['Body'].read().decode(READ_OPTIONS['encoding']).splitlines()[0]
+    return next(csv.reader([first_line]))
+
+
+def column_options(raw_columns, columns='used', compact=True):
+    wanted = set(ETL_COLUMNS) if columns == 'used' else None
+    usecols = [c for c in raw_columns if wanted is None or normalize_name(c) in wanted]
+    missing = sorted((wanted or set()) - {normalize_name(c) for c in raw_columns})
+    if missing:
+        print(f"[columns] not in source, skipped: {missing}")
+    options = {'usecols': usecols}
+    if compact:
+        options['dtype'] = {c: 'category' for c in usecols
+                            if normalize_name(c) in CATEGORICAL_COLUMNS}
+    return options
+
+
+def downcast_numerics(df):
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes(include='floating').columns:
+        narrow = df[col].astype('float32')
+        # Only when lossless, so the written CSV keeps full precision.
+        if (narrow.astype('float64') == df[col])[df[col].notna()].all():
+            df[col] = narrow
+    return df
+
+
+def score_columns(columns):
+    return [col for col in columns if 'review_scores' in col]
+
+
+def price_tiers(price):
+    tiers = pd.cut(price, bins=PRICE_TIER_BINS, labels=PRICE_TIER_LABELS, right=False)
+    return tiers.cat.add_categories('Unknown').fillna('Unknown')
+
+
+def amenity_masks(amenities):
+    # '{TV,"Wireless Internet",...}' -> OR of the dictionary bits of its names,
+    # one int64 column per mask word. Each distinct list is parsed once;
+    # unknown names are only reported.
+    codes, lists = pd.factorize(amenities)
+    names = (pd.Series(lists, dtype='object').astype(str).str.strip('{}')
+             .str.replace('"', '', regex=False).str.split(',').explode().str.strip())
+    names = names[names != '']
+    bits = names.map(AMENITY_BITS)
+    unknown = names[bits.isna()].value_counts()
+    if len(unknown):
+        print(f"[amenities] {len(unknown)} names not in dictionary v{AMENITY_DICTIONARY_VERSION}, "
+              f"e.g. {unknown.index[:5].tolist()}")
+    known = bits.dropna()
+    known = pd.DataFrame({'list': known.index, 'bit': known.to_numpy('int64')}).drop_duplicates()
+    word, bit = np.divmod(known['bit'].to_numpy(), AMENITY_MASK_BITS)
+    # The extra row is for missing lists (code -1): no amenities, mask 0.
+    list_masks = np.zeros((len(lists) + 1, len(AMENITY_MASK_COLUMNS)), dtype='int64')
+    np.add.at(list_masks, (known['list'].to_numpy(), word), np.left_shift(1, bit, dtype='int64'))
+    return list_masks[codes]
+
+
+def transform_rows(df, score_means, derived=True):
+    # Row-local part of the cleaning; score_means holds the global fill
+    # values so chunks cleaned separately match a whole-file clean.
+    # derived=False leaves out price_tier and amenity_mask (parallel pass 1,
+    # which only needs the column kinds).
     if 'price' in df.columns:
         df['price'] = pd.to_numeric(df['price'], errors='coerce')
 
-    score_cols = [col for col in df.columns if 'review_scores' in col]
-    for col in score_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        df[col] = df[col].fillna(df[col].mean())
+    for col in score_columns(df.columns):
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        if col in score_means:
+            df[col] = df[col].fillna(score_means[col])
+
+    if not derived:
+        return df
 
     if 'price' in df.columns:
-        def price_tier(p):
-            if pd.isna(p): return 'Unknown'
-            elif p < 50: return 'Budget'
-            elif p < 150: return 'Mid-range'
-            elif p < 300: return 'Upper Mid-range'
-            else: return 'Luxury'
-        df['price_tier'] = df['price'].apply(price_tier)
+        df['price_tier'] = price_tiers(df['price'])
+
+    if 'amenities' in df.columns:
+        masks = amenity_masks(df['amenities'])
+        df['amenity_mask'] = masks[:, 0]
+        df['amenity_version'] = AMENITY_DICTIONARY_VERSION
+        for word, col in enumerate(AMENITY_MASK_COLUMNS[1:], start=1):
+            df[col] = masks[:, word]
+
+    return df
+
+
+def score_stats(df):
+    stats = {}
+    for col in score_columns(df.columns):
+        values = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        stats[col] = [float(values.sum()), int(values.count())]
+    return stats
+
+
+def merge_score_stats(*all_stats):
+    merged = {}
+    for stats in all_stats:
+        for col, (total, count) in (stats or {}).items():
+            prev = merged.get(col, [0.0, 0])
+            merged[col] = [prev[0] + total, prev[1] + count]
+    return merged
+
+
+def clean_frame(df, prior_stats=None, columns=None):
+    # prior_stats carries review-score sums/counts of data cleaned earlier
+    # (incremental mode), so fill values reflect the whole history.
+    # columns is incremental mode's output column list: every object gets
+    # all of them, in that order, empty or not.
+    if columns is None:
+        df = df.dropna(axis=1, how='all')
+    else:
+        df = df.reindex(columns=[col for col in columns if col not in DERIVED_COLUMNS])
+    df = df.drop_duplicates()
+    stats = score_stats(df)
+    merged = merge_score_stats(prior_stats, stats)
+    score_means = {col: total / count if count else np.nan
+                   for col, (total, count) in merged.items() if col in stats}
+    df = transform_rows(df, score_means)
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    return downcast_numerics(df), stats
+
+
+def clean_airbnb_data(df):
+    return clean_frame(df)[0]
+
+
+def read_frame(source, raw_columns, columns='used'):
+    df = pd.read_csv(source, low_memory=False,
+                     **column_options(raw_columns, columns), **READ_OPTIONS)
+    return downcast_numerics(normalize_columns(df))
+
+
+def stable_dtypes(df, kinds=None):
+    # Parquet files from different runs and chunks must agree on column types,
+    # so widen to int64/float64/string; Parquet encoding keeps them compact.
+    # kinds (from chunked pass 1) types the columns that were read as text.
+    kinds = kinds or {}
+    for col in df.columns:
+        kind = kinds.get(col)
+        if col in BOOLEAN_COLUMNS:
+            df[col] = df[col].astype('object').map(
+                lambda v: BOOLEAN_VALUES.get(str(v).strip().lower()) if pd.notna(v) else None)
+        elif pd.api.types.is_integer_dtype(df[col]) or kind == 'int':
+            df[col] = pd.to_numeric(df[col]).astype('int64')
+        elif pd.api.types.is_float_dtype(df[col]) or kind == 'float':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        else:
+            df[col] = df[col].astype('object').where(df[col].notna(), None)
+    return df
+
+
+def partition_path(values):
+    parts = []
+    for col, value in zip(PARTITION_COLUMNS, values):
+        value = NULL_PARTITION if pd.isna(value) else quote(str(value), safe=' -_.()$')
+        parts.append(f'{col}={value}/')
+    return ''.join(parts)
+
+
+def arrow_schema(df):
+    import pyarrow as pa
+    types = {'int64': pa.int64(), 'float64': pa.float64()}
+    return pa.schema([(col, pa.bool_() if col in BOOLEAN_COLUMNS else types.get(str(dtype), pa.string()))
+                      for col, dtype in df.dtypes.items()])
+
+
+def parquet_partitions(df, file_name, kinds=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = stable_dtypes(df, kinds)
+    # Explicit schema: a partition whose column is all-null must not be
+    # written with Arrow's null type.
+    schema = arrow_schema(df.drop(columns=PARTITION_COLUMNS))
+    for values, group in df.groupby(PARTITION_COLUMNS, dropna=False, sort=False):
+        key = output_prefix + partition_path(values) + file_name
+        table = pa.Table.from_pandas(group.drop(columns=PARTITION_COLUMNS),
+                                     schema=schema, preserve_index=False)
+        buffer = BytesIO()
+        pq.write_table(table, buffer, compression=PARQUET_COMPRESSION)
+        yield key, buffer.getvalue()
+
+
+def write_parquet_partitions(df, file_name, kinds=None):
+    keys = []
+    for key, body in parquet_partitions(df, file_name, kinds):
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+        keys.append(key)
+    return keys
+
+
+def list_keys(prefix):
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+
+def delete_keys(keys):
+    keys = sorted(keys)
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+
+
+def replace_output(new_keys):
+    # The crawler catalogs everything under output_prefix as one table, so
+    # files from the previous run (or the other format) are removed.
+    stale = set(list_keys(output_prefix)) - set(new_keys)
+    delete_keys(stale)
+    if stale:
+        print(f"[output] removed {len(stale)} stale objects under {output_prefix}")
+
+
+def run_file_name(part=0):
+    return f"part-{time.strftime('%Y%m%d%H%M%S')}-{part:05d}.{PARQUET_COMPRESSION}.parquet"
+
+
+def run_full(columns='used', output_format='csv'):
+    with pipeline_metrics.step('etl_read'):
+        raw_columns = read_header()
+        response = s3.get_object(Bucket=bucket, Key=input_key)
+        df = read_frame(response['Body'], raw_columns, columns)
+        pipeline_metrics.add(rows=len(df))
+    print(f"[read] {df.shape}, {df.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory")
+
+    with pipeline_metrics.step('etl_clean'):
+        df_clean = clean_airbnb_data(df)
+        pipeline_metrics.add(rows=len(df_clean))
+
+    with pipeline_metrics.step('etl_write'):
+        if output_format == 'parquet':
+            keys = write_parquet_partitions(df_clean, run_file_name())
+            print(f"[output] wrote {len(keys)} partition files under s3://{bucket}/{output_prefix}")
+        else:
+            buffer = StringIO()
+            df_clean.to_csv(buffer, index=False)
+            s3.put_object(Bucket=bucket, Key=output_key, Body=buffer.getvalue())
+            keys = [output_key]
+        pipeline_metrics.add(rows=len(df_clean))
+        replace_output(keys)
+    pipeline_metrics.add(rows=len(df_clean))
+
+
+class S3MultipartWriter:
+    # Buffers text and uploads it as multipart parts of at least part_size
+    # bytes, so the output never has to be held in memory as a whole.
+
+    def __init__(self, bucket_name, key, part_size=MIN_PART_SIZE):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.buffer = BytesIO()
+        self.parts = []
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+
+    def write(self, text):
+        self.buffer.write(text.encode('utf-8'))
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(Bucket=self.bucket_name, Key=self.key,
+                                  UploadId=self.upload_id, PartNumber=part_number,
+                                  Body=self.buffer.getvalue())
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = BytesIO()
+
+    def close(self):
+        if self.buffer.tell() or not self.parts:
+            self._upload_part()
+        s3.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                     UploadId=self.upload_id,
+                                     MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
 
+
+def read_chunks(chunk_size, usecols=None):
+    # Reads everything as text: dtypes then cannot drift between chunks and
+    # row hashes are comparable across the whole file.
+    response = s3.get_object(Bucket=bucket, Key=input_key)
+    reader = pd.read_csv(response['Body'], dtype=str, chunksize=chunk_size,
+                         usecols=usecols, **READ_OPTIONS)
+    for chunk in reader:
+        yield normalize_columns(chunk)
+
+
+def first_occurrences(hashes, seen):
+    # Marks rows whose hash is neither earlier in this chunk nor in seen, the
+    # hashes of previous chunks (drop_duplicates keep='first'). seen is a
+    # list of sorted runs. Only the chunk is sorted, and a run is merged into
+    # the one before it once that is at most twice its size, so there are
+    # O(log n) runs and each hash is merged O(log n) times.
+    order = np.argsort(hashes, kind='stable')
+    ordered = hashes[order]
+    first = np.ones(len(ordered), dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    for run in seen:
+        # Sorted keys keep the binary searches cache-friendly.
+        pos = np.minimum(np.searchsorted(run, ordered), len(run) - 1)
+        first &= run[pos] != ordered
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[order[first]] = True
+    seen.append(ordered[first])
+    while len(seen) > 1 and len(seen[-2]) <= 2 * len(seen[-1]):
+        # Two sorted runs; the stable sort merges them in linear time.
+        last = seen.pop()
+        seen[-1] = np.sort(np.concatenate([seen[-1], last]), kind='stable')
+    return keep, seen
+
+
+def chunk_kinds(chunk):
+    # Mirrors pandas inference on a whole file: int only when every value is
+    # an integer literal and none is missing, float when all parse as numbers.
+    kinds = {}
+    for col in chunk.columns:
+        present = chunk[col].notna()
+        values = pd.to_numeric(chunk[col], errors='coerce')
+        if values.notna().sum() < present.sum():
+            kinds[col] = 'str'
+        elif present.all() and chunk[col].str.fullmatch(r'[+-]?\d+').all():
+            kinds[col] = 'int'
+        else:
+            kinds[col] = 'float'
+    return kinds
+
+
+def merge_kinds(kinds, new):
+    order = ['int', 'float', 'str']
+    for col, kind in new.items():
+        old = kinds.get(col, kind)
+        kinds[col] = max(old, kind, key=order.index)
+    return kinds
+
+
+def collect_global_stats(chunk_size, usecols=None, infer_kinds=False):
+    # Pass 1: everything clean_airbnb_data needs from the whole file -
+    # non-empty columns, first occurrence of each row, and review-score
+    # means over the de-duplicated rows. Costs ~9 bytes per row.
+    # infer_kinds also records int/float/str per column for typed output.
+    non_null = None
+    kinds = {}
+    sums, counts = {}, {}
+    seen = []
+    keep_parts = []
+    for chunk in read_chunks(chunk_size, usecols):
+        counts_in_chunk = chunk.notna().sum()
+        non_null = counts_in_chunk if non_null is None else non_null + counts_in_chunk
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        keep, seen = first_occurrences(hashes, seen)
+        keep_parts.append(keep)
+        if infer_kinds:
+            merge_kinds(kinds, chunk_kinds(chunk))
+        for col in score_columns(chunk.columns):
+            values = pd.to_numeric(chunk.loc[keep, col], errors='coerce')
+            sums[col] = sums.get(col, 0.0) + values.sum()
+            counts[col] = counts.get(col, 0) + values.count()
+
+    keep_columns = non_null[non_null > 0].index.tolist() if non_null is not None else []
+    keep_rows = np.concatenate(keep_parts) if keep_parts else np.zeros(0, dtype=bool)
+    score_means = {col: sums[col] / counts[col] if counts[col] else np.nan
+                   for col in sums if col in keep_columns}
+    return keep_columns, keep_rows, score_means, kinds
+
+
+def clean_chunks(chunk_size, usecols, keep_columns, keep_rows, score_means):
+    offset = 0
+    for chunk in read_chunks(chunk_size, usecols):
+        mask = keep_rows[offset:offset + len(chunk)]
+        offset += len(chunk)
+        yield transform_rows(chunk.loc[mask, keep_columns].copy(), score_means)
+
+
+def run_chunked(chunk_size=DEFAULT_CHUNK_SIZE, columns='used', output_format='csv'):
+    usecols = column_options(read_header(), columns, compact=False)['usecols']
+    parquet = output_format == 'parquet'
+    with pipeline_metrics.step('etl_pass1'):
+        keep_columns, keep_rows, score_means, kinds = collect_global_stats(
+            chunk_size, usecols, infer_kinds=parquet)
+        pipeline_metrics.add(rows=len(keep_rows))
+    pipeline_metrics.add(rows=int(keep_rows.sum()))
+    print(f"[pass 1] {len(keep_rows)} rows, {int(keep_rows.sum())} unique, "
+          f"{len(keep_columns)} non-empty columns")
+
+    # Pass 2: re-stream the object, clean each chunk and upload as we go.
+    with pipeline_metrics.step('etl_pass2'):
+        chunks = clean_chunks(chunk_size, usecols, keep_columns, keep_rows, score_means)
+        if parquet:
+            keys = []
+            for part, chunk in enumerate(chunks):
+                keys.extend(write_parquet_partitions(chunk, run_file_name(part), kinds))
+                pipeline_metrics.add(rows=len(chunk))
+            print(f"[pass 2] wrote {len(keys)} partition files under s3://{bucket}/{output_prefix}")
+            replace_output(keys)
+            return
+
+        writer = S3MultipartWriter(bucket, output_key)
+        try:
+            first = True
+            for chunk in chunks:
+                writer.write(chunk.to_csv(index=False, header=first))
+                pipeline_metrics.add(rows=len(chunk))
+                first = False
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        print(f"[pass 2] wrote s3://{bucket}/{output_key} in {len(writer.parts)} parts")
+        replace_output([output_key])
+
+
+def load_manifest():
+    try:
+        response = s3.get_object(Bucket=bucket, Key=manifest_key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+
+def save_manifest(manifest):
+    s3.put_object(Bucket=bucket, Key=manifest_key,
+                  Body=json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def list_raw_objects(raw_prefix):
+    objects = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=raw_prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.startswith((output_prefix, os.path.dirname(manifest_key) + '/')):
+                continue
+            if key.lower().endswith('.csv'):
+                objects[key] = obj['ETag'].strip('"')
+    return objects
+
+
+def output_stem(key, etag):
+    return f"{os.path.splitext(os.path.basename(key))[0]}-{etag[:12]}"
+
+
+def output_columns(columns):
+    # Starting column list of an incremental manifest; --columns all learns
+    # it from the first object.
+    return ETL_COLUMNS + DERIVED_COLUMNS if columns == 'used' else []
+
+
+def extend_columns(output, source_columns):
+    # Append-only: Athena and Glue read CSV columns by position, so a column
+    # first seen in a later object goes last and the others never move.
+    new = [col for col in source_columns if col not in output]
+    if not output:
+        new += DERIVED_COLUMNS
+    output.extend(new)
+    return new
+
+
+def stale_kinds(entry, kinds):
+    # True when an object's outputs were typed before a later object widened
+    # one of their columns.
+    return any(kinds.get(col, kind) != kind for col, kind in entry.get('kinds', {}).items())
+
+
+def process_raw_object(key, etag, columns, output_format, prior_stats, schema):
+    # schema is the manifest's column list and kinds; both only grow. The
+    # return value's second item lists the columns this object widened.
+    response = s3.get_object(Bucket=bucket, Key=key)
+    df = read_frame(response['Body'], read_header(key), columns)
+    new_columns = extend_columns(schema['columns'], df.columns)
+    if new_columns and len(new_columns) < len(schema['columns']):
+        print(f"[manifest] {key} adds columns {new_columns}")
+    df_clean, stats = clean_frame(df, prior_stats, schema['columns'])
+
+    kinds = merge_kinds(dict(schema['kinds']), value_kinds(df_clean))
+    widened = [col for col in schema['kinds'] if kinds[col] != schema['kinds'][col]]
+    schema['kinds'] = kinds
+    df_clean = align_kinds(df_clean, kinds)
+
+    stem = output_stem(key, etag)
+    if output_format == 'parquet':
+        outputs = write_parquet_partitions(df_clean, f'{stem}.{PARQUET_COMPRESSION}.parquet', kinds)
+    else:
+        out_key = f'{output_prefix}{stem}.csv'
+        s3.put_object(Bucket=bucket, Key=out_key, Body=df_clean.to_csv(index=False).encode('utf-8'))
+        outputs = [out_key]
+    return {'etag': etag, 'outputs': outputs, 'rows': len(df_clean), 'score_stats': stats,
+            'kinds': {col: kinds[col] for col in df_clean.columns},
+            'processed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}, widened
+
+
+def run_incremental(raw_prefix='', columns='used', output_format='csv'):
+    manifest = load_manifest()
+    bootstrap = manifest is None
+    fresh = {'output_format': output_format, 'amenity_version': AMENITY_DICTIONARY_VERSION,
+             'column_mode': columns, 'columns': output_columns(columns), 'kinds': {}, 'objects': {}}
+    manifest = manifest or fresh
+    if manifest.get('output_format') != output_format:
+        print(f"[manifest] output format changed to {output_format}, reprocessing everything")
+        bootstrap = True
+        manifest = fresh
+    elif manifest.get('amenity_version') != AMENITY_DICTIONARY_VERSION:
+        # Earlier outputs carry no or fewer amenity bits.
+        print(f"[manifest] amenity dictionary is now v{AMENITY_DICTIONARY_VERSION}, reprocessing everything")
+        bootstrap = True
+        manifest = fresh
+    elif manifest.get('column_mode') != columns or 'kinds' not in manifest:
+        # Also manifests from before the column list was recorded, whose
+        # outputs each kept their own columns and types.
+        print(f"[manifest] columns {columns} have no recorded layout, reprocessing everything")
+        bootstrap = True
+        manifest = fresh
+    entries = manifest['objects']
+
+    current = list_raw_objects(raw_prefix)
+    changed = [key for key, etag in sorted(current.items())
+               if entries.get(key, {}).get('etag') != etag or stale_kinds(entries[key], manifest['kinds'])]
+    removed = [key for key in entries if key not in current]
+    print(f"[manifest] {len(current)} raw objects, {len(changed)} new or changed, {len(removed)} removed")
+
+    for key in removed:
+        delete_keys(entries.pop(key)['outputs'])
+
+    for i, key in enumerate(changed):
+        previous = entries.pop(key, None)
+        prior_stats = merge_score_stats(*(e['score_stats'] for e in entries.values()))
+        with pipeline_metrics.step('etl_object', Key=key):
+            entry, widened = process_raw_object(key, current[key], columns, output_format, prior_stats, manifest)
+            pipeline_metrics.add(rows=entry['rows'])
+        pipeline_metrics.add(rows=entry['rows'])
+        if previous:
+            delete_keys(set(previous['outputs']) - set(entry['outputs']))
+        entries[key] = entry
+        if widened:
+            # Rewrite the outputs typed before, so every file has one schema.
+            # A run that stops half way finds them again by stale_kinds.
+            redo = [k for k in sorted(entries)
+                    if stale_kinds(entries[k], manifest['kinds']) and k not in changed[i + 1:]]
+            print(f"[manifest] {key} widens {widened}, rewriting {len(redo)} earlier objects")
+            changed.extend(redo)
+        # Saved after every object so a failed run resumes where it stopped.
+        save_manifest(manifest)
+        print(f"[incremental] {key}: {entry['rows']} rows -> {len(entry['outputs'])} files")
+
+    if bootstrap:
+        # First run: drop outputs written by full/chunked runs.
+        replace_output([k for e in entries.values() for k in e['outputs']])
+    save_manifest(manifest)
+
+
+def value_kinds(df):
+    kinds = {}
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            kinds[col] = 'int'
+        elif pd.api.types.is_float_dtype(df[col]):
+            kinds[col] = 'float'
+        else:
+            kinds[col] = 'str'
+    return kinds
+
+
+def align_kinds(df, kinds):
+    # A column can parse as int in one file and as float or text in another;
+    # every output gets the widest kind seen across all files.
+    for col in df.columns:
+        kind = kinds.get(col)
+        if kind == 'float' and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype('float64')
+        elif kind == 'str' and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype('string')
     return df
 
-df_clean = clean_airbnb_data(df)
+
+def file_row_hashes(df):
+    # Row hashes comparable across files, which may parse a column as int in
+    # one and float in another, or lack it: numbers are hashed as float64,
+    # each column's hash is scaled by an odd hash of its name and missing
+    # cells count as 0, so column order and absent columns do not matter.
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for col in df.columns:
+        values = df[col]
+        values = values.astype('float64') if pd.api.types.is_numeric_dtype(values) else values.astype('object')
+        scale = pd.util.hash_array(np.array([col], dtype=object))[0] | np.uint64(1)
+        column = pd.util.hash_pandas_object(values, index=False).to_numpy() * scale
+        hashes += np.where(values.isna().to_numpy(), np.uint64(0), column)
+    return hashes
+
+
+def prepare_file(path, columns):
+    # Worker, pass 1: parse and de-duplicate one downloaded object, collect its
+    # share of the global statistics and spill the compact frame to disk.
+    # The row hashes let the parent drop rows already in earlier files.
+    raw_columns = pd.read_csv(path, nrows=0, encoding=READ_OPTIONS['encoding']).columns.tolist()
+    df = read_frame(path, raw_columns, columns)
+    rows_read = len(df)
+    df = df.drop_duplicates()
+    result = {'rows_read': rows_read, 'rows': len(df), 'columns': df.columns.tolist(),
+              'non_null': df.notna().sum().to_dict(), 'score_stats': score_stats(df),
+              'hashes': file_row_hashes(df), 'keep': None}
+    # Derived columns are added once, in pass 2.
+    df = downcast_numerics(transform_rows(df, {}, derived=False))
+    result['kinds'] = value_kinds(df)
+    result['spill'] = path + '.pkl'
+    df.to_pickle(result['spill'])
+    os.remove(path)
+    return result
+
+
+def kept_score_stats(spill_path, keep):
+    # Worker: review-score sums/counts of a file without the rows that an
+    # earlier file already had.
+    return score_stats(pd.read_pickle(spill_path)[keep])
+
+
+def finish_file(spill_path, stem, keep_columns, score_means, kinds, output_format, keep=None):
+    # Worker, pass 2: apply the merged statistics and write the outputs to
+    # local files for the parent to upload.
+    df = pd.read_pickle(spill_path)
+    os.remove(spill_path)
+    if keep is not None:
+        df = df[keep]
+    df = df.reindex(columns=keep_columns)
+    df = align_kinds(downcast_numerics(transform_rows(df, score_means)), kinds)
+    if output_format == 'parquet':
+        outputs = []
+        file_name = f'{stem}.{PARQUET_COMPRESSION}.parquet'
+        for n, (key, body) in enumerate(parquet_partitions(df, file_name, kinds)):
+            path = f'{spill_path}.{n}.parquet'
+            with open(path, 'wb') as f:
+                f.write(body)
+            outputs.append((key, path))
+        return outputs
+    path = spill_path + '.csv'
+    df.to_csv(path, index=False)
+    return [(f'{output_prefix}{stem}.csv', path)]
+
+
+def download_raw(key, path):
+    s3.download_file(bucket, key, path)
+    return path
+
+
+def upload_output(key, path):
+    s3.upload_file(path, bucket, key)
+    os.remove(path)
+    return key
+
+
+def drop_repeated_rows(pool, results):
+    # Keeps the first occurrence of every row across all files, in key order,
+    # as full mode does over the concatenated files. Files that lose rows get
+    # their review-score stats recounted by a worker.
+    seen = []
+    recount = {}
+    for result in results:
+        keep, seen = first_occurrences(result.pop('hashes'), seen)
+        if not keep.all():
+            result['keep'], result['rows'] = keep, int(keep.sum())
+            recount[id(result)] = pool.submit(kept_score_stats, result['spill'], keep)
+    for result in results:
+        if id(result) in recount:
+            result['score_stats'] = recount[id(result)].result()
+    return results
+
+
+def merge_file_stats(results):
+    non_null = {}
+    kinds = {}
+    for result in results:
+        for col, count in result['non_null'].items():
+            non_null[col] = non_null.get(col, 0) + count
+        merge_kinds(kinds, result['kinds'])
+    column_order = list(dict.fromkeys(col for result in results for col in result['columns']))
+    keep_columns = [col for col in column_order if non_null.get(col)]
+    for col in keep_columns:
+        # Files without the column contribute nulls, which int cannot hold.
+        if kinds.get(col) == 'int' and any(col not in r['columns'] for r in results):
+            kinds[col] = 'float'
+    stats = merge_score_stats(*(result['score_stats'] for result in results))
+    score_means = {col: total / count if count else np.nan
+                   for col, (total, count) in stats.items() if col in keep_columns}
+    return keep_columns, score_means, kinds
+
+
+def run_parallel(raw_prefix='', columns='used', output_format='csv', workers=0):
+    workers = workers or os.cpu_count() or 1
+    objects = list_raw_objects(raw_prefix)
+    keys = sorted(objects)
+    print(f"[parallel] {len(keys)} raw objects, {workers} workers")
+    work_dir = tempfile.mkdtemp(prefix='etl-', dir=WORK_DIR)
+    try:
+        # spawn: the parent is running download threads when workers start.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool, \
+                ThreadPoolExecutor(DOWNLOAD_THREADS) as io_pool:
+            # Pass 1: each object goes to the pool as soon as it is on disk,
+            # so later downloads overlap with parsing the earlier ones.
+            with pipeline_metrics.step('etl_pass1', Workers=workers):
+                downloads = {io_pool.submit(download_raw, key, os.path.join(work_dir, f'{i:05d}.csv')): key
+                             for i, key in enumerate(keys)}
+                prepared = {}
+                for done in as_completed(downloads):
+                    prepared[downloads[done]] = pool.submit(prepare_file, done.result(), columns)
+                results = {key: prepared[key].result() for key in keys}
+                pipeline_metrics.add(rows=sum(r['rows_read'] for r in results.values()))
+
+            keep_columns, score_means, kinds = merge_file_stats(
+                drop_repeated_rows(pool, [results[key] for key in keys]))
+            print(f"[pass 1] {sum(r['rows_read'] for r in results.values())} rows, "
+                  f"{sum(r['rows'] for r in results.values())} unique, "
+                  f"{len(keep_columns)} non-empty columns")
+
+            # Pass 2: uploads start as soon as each worker finishes a file.
+            with pipeline_metrics.step('etl_pass2', Workers=workers):
+                finished = [pool.submit(finish_file, results[key]['spill'], output_stem(key, objects[key]),
+                                        keep_columns, score_means, kinds, output_format,
+                                        results[key]['keep'])
+                            for key in keys]
+                uploads = []
+                for done in as_completed(finished):
+                    uploads.extend(io_pool.submit(upload_output, key, path) for key, path in done.result())
+                new_keys = [upload.result() for upload in uploads]
+                pipeline_metrics.add(rows=sum(r['rows'] for r in results.values()))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"[pass 2] wrote {len(new_keys)} files under s3://{bucket}/{output_prefix}")
+    replace_output(new_keys)
+    pipeline_metrics.add(rows=sum(r['rows'] for r in results.values()))
+
+
+def save_amenity_dictionary():
+    s3.put_object(Bucket=bucket, Key=amenity_dictionary_key, Body=json.dumps(
+        {'version': AMENITY_DICTIONARY_VERSION, 'amenities': AMENITY_DICTIONARY}, indent=1).encode('utf-8'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['full', 'chunked', 'incremental', 'parallel'], default='full')
+    parser.add_argument('--raw_prefix', default='')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--columns', choices=['used', 'all'], default='used')
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default='csv')
+    # Step Functions execution name, passed on by 11_ETL_job.py.
+    parser.add_argument('--run_id', default='')
+    # Glue adds its own arguments (--job-bookmark-option, ...); ignore them.
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    with pipeline_metrics.step('etl_job', args.run_id or None, Mode=args.mode, OutputFormat=args.output_format):
+        if args.mode == 'parallel':
+            run_parallel(args.raw_prefix, args.columns, args.output_format, args.workers)
+        elif args.mode == 'incremental':
+            run_incremental(args.raw_prefix, args.columns, args.output_format)
+        elif args.mode == 'chunked':
+            run_chunked(args.chunk_size, args.columns, args.output_format)
+        else:
+            run_full(args.columns, args.output_format)
+        # After the outputs, so the feature query never sees bits the data lacks.
+        save_amenity_dictionary()
 
 
-buffer = StringIO()
-df_clean.to_csv(buffer, index=False)
-s3.put_object(Bucket=bucket, Key=output_key, Body=buffer.getvalue())
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from bench_query_backend import generate
+from amenity_features import feature_columns
+from etl_job import AMENITY_DICTIONARY, AMENITY_DICTIONARY_VERSION
+from query_backend import TABLE_LOCATIONS, DuckDBQueryRunner, LocalBucketStore
+
+# The has_* flags of the ML feature query computed with the old LIKE scans
+# over the amenities text and with bit tests on amenity_mask, on the
+# synthetic processed tables of bench_query_backend.py. Only the flags are
+# summed, so the time is not hidden behind writing ml_data.csv. For Parquet
+# it also prints the compressed bytes of the column each variant reads,
+# which is what Athena bills.
+#   python bench_amenity_mask.py --rows 1000000 10000000
+
+
+def flags_query(dictionary):
+    columns = ',\n    '.join(feature_columns(dictionary))
+    features = [column.rsplit(' AS ', 1)[1] for column in feature_columns(dictionary)]
+    return (f"SELECT {', '.join(f'sum({f}) AS {f}' for f in features)} FROM (\n"
+            f"SELECT\n    {columns}\nFROM processed\nWHERE price > 15 AND price IS NOT NULL)")
+
+
+def column_bytes(path, column):
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            meta = pq.ParquetFile(os.path.join(dirpath, name)).metadata
+            names = meta.schema.names
+            for i in range(meta.num_row_groups):
+                total += meta.row_group(i).column(names.index(column)).total_compressed_size
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'parquet'], default=['csv', 'parquet'])
+    parser.add_argument('--data_dir', default=os.path.join(tempfile.gettempdir(), 'bench_query_backend'))
+    args = parser.parse_args()
+
+    dictionary = {'version': AMENITY_DICTIONARY_VERSION, 'amenities': AMENITY_DICTIONARY}
+    variants = {'LIKE': (flags_query(None), 'amenities'),
+                'amenity_mask': (flags_query(dictionary), 'amenity_mask')}
+
+    print(f"{'rows':>11} {'format':>8} {'variant':>13} {'seconds':>8} {'column MB':>10}")
+    for rows in args.rows:
+        for output_format in args.formats:
+            root = os.path.join(args.data_dir, f'{rows}-{output_format}')
+            generate(root, rows, output_format)
+            store = LocalBucketStore(root)
+            runner = DuckDBQueryRunner(store)
+            results = {}
+            for name, (sql, column) in variants.items():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = runner.run(sql, 'data_db', 's3://myresult-sc171/bench/', label=name)
+                if stats['state'] != 'SUCCEEDED':
+                    raise SystemExit(f"{name} failed: {stats['state_change_reason']}")
+                result_path = store.path(*stats['output_location'][len('s3://'):].split('/', 1))
+                with open(result_path) as f:
+                    results[name] = f.read()
+                shutil.rmtree(store.path('myresult-sc171', 'bench/'))
+                size = (f"{column_bytes(store.path(*TABLE_LOCATIONS['processed']), column) / 1e6:>10.1f}"
+                        if output_format == 'parquet' else f"{'-':>10}")
+                print(f"{rows:>11,} {output_format:>8} {name:>13} {stats['wall_ms'] / 1000:>8.2f} {size}")
+            if results['LIKE'] != results['amenity_mask']:
+                raise SystemExit("flag counts differ between LIKE and amenity_mask")
+
+
+if __name__ == '__main__':
+    main()
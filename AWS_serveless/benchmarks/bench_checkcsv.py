@@ -0,0 +1,148 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Cold start and warm latency of 6_checkcsv.py with the old pandas check
+# (whole object downloaded and parsed) and with csv_check (one ranged GET of
+# the head). Each cold start is a fresh interpreter that imports the
+# handler, creates its boto3 client and runs one invocation; S3 is a local
+# stand-in that sleeps --first_byte_ms per request plus transfer time at
+# --mbps, so the download size shows up in the timings.
+#   python bench_checkcsv.py --rows 12 100000 --runs 5
+
+LAMBDA_CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_code')
+
+# 6_checkcsv.py before csv_check.
+LEGACY_HANDLER = '''
+import json
+import boto3
+import pandas as pd
+import io
+
+s3 = boto3.client('s3')
+
+FIXED_OUTPUT_BUCKET = 'myresult-sc171'
+FIXED_TARGET_KEY = 'property_insights.csv'
+
+def lambda_handler(event, context):
+    is_empty_flag = True
+
+    try:
+        response = s3.get_object(Bucket=FIXED_OUTPUT_BUCKET, Key=FIXED_TARGET_KEY)
+        content = response['Body'].read()
+        df = pd.read_csv(io.BytesIO(content))
+        if not df.empty and df.shape[0] > 1:
+            is_empty_flag = False
+    except s3.exceptions.NoSuchKey:
+        print(f"File not found: s3://{FIXED_OUTPUT_BUCKET}/{FIXED_TARGET_KEY}")
+    except Exception as e:
+        print(f"Error processing file: {str(e)}")
+
+    result = {
+        "csvIsEmpty": is_empty_flag,
+        "bucket": FIXED_OUTPUT_BUCKET,
+        "key": FIXED_TARGET_KEY
+    }
+    print("Lambda output:", json.dumps(result))
+    return result
+'''
+
+
+class SimulatedS3:
+    # Serves one local file as every object.
+
+    class exceptions:
+        NoSuchKey = KeyError
+
+    def __init__(self, path, first_byte_ms, mbps):
+        self.path = path
+        self.first_byte_ms = first_byte_ms
+        self.mbps = mbps
+
+    def _wait(self, size):
+        time.sleep(self.first_byte_ms / 1000 + size / (self.mbps * 1e6))
+
+    def get_object(self, Bucket, Key, Range=None):
+        with open(self.path, 'rb') as f:
+            body = f.read()
+        response = {'ETag': '"bench"'}
+        if Range:
+            start, end = (int(i) for i in Range.split('=')[1].split('-'))
+            end = min(end, len(body) - 1)
+            response['ContentRange'] = f'bytes {start}-{end}/{len(body)}'
+            body = body[start:end + 1]
+        self._wait(len(body))
+        return dict(response, Body=io.BytesIO(body))
+
+
+# Runs in the fresh interpreter: argv = module, csv path, first_byte_ms, mbps, warm calls.
+CHILD = '''
+import time
+started = time.perf_counter()
+import contextlib, importlib, io, json, resource, statistics, sys
+module, path, first_byte_ms, mbps, warm = sys.argv[1], sys.argv[2], float(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5])
+handler = importlib.import_module(module)
+imported = time.perf_counter()
+from bench_checkcsv import SimulatedS3
+handler.s3 = SimulatedS3(path, first_byte_ms, mbps)
+with contextlib.redirect_stdout(io.StringIO()):
+    result = handler.lambda_handler({}, None)
+    cold = time.perf_counter()
+    times = []
+    for _ in range(warm):
+        t = time.perf_counter()
+        handler.lambda_handler({}, None)
+        times.append(time.perf_counter() - t)
+print(json.dumps({'import_ms': (imported - started) * 1000, 'cold_ms': (cold - started) * 1000,
+                  'warm_ms': statistics.median(times) * 1000, 'empty': result['csvIsEmpty'],
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def report_csv(path, rows):
+    # property_insights.csv as athena_reports writes it.
+    with open(path, 'w') as f:
+        f.write('"property_type","number_of_listings","avg_accuracy","avg_communication","avg_location","avg_value"\n')
+        for i in range(rows):
+            f.write(f'"Type {i}","{100000 - i}","9.{i % 10}1234567","9.2345678","9.3456789","9.4567891"\n')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[12, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warm', type=int, default=20)
+    parser.add_argument('--first_byte_ms', type=float, default=15)
+    parser.add_argument('--mbps', type=float, default=80)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='bench-checkcsv-')
+    with open(os.path.join(work, 'legacy_checkcsv.py'), 'w') as f:
+        f.write(LEGACY_HANDLER)
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1', PYTHONDONTWRITEBYTECODE='1',
+               PYTHONPATH=os.pathsep.join([work, LAMBDA_CODE, os.path.dirname(os.path.abspath(__file__))]))
+
+    print(f"{'handler':<10} {'rows':>7} {'KB':>8} {'import ms':>10} {'cold ms':>9} {'warm ms':>9} {'RSS MB':>8} empty")
+    for rows in args.rows:
+        path = os.path.join(work, f'report-{rows}.csv')
+        report_csv(path, rows)
+        for name, module in (('pandas', 'legacy_checkcsv'), ('csv_check', '6_checkcsv')):
+            runs = []
+            for _ in range(args.runs):
+                out = subprocess.run([sys.executable, '-c', CHILD, module, path, str(args.first_byte_ms),
+                                      str(args.mbps), str(args.warm)],
+                                     env=env, capture_output=True, text=True, check=True)
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            med = {k: statistics.median(r[k] for r in runs) for k in ('import_ms', 'cold_ms', 'warm_ms', 'rss_mb')}
+            print(f"{name:<10} {rows:>7} {os.path.getsize(path) / 1024:>8.1f} {med['import_ms']:>10.0f} "
+                  f"{med['cold_ms']:>9.0f} {med['warm_ms']:>9.1f} {med['rss_mb']:>8.0f} {runs[0]['empty']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Wall time and peak RSS of read + clean_airbnb_data before and after the
+# vectorized, dtype-compact engine. Each variant runs in its own process so
+# peak RSS is not shared.
+#   python bench_etl_clean.py --rows 1000000
+
+
+def legacy_clean(df):
+    # clean_airbnb_data as it was before the rework.
+    df = df.dropna(axis=1, how='all')
+    df = df.drop_duplicates()
+    if 'price' in df.columns:
+        df['price'] = pd.to_numeric(df['price'], errors='coerce')
+
+    score_cols = [col for col in df.columns if 'review_scores' in col]
+    for col in score_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+        df[col] = df[col].fillna(df[col].mean())
+
+    if 'price' in df.columns:
+        def price_tier(p):
+            if pd.isna(p): return 'Unknown'
+            elif p < 50: return 'Budget'
+            elif p < 150: return 'Mid-range'
+            elif p < 300: return 'Upper Mid-range'
+            else: return 'Luxury'
+        df['price_tier'] = df['price'].apply(price_tier)
+
+    return df
+
+
+def run_variant(variant, path):
+    import etl_job
+
+    start = time.perf_counter()
+    if variant == 'before':
+        df = pd.read_csv(path, low_memory=False, **etl_job.READ_OPTIONS)
+        df = etl_job.normalize_columns(df)
+        read_done = time.perf_counter()
+        df = legacy_clean(df)
+    else:
+        raw_columns = pd.read_csv(path, nrows=0, encoding='latin1').columns.tolist()
+        df = etl_job.read_frame(path, raw_columns)
+        read_done = time.perf_counter()
+        df = etl_job.clean_airbnb_data(df)
+    end = time.perf_counter()
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    frame_mb = df.memory_usage(deep=True).sum() / 1e6
+    print(f"{variant},{read_done - start:.2f},{end - read_done:.2f},{end - start:.2f},"
+          f"{peak_mb:.0f},{frame_mb:.0f},{df.shape[0]},{df.shape[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--input', help='existing raw CSV; generated when omitted')
+    parser.add_argument('--run', choices=['before', 'after'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_variant(args.run, args.input)
+        return
+
+    path = args.input
+    if not path:
+        from synthetic_airbnb import write_raw_csv
+        path = os.path.join(tempfile.gettempdir(), f'airbnb_raw_{args.rows}.csv')
+        if not os.path.exists(path):
+            print(f"generating {args.rows} rows -> {path}")
+            write_raw_csv(path, args.rows)
+    print(f"input: {path} ({os.path.getsize(path) / 1e6:.0f} MB)\n")
+
+    print(f"{'variant':<8} {'read s':>8} {'clean s':>8} {'total s':>8} {'peak RSS MB':>12} "
+          f"{'frame MB':>9} {'rows':>9} {'cols':>5}")
+    results = {}
+    for variant in ('before', 'after'):
+        out = subprocess.run([sys.executable, __file__, '--run', variant, '--input', path],
+                             check=True, capture_output=True, text=True).stdout
+        fields = out.strip().splitlines()[-1].split(',')
+        results[variant] = fields
+        print(f"{fields[0]:<8} {fields[1]:>8} {fields[2]:>8} {fields[3]:>8} {fields[4]:>12} "
+              f"{fields[5]:>9} {fields[6]:>9} {fields[7]:>5}")
+
+    before, after = results['before'], results['after']
+    print(f"\nspeedup {float(before[3]) / float(after[3]):.1f}x, "
+          f"peak RSS {float(after[4]) / float(before[4]) * 100:.0f}% of before")
+
+
+if __name__ == '__main__':
+    main()
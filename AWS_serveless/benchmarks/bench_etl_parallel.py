@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Throughput of etl_job --mode parallel for 1, 2, 4 and 8 workers over a
+# prefix of synthetic daily drops. S3 is replaced by a local directory;
+# --download_mbps throttles downloads to show them overlapping with parsing.
+# --overlap repeats that many rows of each drop in the next one, and --check
+# compares the first run's output with full mode over the concatenated files.
+#   python bench_etl_parallel.py --files 16 --rows 200000 --download_mbps 100
+#   python bench_etl_parallel.py --files 4 --rows 20000 --overlap 2000 --workers 2 --check
+
+
+class LocalBucket:
+    # The handful of S3 client calls run_parallel makes, over a directory.
+
+    def __init__(self, root, download_mbps=0):
+        self.root = root
+        self.download_mbps = download_mbps
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        contents = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    stat = os.stat(path)
+                    contents.append({'Key': key, 'ETag': f'"{stat.st_mtime_ns:x}{stat.st_size:x}"',
+                                     'Size': stat.st_size})
+        yield {'Contents': sorted(contents, key=lambda obj: obj['Key'])}
+
+    def download_file(self, bucket, key, path):
+        start = time.perf_counter()
+        shutil.copyfile(self._path(key), path)
+        if self.download_mbps:
+            budget = os.path.getsize(path) / (self.download_mbps * 1e6)
+            time.sleep(max(0.0, budget - (time.perf_counter() - start)))
+
+    def upload_file(self, path, bucket, key):
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        shutil.copyfile(path, self._path(key))
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            os.remove(self._path(obj['Key']))
+
+
+def repeat_rows(prev_path, path, rows):
+    # The next daily drop starts with the last rows of the previous one.
+    with open(prev_path, 'rb') as f:
+        tail = f.read().splitlines(keepends=True)[-rows:]
+    with open(path, 'ab') as f:
+        f.writelines(tail)
+
+
+def same_as_full(etl_job, root):
+    # Row count and review-score means of the parallel outputs against
+    # clean_airbnb_data over the concatenated drops.
+    daily = sorted(os.path.join(root, 'daily', name) for name in os.listdir(os.path.join(root, 'daily')))
+    combined = os.path.join(root, 'combined.csv')
+    with open(combined, 'wb') as out:
+        for i, path in enumerate(daily):
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+            out.writelines(lines if i == 0 else lines[1:])
+    raw_columns = pd.read_csv(combined, nrows=0, encoding='latin1').columns.tolist()
+    full = etl_job.clean_airbnb_data(etl_job.read_frame(combined, raw_columns))
+    os.remove(combined)
+    processed = os.path.join(root, etl_job.output_prefix)
+    parallel = pd.concat([pd.read_csv(os.path.join(processed, name)) for name in sorted(os.listdir(processed))],
+                         ignore_index=True)
+    scores = etl_job.score_columns(full.columns)
+    print(f"full {len(full)} rows, parallel {len(parallel)} rows")
+    return len(full) == len(parallel) and np.allclose(
+        full[scores].astype('float64').mean(), parallel[scores].mean())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--rows', type=int, default=200000, help='rows per file')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--download_mbps', type=float, default=0)
+    parser.add_argument('--output_format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--overlap', type=int, default=0, help='rows of each drop repeated in the next')
+    parser.add_argument('--check', action='store_true', help='compare with full mode (csv output)')
+    args = parser.parse_args()
+
+    import etl_job
+    from synthetic_airbnb import write_raw_csv
+
+    root = tempfile.mkdtemp(prefix='bench-etl-parallel-')
+    try:
+        for i in range(args.files):
+            path = os.path.join(root, 'daily', f'2026-01-{i + 1:02d}.csv')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_raw_csv(path, args.rows, seed=i)
+            if args.overlap and i:
+                repeat_rows(os.path.join(root, 'daily', f'2026-01-{i:02d}.csv'), path, args.overlap)
+        total_mb = sum(os.path.getsize(os.path.join(root, 'daily', name))
+                       for name in os.listdir(os.path.join(root, 'daily'))) / 1e6
+        print(f"{args.files} files x {args.rows} rows, {total_mb:.0f} MB, "
+              f"{os.cpu_count()} cores, download {args.download_mbps or 'unthrottled'} MB/s\n")
+
+        etl_job.s3 = LocalBucket(root, args.download_mbps)
+        print(f"{'workers':>7} {'wall s':>8} {'rows/s':>10} {'MB/s':>7} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                etl_job.run_parallel('daily/', output_format=args.output_format, workers=workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            rows = args.files * args.rows / elapsed
+            print(f"{workers:>7} {elapsed:>8.2f} {rows:>10.0f} {total_mb / elapsed:>7.1f} "
+                  f"{baseline / elapsed:>7.2f}x", flush=True)
+            if args.check and workers == args.workers[0]:
+                same = same_as_full(etl_job, root)
+                print(f"same rows and score means as full mode: {same}")
+                if not same:
+                    raise SystemExit(1)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ['QUERY_BACKEND'] = 'duckdb'
+
+# Exports the ML training set from a synthetic processed table with
+# 2_get_output on the local DuckDB backend, once as ml_data.csv and once as
+# the typed Parquet export, then compares the bytes SageMaker downloads and
+# how long ml_code.py's Step 1 takes to load each.
+#   python bench_ml_export.py --rows 1000000
+
+
+def load_seconds(read, path, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df = read(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return df, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--data_dir', default=os.path.join(tempfile.gettempdir(), 'bench_ml_export'))
+    args = parser.parse_args()
+
+    root = os.path.join(args.data_dir, str(args.rows))
+    os.environ['LOCAL_DATA_ROOT'] = root
+    from bench_query_backend import generate
+    generate(root, args.rows, 'parquet')
+
+    handler = importlib.import_module('2_get_output')
+    with contextlib.redirect_stdout(io.StringIO()):
+        csv_result = handler.lambda_handler({'export_format': 'csv', 'refresh_cache': True}, None)
+        parquet_result = handler.lambda_handler({'export_format': 'parquet', 'refresh_cache': True}, None)
+    if csv_result['statusCode'] != 200 or parquet_result['statusCode'] != 200:
+        raise SystemExit(f"export failed: {csv_result} {parquet_result}")
+
+    csv_path = handler.s3.path('myresult-sc171', 'ml_data.csv')
+    parquet_path = handler.s3.path('myresult-sc171', handler.PARQUET_PREFIX)
+    csv_bytes = os.path.getsize(csv_path)
+    parquet_bytes = sum(os.path.getsize(os.path.join(parquet_path, name)) for name in os.listdir(parquet_path))
+
+    csv_df, csv_s = load_seconds(pd.read_csv, csv_path)
+    parquet_df, parquet_s = load_seconds(pd.read_parquet, parquet_path)
+
+    print(f"{'format':<8} {'rows':>10} {'MB':>8} {'load s':>8} {'memory MB':>10}")
+    for name, df, size, seconds in (('csv', csv_df, csv_bytes, csv_s),
+                                    ('parquet', parquet_df, parquet_bytes, parquet_s)):
+        memory = df.memory_usage(deep=True).sum() / 1e6
+        print(f"{name:<8} {len(df):>10} {size / 1e6:>8.1f} {seconds:>8.2f} {memory:>10.1f}")
+
+    print("\ncolumn types")
+    for col in parquet_df.columns:
+        print(f"  {col:<16} csv {str(csv_df[col].dtype):<8} parquet {parquet_df[col].dtype}")
+
+    key = list(parquet_df.columns)
+    same = (csv_df.sort_values(key).reset_index(drop=True)
+            .equals(parquet_df.astype(csv_df.dtypes.to_dict()).sort_values(key).reset_index(drop=True)))
+    print(f"\nsame rows: {same}")
+    if not same:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
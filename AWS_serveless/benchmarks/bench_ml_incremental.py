@@ -0,0 +1,144 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'machine_learning_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from bench_ml_preprocess import write_ml_data
+
+# Wall time and RMSE of ml_code.py's mode "incremental" against a full
+# retrain, on a synthetic history plus a batch of new rows whose prices have
+# risen a little. The previous model is a full training on the history,
+# saved with its training_state.pkl the way the job leaves it. Both models
+# are scored on the same held-out rows drawn like the batch. A second batch
+# with a larger price rise must fall back to a full retrain, and small
+# batches drawn like the history must not (--draws samples per size).
+#   python bench_ml_incremental.py --rows 500000 --new-rows 50000
+
+
+def synthetic(rows, seed, price_factor=1.0):
+    import ml_code
+    path = os.path.join(tempfile.gettempdir(), f'ml_data_{rows}_{seed}.csv')
+    if not os.path.exists(path):
+        write_ml_data(path, rows, seed)
+    columns = pd.read_csv(path, nrows=0).columns
+    df = pd.read_csv(path, dtype=ml_code.compact_dtypes(columns))
+    df[ml_code.TARGET_COL] = (df[ml_code.TARGET_COL] * price_factor).round(2)
+    return df
+
+
+def combined(*frames):
+    import ml_code
+    df = pd.concat(frames, ignore_index=True)
+    return df.astype(ml_code.compact_dtypes(df.columns))
+
+
+def split(df):
+    import ml_code
+    return df.drop(columns=[ml_code.TARGET_COL]), df[ml_code.TARGET_COL]
+
+
+def rmse(model, X, y):
+    return float(np.sqrt(np.mean((model.predict(X) - y) ** 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--new-rows', type=int, default=50000)
+    parser.add_argument('--rise', type=float, default=1.05, help='price factor of the new rows')
+    parser.add_argument('--drift', type=float, default=1.5, help='price factor of the drifted batch')
+    parser.add_argument('--draws', type=int, default=20)
+    args = parser.parse_args()
+
+    import ml_code
+    from sklearn.model_selection import train_test_split
+    hyperparameters = ml_code.hyperparameters
+
+    history = synthetic(args.rows, 0)
+    batch = synthetic(args.new_rows, 1, args.rise)
+    X_holdout, y_holdout = split(synthetic(args.new_rows, 2, args.rise))
+    print(f"{len(history)} rows of history, {len(batch)} new rows, "
+          f"held-out rows priced x{args.rise}\n")
+
+    # The previous job: a full training on the history.
+    X, y = split(history)
+    X_train, X_test, y_train, _ = train_test_split(
+        X, y, test_size=hyperparameters['test_size'], random_state=hyperparameters['random_state'])
+    previous = ml_code.build_pipeline(X, hyperparameters).fit(X_train, y_train)
+    ml_code.previous_path = tempfile.mkdtemp(prefix='previous_')
+    joblib.dump(previous, os.path.join(ml_code.previous_path, os.path.basename(ml_code.output_path)))
+    state_file = os.path.join(ml_code.previous_path, os.path.basename(ml_code.state_path))
+    hashes = ml_code.row_hashes(history)
+    joblib.dump(ml_code.training_state(X, y, hashes[X.index.get_indexer(X_train.index)],
+                                       held_out=hashes[X.index.get_indexer(X_test.index)]), state_file)
+
+    df = combined(history, batch)
+    X, y = split(df)
+    results = [('previous', None, rmse(previous, X_holdout, y_holdout))]
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        model, _, _, _, reason = ml_code.incremental_update(X, y, ml_code.row_hashes(df), hyperparameters)
+    if reason:
+        raise SystemExit(f"incremental run fell back to a full retrain: {reason}")
+    results.append(('incremental', time.perf_counter() - started, rmse(model, X_holdout, y_holdout)))
+
+    started = time.perf_counter()
+    X_train, _, y_train, _ = train_test_split(
+        X, y, test_size=hyperparameters['test_size'], random_state=hyperparameters['random_state'])
+    model = ml_code.build_pipeline(X, hyperparameters).fit(X_train, y_train)
+    results.append(('full retrain', time.perf_counter() - started, rmse(model, X_holdout, y_holdout)))
+
+    print(f"{'variant':<13} {'wall s':>8} {'held-out RMSE':>14}")
+    for name, seconds, score in results:
+        wall = f"{seconds:.2f}" if seconds is not None else '-'
+        print(f"{name:<13} {wall:>8} {score:>14.2f}")
+    print(f"\nincremental {results[2][1] / results[1][1]:.1f}x faster than the full retrain")
+
+    df = combined(history, synthetic(args.new_rows, 3, args.drift))
+    X, y = split(df)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model, _, _, _, reason = ml_code.incremental_update(X, y, ml_code.row_hashes(df), hyperparameters)
+    print(f"batch priced x{args.drift}: {reason or 'extended'}")
+    if not reason:
+        raise SystemExit(1)
+
+    # Small batches from the history's distribution (new rows, new seed),
+    # with the held-out history trained on as well, as after a later run;
+    # otherwise those rows would be part of every batch.
+    X, y = split(history)
+    state = ml_code.training_state(X, y, hashes)
+    joblib.dump(state, state_file)
+    fresh = synthetic(args.new_rows, 4)
+    print(f"\n{'new rows':>8} {'draws':>6} {'drift':>6} {'full retrain':>13}")
+    false_alarms = 0
+    for size in (5, 20, 60, 150, 500, 2000):
+        drifts = retrains = 0
+        for draw in range(args.draws):
+            sample = fresh.sample(size, random_state=draw)
+            X_new, y_new = split(sample)
+            drifts += bool(ml_code.drift_reason(state['reference'], X_new, y_new,
+                                                hyperparameters['rare_threshold']))
+            df = combined(history, sample)
+            X, y = split(df)
+            with contextlib.redirect_stdout(io.StringIO()):
+                reason = ml_code.incremental_update(X, y, ml_code.row_hashes(df), hyperparameters)[-1]
+            retrains += bool(reason)
+        false_alarms += retrains
+        print(f"{size:>8} {args.draws:>6} {drifts:>6} {retrains:>13}")
+    if false_alarms:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
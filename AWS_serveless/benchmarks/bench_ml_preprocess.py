@@ -0,0 +1,172 @@
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'machine_learning_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from amenity_features import AMENITY_FEATURES
+from synthetic_airbnb import CITIES, ROOM_TYPES
+
+# Load + preprocessing time and peak RSS of ml_code.py on a synthetic
+# ml_data.csv, before (object/int64 columns, compress_rare_categories with
+# Series.apply) and after (category/int8 columns, rare categories left out
+# of the encoder). Preprocessing is fitting and applying the pipeline's
+# ColumnTransformer, without the regressor. Each variant runs in its own
+# process so peak RSS is not shared.
+#   python bench_ml_preprocess.py --rows 5000000
+
+# A long tail of small towns below the 1% rare threshold, and one rare room type.
+TOWNS = [f'Town {i}' for i in range(400)]
+
+
+def write_ml_data(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    towns = rng.random(rows) < 0.1
+    city = np.where(towns, np.array(TOWNS, dtype=object)[rng.integers(0, len(TOWNS), rows)],
+                    np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), rows)])
+    city[rng.random(rows) < 0.001] = None
+    room_type = rng.choice(ROOM_TYPES + ['Hotel room'], rows, p=[0.6, 0.35, 0.045, 0.005])
+    bathrooms = rng.choice([1.0, 1.5, 2.0, 2.5, 3.0], rows)
+    bathrooms[rng.random(rows) < 0.01] = np.nan
+    bedrooms = rng.integers(0, 6, rows).astype('float64')
+    bedrooms[rng.random(rows) < 0.01] = np.nan
+    accommodates = rng.integers(1, 12, rows)
+    flags = {feature: (rng.random(rows) < 0.6).astype(int) for feature in AMENITY_FEATURES}
+    # Price depends on the city, the room type, size and a few amenities
+    # (with an interaction), so tuning has something to find.
+    city_factor = pd.Series(city).map(dict(zip(CITIES, np.linspace(0.7, 1.6, len(CITIES))))).fillna(0.8).to_numpy()
+    room_factor = pd.Series(room_type).map({'Entire home/apt': 1.0, 'Private room': 0.55,
+                                            'Shared room': 0.35, 'Hotel room': 1.2}).to_numpy()
+    amenity = sum(flags[feature] for feature in list(AMENITY_FEATURES)[:4]) * 0.05
+    size = 40 + 12 * accommodates + 25 * np.nan_to_num(bedrooms) * (1 + 0.5 * flags[list(AMENITY_FEATURES)[0]])
+    price = size * city_factor * room_factor * (1 + amenity) * rng.lognormal(0, 0.25, rows)
+    df = pd.DataFrame({
+        'city': city,
+        'accommodates': accommodates,
+        'room_type': room_type,
+        'bathrooms': bathrooms,
+        'bedrooms': bedrooms,
+        'is_superhost': (rng.random(rows) < 0.2).astype(int),
+        **flags,
+        'price': np.round(price, 2),
+    })
+    df.to_csv(path, index=False)
+
+
+def compress_rare_categories(series, threshold=0.01):
+    # ml_code.py before the rework.
+    freq = series.value_counts(normalize=True)
+    rare = freq[freq < threshold].index
+    return series.apply(lambda x: 'RARE' if x in rare else x)
+
+
+def legacy_preprocessor(X):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OrdinalEncoder
+    categorical = X.select_dtypes(include=['object', 'string']).columns.tolist()
+    numeric = X.select_dtypes(include=[np.number]).columns.tolist()
+    return ColumnTransformer([
+        ('num', Pipeline([('imputer', SimpleImputer(strategy='mean'))]), numeric),
+        ('cat', Pipeline([
+            ('imputer', SimpleImputer(strategy='most_frequent')),
+            ('encoder', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1))
+        ]), categorical)
+    ])
+
+
+def preprocess(variant, path, threshold, nrows=None):
+    # (frame, encoded matrix, read seconds, preprocessing seconds)
+    import ml_code
+    start = time.perf_counter()
+    if variant == 'before':
+        df = pd.read_csv(path, nrows=nrows)
+    else:
+        columns = pd.read_csv(path, nrows=0).columns
+        df = pd.read_csv(path, nrows=nrows, dtype=ml_code.compact_dtypes(columns))
+    read_done = time.perf_counter()
+    X = df.drop(columns=[ml_code.TARGET_COL])
+    if variant == 'before':
+        for col in X.select_dtypes(include=['object', 'string']).columns:
+            X[col] = compress_rare_categories(X[col], threshold=threshold)
+        encoded = legacy_preprocessor(X).fit_transform(X)
+    else:
+        pipeline = ml_code.build_pipeline(X, dict(ml_code.hyperparameters, rare_threshold=threshold))
+        encoded = pipeline.named_steps['preprocessor'].fit_transform(X)
+    return df, encoded, read_done - start, time.perf_counter() - read_done
+
+
+def run_variant(variant, path, threshold):
+    df, encoded, read_s, prep_s = preprocess(variant, path, threshold)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    frame_mb = df.memory_usage(deep=True).sum() / 1e6
+    print(f"{variant},{read_s:.2f},{prep_s:.2f},{read_s + prep_s:.2f},{peak_mb:.0f},{frame_mb:.0f},{encoded.shape[0]}")
+
+
+def same_encoding(path, threshold, rows):
+    # Both variants must group the rows of every column the same way; the
+    # codes themselves differ (RARE had its own code, now it is -1). Rows
+    # with a missing city are left out: before, they were imputed after the
+    # mapping, so with many rare towns they became RARE; now they get the
+    # most frequent city.
+    df, before, _, _ = preprocess('before', path, threshold, rows)
+    _, after, _, _ = preprocess('after', path, threshold, rows)
+    known = df['city'].notna().to_numpy()
+    before, after = before[known], after[known]
+    return before.shape == after.shape and all(
+        np.array_equal(pd.factorize(before[:, i])[0], pd.factorize(after[:, i])[0])
+        for i in range(before.shape[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--threshold', type=float, default=0.01)
+    parser.add_argument('--input', help='existing ml_data.csv; generated when omitted')
+    parser.add_argument('--run', choices=['before', 'after'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_variant(args.run, args.input, args.threshold)
+        return
+
+    path = args.input
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), f'ml_data_{args.rows}.csv')
+        if not os.path.exists(path):
+            print(f"generating {args.rows} rows -> {path}")
+            write_ml_data(path, args.rows)
+    print(f"input: {path} ({os.path.getsize(path) / 1e6:.0f} MB)\n")
+
+    print(f"{'variant':<8} {'read s':>8} {'prep s':>8} {'total s':>8} {'peak RSS MB':>12} {'frame MB':>9} {'rows':>9}")
+    results = {}
+    for variant in ('before', 'after'):
+        out = subprocess.run([sys.executable, __file__, '--run', variant, '--input', path,
+                              '--threshold', str(args.threshold)],
+                             check=True, capture_output=True, text=True).stdout
+        fields = out.strip().splitlines()[-1].split(',')
+        results[variant] = fields
+        print(f"{fields[0]:<8} {fields[1]:>8} {fields[2]:>8} {fields[3]:>8} {fields[4]:>12} "
+              f"{fields[5]:>9} {fields[6]:>9}")
+
+    before, after = results['before'], results['after']
+    print(f"\npreprocessing {float(before[2]) / float(after[2]):.1f}x faster, "
+          f"total {float(before[3]) / float(after[3]):.1f}x, "
+          f"peak RSS {float(after[4]) / float(before[4]) * 100:.0f}% of before")
+    same = same_encoding(path, args.threshold, 200000)
+    print(f"same grouping of rows on the first 200000 (city given): {same}")
+    if not same:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'machine_learning_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from bench_ml_preprocess import write_ml_data
+
+# Wall time, number of fits and test RMSE of ml_code.py's three ways to get a
+# regressor on a synthetic ml_data.csv: the default settings (mode "train"),
+# a plain GridSearchCV over a grid of the same size as the search, and the
+# successive-halving search of mode "tune". Both searches cross-validate on
+# every core. Rows fitted counts the training rows of every fit, refit
+# included, as a proxy for billed instance time.
+#   python bench_ml_tuning.py --rows 300000
+
+GRID = {
+    'learning_rate': [0.05, 0.1, 0.2],
+    'max_depth': [None, 6],
+    'max_leaf_nodes': [31, 63],
+    'l2_regularization': [0.0, 1.0],
+}
+
+
+def rmse(model, X, y):
+    return float(np.sqrt(np.mean((model.predict(X) - y) ** 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--input', help='existing ml_data.csv; generated when omitted')
+    parser.add_argument('--cv', type=int, default=3)
+    args = parser.parse_args()
+
+    import ml_code
+    from sklearn.model_selection import GridSearchCV, ParameterGrid, train_test_split
+    from sklearn.pipeline import Pipeline
+
+    path = args.input
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), f'ml_data_{args.rows}.csv')
+        if not os.path.exists(path):
+            print(f"generating {args.rows} rows -> {path}")
+            write_ml_data(path, args.rows)
+    columns = pd.read_csv(path, nrows=0).columns
+    df = pd.read_csv(path, dtype=ml_code.compact_dtypes(columns))
+    X, y = df.drop(columns=[ml_code.TARGET_COL]), df[ml_code.TARGET_COL]
+    hyperparameters = dict(ml_code.hyperparameters, tune_candidates=len(ParameterGrid(GRID)), tune_cv=args.cv)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=hyperparameters['test_size'], random_state=hyperparameters['random_state'])
+    print(f"{len(X_train)} training rows, {os.cpu_count()} cores, {hyperparameters['tune_candidates']} candidates, "
+          f"{args.cv}-fold CV\n")
+
+    results = []
+    started = time.perf_counter()
+    model = ml_code.build_pipeline(X, hyperparameters).fit(X_train, y_train)
+    results.append(('default', time.perf_counter() - started, 1, len(X_train), None, rmse(model, X_test, y_test)))
+
+    started = time.perf_counter()
+    pipeline = ml_code.build_pipeline(X, hyperparameters)
+    encoded = pipeline.named_steps['preprocessor'].fit_transform(X_train)
+    grid = GridSearchCV(pipeline.named_steps['regressor'], GRID, cv=args.cv,
+                        scoring='neg_root_mean_squared_error', n_jobs=-1).fit(encoded, y_train)
+    model = Pipeline([('preprocessor', pipeline.named_steps['preprocessor']), ('regressor', grid.best_estimator_)])
+    fits = len(grid.cv_results_['params']) * args.cv
+    results.append(('grid search', time.perf_counter() - started, fits + 1,
+                    fits * len(X_train) * (args.cv - 1) // args.cv + len(X_train),
+                    -grid.best_score_, rmse(model, X_test, y_test)))
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        model, search = ml_code.tune(ml_code.build_pipeline(X, hyperparameters), X_train, y_train, hyperparameters)
+    fits = sum(r['candidates'] for r in search['rounds']) * args.cv
+    rows = sum(r['candidates'] * r['samples'] for r in search['rounds']) * (args.cv - 1)
+    results.append(('halving', time.perf_counter() - started, fits + 1, rows + len(X_train),
+                    search['cv_rmse'], rmse(model, X_test, y_test)))
+
+    print(f"{'variant':<12} {'wall s':>8} {'fits':>6} {'rows fitted':>13} {'CV RMSE':>9} {'test RMSE':>10}")
+    for name, seconds, fits, rows, cv_rmse, test_rmse in results:
+        cv_text = f"{cv_rmse:.2f}" if cv_rmse is not None else '-'
+        print(f"{name:<12} {seconds:>8.1f} {fits:>6} {rows:>13,} {cv_text:>9} {test_rmse:>10.2f}")
+
+    print("\nhalving rounds")
+    for iteration, tuning_round in enumerate(search['rounds']):
+        print(f"  round {iteration}: {tuning_round['candidates']} candidates on {tuning_round['samples']} rows")
+    grid_s, halving_s = results[1][1], results[2][1]
+    print(f"\nhalving {grid_s / halving_s:.1f}x faster than the grid, best {search['best_params']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+
+# Simulated end-to-end time of a pipeline run with the fixed Wait states and
+# sleep-polling Lambdas the state machine used to have, against the status
+# loops of step_function_json/steps.json. Each run draws the durations of
+# the Glue ETL job, both SageMaker processing jobs, the crawler and the RDS
+# instance creation; both orchestrations then run on the same draws. The
+# poll interval is read from steps.json. "Early" counts runs in which a
+# fixed wait ended before the thing it waited for: IngestData read a
+# half-written processed/ prefix, the reports queried an old catalog, or the
+# web tier started without its database. "Lambda s" is the billed time of
+# IngestData and MLprocess.
+#   python bench_orchestration.py --runs 2000
+
+STEPS = os.path.join(os.path.dirname(__file__), '..', 'step_function_json', 'steps.json')
+
+# The Wait states the status loops replaced, and the sleep in the handlers.
+FIXED_ETL_WAIT = 200      # Wait (2), after CreateCrawler
+FIXED_CRAWLER_WAIT = 160  # Wait, after IngestData
+FIXED_MODEL_WAIT = 200    # Wait (1), after MLprocess
+HANDLER_SLEEP = 30
+LAMBDA_TIMEOUT = 900
+
+# Fixed costs in seconds: a Lambda task, an aws-sdk task, the Athena query
+# of MLdata, the report branch and the three web-tier Lambdas.
+LAMBDA_CALL = 0.4
+SDK_CALL = 0.1
+ML_QUERY = 6
+REPORT_BRANCH = 20
+WEB_TIER = 6
+
+# Median seconds and log-normal spread per scenario.
+SCENARIOS = {
+    'typical': {'etl': (150, 0.35), 'ingest_job': (330, 0.25), 'crawler': (90, 0.3),
+                'ml_job': (360, 0.25), 'rds': (420, 0.2)},
+    'large input': {'etl': (320, 0.35), 'ingest_job': (600, 0.25), 'crawler': (200, 0.3),
+                    'ml_job': (660, 0.25), 'rds': (420, 0.2)},
+    'small input': {'etl': (60, 0.3), 'ingest_job': (240, 0.2), 'crawler': (50, 0.3),
+                    'ml_job': (250, 0.2), 'rds': (420, 0.2)},
+}
+
+
+def poll_seconds(path=STEPS):
+    # All status loops in the state machine share one interval.
+    with open(path) as f:
+        text = f.read()
+    seconds = {state['Seconds'] for state in walk(json.loads(text)['States']) if state['Type'] == 'Wait'}
+    if len(seconds) != 1:
+        raise ValueError(f"expected one poll interval in {path}, found {sorted(seconds)}")
+    return seconds.pop()
+
+
+def walk(states):
+    for state in states.values():
+        yield state
+        for branch in state.get('Branches', []):
+            yield from walk(branch['States'])
+
+
+def draw(rng, scenario):
+    return {name: rng.lognormvariate(math.log(median), sigma) for name, (median, sigma) in scenario.items()}
+
+
+def polled(duration, interval, first_check_at=0):
+    # Checks at first_check_at, + interval, ...: when the first check that
+    # sees the job ended happens, and how many checks that took.
+    if duration <= first_check_at:
+        return first_check_at, 1
+    checks = math.ceil((duration - first_check_at) / interval)
+    return first_check_at + checks * interval, checks + 1
+
+
+def fixed_run(d):
+    # Parallel (1) starts the ETL job and the RDS instance and returns.
+    t = LAMBDA_CALL
+    etl_done = d['etl'] + LAMBDA_CALL
+    t += 2 * SDK_CALL + FIXED_ETL_WAIT
+    early = etl_done > t
+
+    # IngestData: create the job, then describe / sleep(30) until it ends.
+    blocked, _ = polled(d['ingest_job'], HANDLER_SLEEP)
+    lambda_s = LAMBDA_CALL + blocked
+    timeout = blocked > LAMBDA_TIMEOUT
+    t += LAMBDA_CALL + blocked
+    crawler_done = t + d['crawler']
+    t += FIXED_CRAWLER_WAIT
+    early = early or crawler_done > t
+
+    # Parallel: MLdata and MLprocess (blocking as well), Wait (1), web tier.
+    ml_blocked, _ = polled(d['ml_job'], HANDLER_SLEEP)
+    timeout = timeout or ml_blocked > LAMBDA_TIMEOUT
+    lambda_s += LAMBDA_CALL + ml_blocked
+    branch = t + ML_QUERY + LAMBDA_CALL + ml_blocked + FIXED_MODEL_WAIT
+    early = early or d['rds'] > branch
+    end = max(branch + WEB_TIER, t + REPORT_BRANCH) + LAMBDA_CALL
+    return {'end': end, 'lambda_s': lambda_s, 'early': early, 'timeout': timeout, 'polls': 0}
+
+
+def loop_run(d, interval):
+    # ETLprocess, then WaitForETL / GetETLRun until the run has ended.
+    etl_seen, etl_polls = polled(d['etl'], interval, interval)
+    t = LAMBDA_CALL + etl_seen + etl_polls * SDK_CALL + 2 * SDK_CALL
+
+    # IngestData starts the job; WaitForIngestJob re-invokes it to check.
+    ingest_seen, ingest_polls = polled(d['ingest_job'], interval, interval)
+    t += LAMBDA_CALL + ingest_seen + ingest_polls * LAMBDA_CALL
+    lambda_s = (1 + ingest_polls) * LAMBDA_CALL
+
+    # WaitForCrawler / GetCrawler from the moment the last check started it.
+    crawler_seen, crawler_polls = polled(d['crawler'], interval, interval)
+    t += crawler_seen + crawler_polls * SDK_CALL
+
+    ml_seen, ml_polls = polled(d['ml_job'], interval, interval)
+    branch = t + ML_QUERY + LAMBDA_CALL + ml_seen + ml_polls * LAMBDA_CALL
+    lambda_s += (1 + ml_polls) * LAMBDA_CALL
+    # DescribeRDS checks first, then every interval until available.
+    rds_wait, rds_polls = polled(max(0.0, d['rds'] - branch), interval)
+    branch += rds_wait + rds_polls * SDK_CALL
+    end = max(branch + WEB_TIER, t + REPORT_BRANCH) + LAMBDA_CALL
+    polls = etl_polls + ingest_polls + crawler_polls + ml_polls + rds_polls
+    return {'end': end, 'lambda_s': lambda_s, 'early': False, 'timeout': False, 'polls': polls}
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--poll', type=int, help='poll interval; default from steps.json')
+    args = parser.parse_args()
+    interval = args.poll or poll_seconds()
+
+    print(f"{args.runs} simulated runs per scenario, status loops poll every {interval} s\n")
+    print(f"{'scenario':<12} {'orchestration':<14} {'median':>8} {'p95':>8} {'saved':>8} "
+          f"{'early':>6} {'timeout':>8} {'Lambda s':>9} {'polls':>6}")
+    for name, scenario in SCENARIOS.items():
+        rng = random.Random(args.seed)
+        runs = [draw(rng, scenario) for _ in range(args.runs)]
+        fixed = [fixed_run(d) for d in runs]
+        loops = [loop_run(d, interval) for d in runs]
+        saved = statistics.median(f['end'] - l['end'] for f, l in zip(fixed, loops))
+        for label, results in (('fixed waits', fixed), ('status loops', loops)):
+            ends = [r['end'] for r in results]
+            saved_text = f"{saved / 60:6.1f} m" if results is loops else ''
+            print(f"{name:<12} {label:<14} {statistics.median(ends) / 60:>6.1f} m "
+                  f"{percentile(ends, 95) / 60:>6.1f} m {saved_text:>8} "
+                  f"{sum(r['early'] for r in results) / len(results):>6.0%} "
+                  f"{sum(r['timeout'] for r in results) / len(results):>8.0%} "
+                  f"{statistics.median(r['lambda_s'] for r in results):>9.0f} "
+                  f"{statistics.median(r['polls'] for r in results):>6.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import duckdb
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import athena_reports
+from check_single_scan_reports import PREVIOUS_QUERIES
+from etl_job import AMENITY_DICTIONARY, AMENITY_DICTIONARY_VERSION
+from query_backend import TABLE_LOCATIONS, DuckDBQueryRunner, LocalBucketStore, sql_string
+
+# Times every report query of the analytics handlers on the local DuckDB
+# backend over synthetic processed tables of 1M, 10M and 50M rows, written
+# both as the ETL's CSV output and as its city=/price_tier= Parquet layout.
+# Datasets are generated once under --data_dir and reused.
+#   python bench_query_backend.py --rows 1000000 10000000 50000000
+
+CITIES = ['Boston', 'New York', 'Los Angeles', 'San Francisco', 'Seattle', 'Austin',
+          'Chicago', 'Denver', 'Portland', 'Nashville', 'Washington', 'New Orleans']
+PROPERTY_TYPES = ['Apartment', 'House', 'Condominium', 'Townhouse', 'Loft', 'Guesthouse',
+                  'Bed & Breakfast', 'Bungalow', 'Villa', 'Cabin', 'Boat', 'Other']
+ROOM_TYPES = ['Entire home/apt', 'Private room', 'Shared room']
+AMENITIES = ['TV', 'Wireless Internet', 'Air Conditioning', 'Kitchen', 'Heating', 'Washer',
+             'Dryer', 'Shampoo', 'Essentials', 'Hair Dryer', 'Elevator in Building', 'Gym',
+             'Free Parking on Premises', 'Smoke Detector', 'Iron', 'Hangers']
+SCORE_COLUMNS = ['review_scores_accuracy', 'review_scores_cleanliness', 'review_scores_checkin',
+                 'review_scores_communication', 'review_scores_location', 'review_scores_value']
+
+
+def sql_list(values):
+    return '[' + ', '.join(sql_string(v) for v in values) + ']'
+
+
+def pick(values):
+    return f"{sql_list(values)}[1 + CAST(floor(random() * {len(values)}) AS INTEGER)]"
+
+
+def processed_sql(rows):
+    # Same columns and types as the ETL's processed output, amenity_mask
+    # included; ~1 % NULL prices land in price_tier 'Unknown'.
+    scores = ',\n        '.join(f"2.0 + floor(random() * 9) AS {col}" for col in SCORE_COLUMNS)
+    names = sql_list(f'"{a}"' if ' ' in a else a for a in AMENITIES)
+    bits = '[' + ', '.join(str(1 << AMENITY_DICTIONARY.index(a)) for a in AMENITIES) + ']'
+    return f"""
+    SELECT * EXCLUDE (picked),
+        '{{' || array_to_string(list_transform(picked, j -> {names}[j]), ',') || '}}' AS amenities,
+        CAST(coalesce(list_sum(list_transform(picked, j -> {bits}[j])), 0) AS BIGINT) AS amenity_mask,
+        {AMENITY_DICTIONARY_VERSION} AS amenity_version,
+        CASE
+            WHEN price IS NULL THEN 'Unknown'
+            WHEN price < 50 THEN 'Budget'
+            WHEN price < 150 THEN 'Mid-range'
+            WHEN price < 300 THEN 'Upper Mid-range'
+            ELSE 'Luxury'
+        END AS price_tier
+    FROM (
+        SELECT
+        i + 1 AS listing_id,
+        random() < 0.2 AS host_is_superhost,
+        {pick(CITIES)} AS city,
+        {pick(PROPERTY_TYPES)} AS property_type,
+        {pick(ROOM_TYPES)} AS room_type,
+        1 + CAST(floor(random() * 10) AS INTEGER) AS accommodates,
+        0.5 * (2 + floor(random() * 5)) AS bathrooms,
+        CAST(floor(random() * 6) AS INTEGER) AS bedrooms,
+        list_filter(range(1, {len(AMENITIES) + 1}), j -> random() < 0.5) AS picked,
+        CASE WHEN random() < 0.01 THEN NULL ELSE 10.0 + floor(random() * random() * 600) END AS price,
+        CAST(floor(random() * 200) AS INTEGER) AS number_of_reviews,
+        20.0 + floor(random() * 81) AS review_scores_rating,
+        {scores}
+        FROM range({rows}) t(i)
+    )
+    """
+
+
+def generate(root, rows, output_format):
+    bucket, prefix = TABLE_LOCATIONS['processed']
+    target = os.path.join(root, bucket, *prefix.split('/'))
+    if os.path.isdir(target):
+        return
+    os.makedirs(target)
+    started = time.perf_counter()
+    conn = duckdb.connect()
+    conn.execute("SELECT setseed(0.7)")
+    if output_format == 'csv':
+        # t/f like the ETL's CSV output of host_is_superhost.
+        conn.execute(f"COPY (SELECT * REPLACE (CASE WHEN host_is_superhost THEN 't' ELSE 'f' END "
+                     f"AS host_is_superhost) FROM ({processed_sql(rows)})) "
+                     f"TO {sql_string(os.path.join(target, 'airbnb_ratings_new.csv'))} (HEADER)")
+    else:
+        conn.execute(f"COPY ({processed_sql(rows)}) TO {sql_string(target)} "
+                     f"(FORMAT parquet, COMPRESSION snappy, PARTITION_BY (city, price_tier))")
+    conn.close()
+    print(f"generated {rows:,} rows as {output_format} in {time.perf_counter() - started:.1f} s")
+
+
+def disk_bytes(path):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, files in os.walk(path) for name in files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000, 50000000])
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'parquet'], default=['csv', 'parquet'])
+    parser.add_argument('--data_dir', default=os.path.join(tempfile.gettempdir(), 'bench_query_backend'))
+    args = parser.parse_args()
+
+    handler = importlib.import_module('2_get_output')
+    dictionary = {'version': AMENITY_DICTIONARY_VERSION, 'amenities': AMENITY_DICTIONARY}
+    queries = {'ml_data': handler.ml_data_query(dictionary),
+               'ml_data (LIKE)': handler.ML_DATA_QUERY,
+               'reports': athena_reports.REPORTS_QUERY}
+    queries.update({f'old {name}': sql for name, sql in PREVIOUS_QUERIES.items()})
+
+    print(f"{'rows':>11} {'format':>8} {'on disk MB':>11} {'query':>22} {'seconds':>8} {'Mrows/s':>8} {'result MB':>10}")
+    for rows in args.rows:
+        for output_format in args.formats:
+            root = os.path.join(args.data_dir, f'{rows}-{output_format}')
+            generate(root, rows, output_format)
+            store = LocalBucketStore(root)
+            runner = DuckDBQueryRunner(store)
+            size = disk_bytes(store.path(*TABLE_LOCATIONS['processed'])) / 1e6
+            for name, sql in queries.items():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = runner.run(sql, 'data_db', 's3://myresult-sc171/bench/', label=name)
+                result = store.path('myresult-sc171', 'bench/')
+                result_mb = disk_bytes(result) / 1e6
+                shutil.rmtree(result)
+                if stats['state'] != 'SUCCEEDED':
+                    raise SystemExit(f"{name} failed: {stats['state_change_reason']}")
+                seconds = stats['wall_ms'] / 1000
+                print(f"{rows:>11,} {output_format:>8} {size:>11.0f} {name:>22} {seconds:>8.2f} "
+                      f"{rows / seconds / 1e6:>8.1f} {result_mb:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import pymysql
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+import rds_loader
+
+# Compares rows/sec of the three rds_loader modes against a local MySQL.
+#   docker run -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench mysql:8.0 --local-infile=1
+#   python bench_rds_load.py --rows 200000
+
+HEADER = ['property_type', 'number_of_listings', 'avg_accuracy',
+          'avg_communication', 'avg_location', 'avg_value']
+PROPERTY_TYPES = ['Apartment', 'House', 'Condominium', 'Loft', 'Townhouse',
+                  'Guest suite', 'Villa', 'Boat', 'Dorm', 'Camper/RV']
+
+
+def synthetic_rows(n, seed=42):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield [
+            rng.choice(PROPERTY_TYPES),
+            str(rng.randint(1, 5000)),
+            f"{rng.uniform(2, 10):.6f}",
+            f"{rng.uniform(2, 10):.6f}",
+            f"{rng.uniform(2, 10):.6f}",
+            f"{rng.uniform(2, 10):.6f}",
+        ]
+
+
+def run_mode(conn, table, mode, rows, batch_size):
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(rds_loader.create_table_sql(table, HEADER))
+    conn.commit()
+
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        count = rds_loader.load_rows(cursor, table, HEADER, synthetic_rows(rows),
+                                     mode=mode, batch_size=batch_size)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=os.environ.get('MYSQL_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MYSQL_PORT', 3306)))
+    parser.add_argument('--user', default=os.environ.get('MYSQL_USER', 'root'))
+    parser.add_argument('--password', default=os.environ.get('MYSQL_PASSWORD', 'bench'))
+    parser.add_argument('--database', default='rds_load_bench')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--row-limit', type=int, default=20000,
+                        help='cap for the per-row mode, which is much slower')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--modes', default=','.join(rds_loader.LOAD_MODES))
+    args = parser.parse_args()
+
+    init = pymysql.connect(host=args.host, port=args.port, user=args.user,
+                           password=args.password)
+    with init.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {args.database}")
+    init.close()
+
+    conn = pymysql.connect(host=args.host, port=args.port, user=args.user,
+                           password=args.password, database=args.database,
+                           local_infile=True)
+
+    print(f"{'mode':<8} {'rows':>10} {'seconds':>10} {'rows/sec':>12}")
+    for mode in args.modes.split(','):
+        rows = min(args.rows, args.row_limit) if mode == 'row' else args.rows
+        count, elapsed = run_mode(conn, f"bench_{mode}", mode, rows, args.batch_size)
+        print(f"{mode:<8} {count:>10} {elapsed:>10.2f} {count / elapsed:>12.0f}")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import sys
+import time
+
+import pymysql
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+import rds_loader
+from bench_rds_load import HEADER, synthetic_rows
+
+# Loads the same synthetic property_insights rows into an all-VARCHAR table
+# and into an inferred, indexed table, then compares on-disk size and the
+# latency of typical dashboard queries. Needs a local MySQL, see bench_rds_load.py.
+
+QUERIES = {
+    'filter by property_type': (
+        "SELECT * FROM {t} WHERE property_type = 'Villa'",
+        "SELECT * FROM {t} WHERE property_type = 'Villa'",
+    ),
+    'numeric range filter': (
+        "SELECT COUNT(*) FROM {t} WHERE CAST(avg_accuracy AS DECIMAL(12,6)) > 9.5",
+        "SELECT COUNT(*) FROM {t} WHERE avg_accuracy > 9.5",
+    ),
+    'top 20 by listings': (
+        "SELECT * FROM {t} ORDER BY CAST(number_of_listings AS UNSIGNED) DESC LIMIT 20",
+        "SELECT * FROM {t} ORDER BY number_of_listings DESC LIMIT 20",
+    ),
+    'avg value per type': (
+        "SELECT property_type, AVG(CAST(avg_value AS DECIMAL(12,6))) FROM {t} GROUP BY property_type",
+        "SELECT property_type, AVG(avg_value) FROM {t} GROUP BY property_type",
+    ),
+}
+
+
+def load(conn, table, rows, typed):
+    sample, data = rds_loader.peek_rows(synthetic_rows(rows))
+    column_types = None
+    if typed:
+        column_types = rds_loader.infer_schema(HEADER, sample)
+        data = rds_loader.coerce_nulls(data, column_types)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        index_columns = rds_loader.INDEX_COLUMNS if typed else ()
+        cursor.execute(rds_loader.create_table_sql(table, HEADER, column_types, index_columns))
+        rds_loader.load_rows(cursor, table, HEADER, data, mode='batch', batch_size=5000)
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
+    conn.commit()
+    return column_types
+
+
+def table_size_mb(conn, database, table):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT data_length, index_length FROM information_schema.tables "
+            "WHERE table_schema = %s AND table_name = %s", (database, table))
+        data_length, index_length = cursor.fetchone()
+    return data_length / 1024 / 1024, index_length / 1024 / 1024
+
+
+def time_query(conn, sql, repeat):
+    best = None
+    with conn.cursor() as cursor:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=os.environ.get('MYSQL_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MYSQL_PORT', 3306)))
+    parser.add_argument('--user', default=os.environ.get('MYSQL_USER', 'root'))
+    parser.add_argument('--password', default=os.environ.get('MYSQL_PASSWORD', 'bench'))
+    parser.add_argument('--database', default='rds_load_bench')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    init = pymysql.connect(host=args.host, port=args.port, user=args.user, password=args.password)
+    with init.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {args.database}")
+    init.close()
+    conn = pymysql.connect(host=args.host, port=args.port, user=args.user,
+                           password=args.password, database=args.database)
+
+    load(conn, 'schema_varchar', args.rows, typed=False)
+    column_types = load(conn, 'schema_typed', args.rows, typed=True)
+    print("inferred:", dict(zip(HEADER, column_types)))
+
+    print(f"\n{'table':<16} {'data MB':>10} {'index MB':>10}")
+    for table in ('schema_varchar', 'schema_typed'):
+        data_mb, index_mb = table_size_mb(conn, args.database, table)
+        print(f"{table:<16} {data_mb:>10.1f} {index_mb:>10.1f}")
+
+    print(f"\n{'query':<26} {'varchar ms':>12} {'typed ms':>12} {'speedup':>8}")
+    for name, (varchar_sql, typed_sql) in QUERIES.items():
+        before = time_query(conn, varchar_sql.format(t='schema_varchar'), args.repeat)
+        after = time_query(conn, typed_sql.format(t='schema_typed'), args.repeat)
+        print(f"{name:<26} {before:>12.1f} {after:>12.1f} {before / after:>7.1f}x")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
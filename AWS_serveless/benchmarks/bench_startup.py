@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Import time and first-invocation latency of every handler in lambda_code/,
+# each in a fresh interpreter as in a Lambda cold start. AWS calls go to a
+# local endpoint (AWS_ENDPOINT_URL) that answers every request with an empty
+# success, so the timings are client creation and request handling, not the
+# network; handlers that then miss a field in the response end in an error,
+# which is reported but does not matter here. --ref also runs the handlers
+# of a git revision to compare against.
+#   python bench_startup.py --runs 5 --ref HEAD~1
+
+LAMBDA_CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_code')
+
+# Event per handler; the rest get {}.
+EVENTS = {
+    '2_get_output': {'refresh_cache': True},
+    '5_avg_info_property': {'refresh_cache': True},
+    '8_PriceRange': {'refresh_cache': True},
+    '4_refresh_asg': {'subnet_ids': ['subnet-1']},
+}
+
+
+class EmptySuccess(BaseHTTPRequestHandler):
+    # JSON for the JSON protocols (X-Amz-Target), XML for the rest.
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.headers.get('X-Amz-Target'):
+            body, content_type = b'{}', 'application/x-amz-json-1.1'
+        else:
+            body, content_type = b'<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 'text/xml'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+# Runs in the fresh interpreter: argv = module, event.
+CHILD = '''
+import time
+started = time.perf_counter()
+import contextlib, importlib, io, json, sys
+module, event = sys.argv[1], json.loads(sys.argv[2])
+
+def invoke():
+    try:
+        handler.lambda_handler(event, None)
+        return 'ok'
+    except Exception as e:
+        return type(e).__name__
+
+with contextlib.redirect_stdout(io.StringIO()):
+    handler = importlib.import_module(module)
+    imported = time.perf_counter()
+    boto3_at_import = 'boto3' in sys.modules
+    outcome = invoke()
+    invoked = time.perf_counter()
+    invoke()
+    warm = time.perf_counter() - invoked
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_ms': (invoked - imported) * 1000,
+                  'warm_ms': warm * 1000, 'boto3_at_import': boto3_at_import, 'outcome': outcome}))
+'''
+
+
+def handlers(code_dir):
+    names = [name[:-3] for name in os.listdir(code_dir) if name.endswith('.py') and name[0].isdigit()]
+    return sorted(names, key=lambda name: int(name.split('_')[0]))
+
+
+def extract(ref, work):
+    # lambda_code/ as of ref, via git archive.
+    root = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=LAMBDA_CODE,
+                          capture_output=True, text=True, check=True).stdout.strip()
+    prefix = os.path.relpath(os.path.abspath(LAMBDA_CODE), root)
+    archive = os.path.join(work, 'ref.tar')
+    subprocess.run(['git', 'archive', '-o', archive, ref, prefix], cwd=root, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(os.path.join(work, 'ref'))
+    return os.path.join(work, 'ref', prefix)
+
+
+def measure(code_dir, module, runs, env):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', CHILD, module, json.dumps(EVENTS.get(module, {}))],
+                             cwd=code_dir, env=dict(env, PYTHONPATH=code_dir),
+                             capture_output=True, text=True, timeout=120)
+        if out.returncode:
+            return {'outcome': out.stderr.strip().splitlines()[-1]}
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    result = {k: statistics.median(s[k] for s in samples) for k in ('import_ms', 'first_ms', 'warm_ms')}
+    return dict(result, boto3_at_import=samples[0]['boto3_at_import'], outcome=samples[0]['outcome'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ref', help='git revision to compare against')
+    parser.add_argument('--handlers', nargs='+')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EmptySuccess)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, AWS_ENDPOINT_URL=f'http://127.0.0.1:{server.server_port}',
+               AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1',
+               AWS_MAX_ATTEMPTS='1', PYTHONDONTWRITEBYTECODE='1', QUERY_BACKEND='athena')
+
+    work = tempfile.mkdtemp(prefix='bench-startup-')
+    trees = [('tree', LAMBDA_CODE)] + ([(args.ref, extract(args.ref, work))] if args.ref else [])
+    modules = args.handlers or handlers(LAMBDA_CODE)
+
+    print(f"{'handler':<22} {'code':<10} {'import ms':>10} {'first call ms':>14} {'cold ms':>8} "
+          f"{'warm ms':>8} {'boto3 at import':>16} outcome")
+    totals = {}
+    for module in modules:
+        for label, code_dir in trees:
+            if not os.path.exists(os.path.join(code_dir, module + '.py')):
+                continue
+            r = measure(code_dir, module, args.runs, env)
+            if 'import_ms' not in r:
+                print(f"{module:<22} {label:<10} {r['outcome']}")
+                continue
+            cold = r['import_ms'] + r['first_ms']
+            totals.setdefault(label, []).append(cold)
+            print(f"{module:<22} {label:<10} {r['import_ms']:>10.0f} {r['first_ms']:>14.0f} {cold:>8.0f} "
+                  f"{r['warm_ms']:>8.1f} {str(r['boto3_at_import']):>16} {r['outcome']}")
+    for label, values in totals.items():
+        print(f"median cold start ({label}): {statistics.median(values):.0f} ms over {len(values)} handlers")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
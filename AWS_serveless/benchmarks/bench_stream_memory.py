@@ -0,0 +1,96 @@
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+import rds_loader
+
+# Streams a synthetic multi-GB CSV through the RDS loader path under a hard
+# address-space cap and fails if peak RSS exceeds the cap. The body is
+# generated on the fly, so neither the disk nor a real S3 object is needed.
+#   python bench_stream_memory.py --size-mb 2048 --cap-mb 256
+
+HEADER = b'property_type,number_of_listings,avg_accuracy,avg_communication,avg_location,avg_value\n'
+ROW = b'"Guest suite, private",1234,9.812345,9.712345,9.612345,9.512345\n'
+
+
+class SyntheticBody:
+    # Minimal stand-in for botocore's StreamingBody: read(amt) only.
+    def __init__(self, size_bytes):
+        self.remaining = size_bytes
+        self.header_sent = False
+        self.block = ROW * 16384
+
+    def read(self, amt=None):
+        if not self.header_sent:
+            self.header_sent = True
+            return HEADER
+        if self.remaining <= 0:
+            return b''
+        n = len(self.block)
+        if amt:
+            n = min(n, (amt // len(ROW)) * len(ROW) or len(ROW))
+        n = min(n, self.remaining)
+        self.remaining -= n
+        data = self.block[:n]
+        # Keep the last row whole so the CSV stays valid.
+        if self.remaining <= 0 and not data.endswith(b'\n'):
+            data = data[:data.rfind(b'\n') + 1]
+        return data
+
+
+class NullCursor:
+    def __init__(self):
+        self.rows = 0
+
+    def executemany(self, sql, batch):
+        self.rows += len(batch)
+
+    def execute(self, sql, args=None):
+        self.rows += 1
+
+
+def address_space_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--cap-mb', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=rds_loader.DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    baseline = peak_rss_mb()
+    # Hard cap: any allocation past the current address space + cap raises MemoryError.
+    if os.path.exists('/proc/self/statm'):
+        limit = address_space_bytes() + args.cap_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.RLIM_INFINITY))
+
+    body = SyntheticBody(args.size_mb * 1024 * 1024)
+    cursor = NullCursor()
+    start = time.perf_counter()
+    header, rows = rds_loader.read_csv_stream(body)
+    count = rds_loader.load_rows(cursor, 'bench', header, rows,
+                                 mode='batch', batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    growth = peak_rss_mb() - baseline
+    print(f"streamed {args.size_mb} MB, {count} rows in {elapsed:.1f}s "
+          f"({args.size_mb / elapsed:.1f} MB/s)")
+    print(f"peak RSS {peak_rss_mb():.1f} MB (baseline {baseline:.1f} MB, growth {growth:.1f} MB)")
+    if growth > args.cap_mb:
+        print(f"FAIL: RSS growth exceeded the {args.cap_mb} MB cap")
+        sys.exit(1)
+    print(f"OK: RSS growth within the {args.cap_mb} MB cap")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from check_athena_runner import check
+
+# Grows etl_job.py's amenity dictionary past the 63 bits of one BIGINT and
+# checks that the mask columns it writes answer every has_* flag of
+# amenity_features.py the way LIKE over the amenities text does.
+#   python check_amenity_mask.py
+
+EXTRA = ['Gym Access', 'Wireless Printer', 'Outdoor Kitchen', 'Heated Floors', 'Ceiling Fan']
+
+
+def grow(etl_job, names):
+    # The dictionary constants as etl_job.py derives them, for a longer list.
+    etl_job.AMENITY_DICTIONARY = names
+    etl_job.AMENITY_BITS = {name: i for i, name in enumerate(names)}
+    words = -(-len(names) // etl_job.AMENITY_MASK_BITS)
+    etl_job.AMENITY_MASK_COLUMNS = ['amenity_mask'] + [f'amenity_mask_{word}' for word in range(1, words)]
+    etl_job.DERIVED_COLUMNS = ['price_tier', 'amenity_mask', 'amenity_version'] + etl_job.AMENITY_MASK_COLUMNS[1:]
+
+
+def flags_from_masks(df, masks):
+    return {feature: np.logical_or.reduce([(df[column].to_numpy() & mask) != 0
+                                           for column, mask in columns.items()]).astype(int)
+            for feature, columns in masks.items()}
+
+
+def flags_from_text(df):
+    from amenity_features import AMENITY_FEATURES
+    return {feature: df['amenities'].fillna('').str.contains(pattern, regex=False).astype(int).to_numpy()
+            for feature, pattern in AMENITY_FEATURES.items()}
+
+
+def main():
+    import etl_job
+    from amenity_features import feature_masks
+
+    names = etl_job.AMENITY_DICTIONARY + EXTRA
+    check(len(names) > etl_job.AMENITY_MASK_BITS, 'the grown dictionary needs a second mask column')
+    grow(etl_job, names)
+    rng = np.random.default_rng(0)
+    lists = ['{' + ','.join(f'"{name}"' for name in rng.choice(names, rng.integers(0, 12), replace=False)) + '}'
+             for _ in range(2000)]
+    df = pd.DataFrame({'amenities': lists + [None], 'price': 100.0})
+    df = etl_job.transform_rows(df, {})
+
+    check(list(df.columns[-4:]) == ['price_tier', 'amenity_mask', 'amenity_version', 'amenity_mask_1'],
+          'a second mask column goes after the existing derived columns')
+    check(all(df[col].dtype == 'int64' for col in etl_job.AMENITY_MASK_COLUMNS), 'mask columns are int64')
+    last = df['amenities'].fillna('').str.contains('"' + EXTRA[-1] + '"', regex=False)
+    bit = 1 << (len(names) - 1) % etl_job.AMENITY_MASK_BITS
+    check((((df['amenity_mask_1'] & bit) != 0) == last).all(), f'name {len(names)} sets a bit of amenity_mask_1')
+    check((df[etl_job.AMENITY_MASK_COLUMNS].iloc[-1] == 0).all(), 'a missing list has no bits')
+
+    masks = feature_masks({'version': 2, 'amenities': names})
+    check(any('amenity_mask_1' in columns for columns in masks.values()),
+          'some flag tests the second mask column')
+    by_mask, by_text = flags_from_masks(df, masks), flags_from_text(df)
+    check(all((by_mask[feature] == by_text[feature]).all() for feature in by_text),
+          'every has_* flag matches LIKE over the amenities text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import importlib
+import json
+from datetime import timedelta
+
+from check_athena_runner import (REPORTS_RESULT, LambdaContext, SimulatedClock, StandInAthena,
+                                 StandInS3, check)
+from athena_cache import AthenaResultCache, normalize_sql
+from athena_runner import AthenaQueryRunner
+
+# Exercises the Athena result cache in front of 2_get_output and the combined
+# report query of 5_avg_info_property / 8_PriceRange with the stand-in
+# clients from check_athena_runner.py: hits, misses after an ETL run, SQL
+# normalization, expiry and eviction.
+#   python check_athena_cache.py
+
+SOURCE = 'raw-data-sc171'
+RESULTS = 'myresult-sc171'
+
+
+def setup(module_name):
+    handler = importlib.import_module(module_name)
+    s3 = StandInS3()
+    s3.put(SOURCE, 'processed/airbnb_ratings_new.csv', b'listing_id,price\n1,100\n')
+    clock = SimulatedClock()
+    athena = StandInAthena(clock, s3=s3, result_body=REPORTS_RESULT)
+    handler.s3 = s3
+    handler.query_runner = AthenaQueryRunner(athena, clock=clock, sleep=clock.sleep)
+    handler.result_cache = AthenaResultCache(s3, RESULTS)
+    return handler, s3, athena, LambdaContext(clock, 900)
+
+
+def cache_entries(s3, label):
+    return sorted(key for bucket, key in s3.objects if key.startswith(f'athena_cache/{label}/'))
+
+
+def cache_outcome(result):
+    return result.get('cache') or json.loads(result['body'])['cache']
+
+
+def main():
+    check(normalize_sql("SELECT a\n  FROM t WHERE x = 'Villa';  -- note") ==
+          normalize_sql("select a from T where x = 'Villa'"), 'case, whitespace and comments are normalized')
+    check(normalize_sql("SELECT a FROM t WHERE x = 'Villa'") !=
+          normalize_sql("SELECT a FROM t WHERE x = 'villa'"), 'string literals keep their case')
+
+    for module_name, label, target in (('2_get_output', 'ml_data', 'ml_data.csv'),
+                                       ('5_avg_info_property', 'reports', 'property_insights.csv'),
+                                       ('8_PriceRange', 'reports', 'price_range.csv')):
+        print(f"\n{module_name}")
+        handler, s3, athena, context = setup(module_name)
+
+        result = handler.lambda_handler({}, context)
+        check(cache_outcome(result) == 'miss' and len(athena.queries) == 1, 'first run queries Athena')
+        check(len(cache_entries(s3, label)) == 1, 'result is stored in the cache')
+
+        result = handler.lambda_handler({}, context)
+        check(cache_outcome(result) == 'hit' and len(athena.queries) == 1, 'unchanged processed/ is a hit')
+        del s3.objects[(RESULTS, target)]
+        result = handler.lambda_handler({}, context)
+        check(cache_outcome(result) == 'hit' and (RESULTS, target) in s3.objects,
+              f'hit rewrites {target} from the cached CSV')
+
+        result = handler.lambda_handler({'refresh_cache': True}, context)
+        check(cache_outcome(result) == 'miss' and len(athena.queries) == 2, 'refresh_cache forces a query')
+
+        s3.put(SOURCE, 'processed/airbnb_ratings_new.csv', b'listing_id,price\n1,120\n')
+        result = handler.lambda_handler({}, context)
+        check(cache_outcome(result) == 'miss' and len(athena.queries) == 3, 'rewritten processed/ is a miss')
+
+        for key in cache_entries(s3, label):
+            s3.objects[(RESULTS, key)]['LastModified'] -= timedelta(days=8)
+        result = handler.lambda_handler({}, context)
+        check(cache_outcome(result) == 'miss' and len(athena.queries) == 4, 'expired entry is not used')
+        check(len(cache_entries(s3, label)) == 1, 'expired entries are deleted')
+
+        for n in range(5):
+            s3.put(SOURCE, f'processed/daily-{n}.csv', b'x' * n)
+            handler.lambda_handler({}, context)
+        check(len(cache_entries(s3, label)) == 3, 'at most 3 entries are kept per report')
+
+
+if __name__ == '__main__':
+    main()
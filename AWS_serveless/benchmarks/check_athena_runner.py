@@ -0,0 +1,258 @@
+import hashlib
+import importlib
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from athena_reports import REPORT_KEYS
+from athena_runner import AthenaQueryRunner, split_s3_uri
+
+# Exercises athena_runner, the three report handlers and the two CSV checks
+# against a stand-in Athena client on a simulated clock, and compares polls
+# and completion lag with the old fixed 2 s loop. No AWS access needed.
+#   python check_athena_runner.py
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class StandInAthena:
+    # Each query is queued for queue_s, runs for run_s and then ends in
+    # outcome; stop_query_execution cancels it. The first `throttle` polls
+    # raise ThrottlingException. With s3, result_body is written to the
+    # query's output location.
+
+    def __init__(self, clock, queue_s=0.3, run_s=1.5, outcome='SUCCEEDED',
+                 scanned=48 * 1024 * 1024, throttle=0, s3=None, result_body=b''):
+        self.clock = clock
+        self.s3 = s3
+        self.result_body = result_body
+        self.queue_s = queue_s
+        self.run_s = run_s
+        self.outcome = outcome
+        self.scanned = scanned
+        self.throttle = throttle
+        self.queries = {}
+        self.polls = 0
+        self.stopped = []
+
+    def start_query_execution(self, QueryString, QueryExecutionContext, ResultConfiguration):
+        query_id = f'q-{len(self.queries) + 1}'
+        self.queries[query_id] = {'started': self.clock(), 'cancelled_at': None,
+                                  'location': ResultConfiguration['OutputLocation'] + query_id + '.csv'}
+        if self.s3 is not None:
+            bucket, key = split_s3_uri(self.queries[query_id]['location'])
+            self.s3.put(bucket, key, self.result_body)
+        return {'QueryExecutionId': query_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        self.polls += 1
+        if self.throttle:
+            self.throttle -= 1
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'GetQueryExecution')
+        query = self.queries[QueryExecutionId]
+        elapsed = self.clock() - query['started']
+        end = self.queue_s + self.run_s
+        if query['cancelled_at'] is not None:
+            state, elapsed = 'CANCELLED', query['cancelled_at'] - query['started']
+        elif elapsed >= end:
+            state, elapsed = self.outcome, end
+        else:
+            state = 'QUEUED' if elapsed < self.queue_s else 'RUNNING'
+        running = max(0.0, elapsed - self.queue_s)
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': {'State': state},
+            'ResultConfiguration': {'OutputLocation': query['location']},
+            'Statistics': {
+                'DataScannedInBytes': int(self.scanned * min(1.0, running / self.run_s)),
+                'QueryQueueTimeInMillis': int(min(elapsed, self.queue_s) * 1000),
+                'EngineExecutionTimeInMillis': int(running * 1000),
+                'TotalExecutionTimeInMillis': int(elapsed * 1000),
+            },
+        }}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+        self.queries[QueryExecutionId]['cancelled_at'] = self.clock()
+
+
+class StandInS3:
+    # In-memory buckets: {(bucket, key): {'Body', 'ETag', 'LastModified'}}.
+
+    def __init__(self):
+        self.objects = {}
+        self.copies = []
+
+    def put(self, bucket, key, body=b'', last_modified=None):
+        self.objects[(bucket, key)] = {
+            'Body': body, 'ETag': '"%s"' % hashlib.md5(body).hexdigest(),
+            'LastModified': last_modified or datetime.now(timezone.utc)}
+
+    def copy_object(self, Bucket, CopySource, Key):
+        self.copies.append((CopySource['Key'], Key))
+        self.put(Bucket, Key, self.objects[(CopySource['Bucket'], CopySource['Key'])]['Body'])
+
+    def put_object(self, Bucket, Key, Body):
+        self.put(Bucket, Key, Body)
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        body = self.objects[(Bucket, Key)]['Body']
+        if not Range:
+            return {'Body': io.BytesIO(body)}
+        if not body:
+            raise ClientError({'Error': {'Code': 'InvalidRange', 'Message': 'Not Satisfiable'}}, 'GetObject')
+        start, end = (int(i) for i in Range.split('=')[1].split('-'))
+        end = min(end, len(body) - 1)
+        return {'Body': io.BytesIO(body[start:end + 1]), 'ContentRange': f'bytes {start}-{end}/{len(body)}'}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return dict(self.objects[(Bucket, Key)])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        yield {'Contents': [dict(obj, Key=key) for (bucket, key), obj in sorted(self.objects.items())
+                            if bucket == Bucket and key.startswith(Prefix)]}
+
+
+class LambdaContext:
+    def __init__(self, clock, limit_s):
+        self.clock = clock
+        self.limit_s = limit_s
+
+    def get_remaining_time_in_millis(self):
+        return int((self.limit_s - self.clock()) * 1000)
+
+
+# A combined result of athena_reports.REPORTS_QUERY in Athena's CSV layout.
+REPORTS_RESULT = (
+    '"report","property_type","price_tier","number_of_listings","avg_accuracy",'
+    '"avg_communication","avg_location","avg_value","min_price"\n'
+    '"property_insights","House",,"40","9.5","9.7","9.6","9.4","20.0"\n'
+    '"property_insights","Apartment",,"60","9.4","9.6","9.8","9.3","15.0"\n'
+    '"price_range",,"Budget (Under $50)","30","9.3",,,"9.5","15.0"\n'
+    '"price_range",,"Mid-range ($50-$149)","70","9.5",,,"9.3","50.0"\n'
+).encode('utf-8')
+
+
+def run(label, timeout=60, context_limit=None, **client_options):
+    clock = SimulatedClock()
+    client = StandInAthena(clock, **client_options)
+    runner = AthenaQueryRunner(client, timeout=timeout, clock=clock, sleep=clock.sleep)
+    context = LambdaContext(clock, context_limit) if context_limit else None
+    stats = runner.run('SELECT 1', 'data_db', 's3://myresult-sc171/', label=label, context=context)
+    return stats, client
+
+
+def fixed_loop(run_s, queue_s=0.3):
+    # Old handlers: poll, then sleep 2 s until a terminal state.
+    polls, now = 1, 0.0
+    while now < queue_s + run_s:
+        now += 2
+        polls += 1
+    return polls, now - (queue_s + run_s)
+
+
+def check(condition, message):
+    if not condition:
+        raise SystemExit(f"FAILED: {message}")
+    print(f"ok   {message}")
+
+
+def main():
+    print("scenarios")
+    stats, client = run('success')
+    check(stats['state'] == 'SUCCEEDED' and not stats['timed_out'], 'query succeeds')
+    check(stats['data_scanned_bytes'] == 48 * 1024 * 1024, 'scanned bytes reported')
+    check(stats['queue_ms'] == 300 and stats['engine_execution_ms'] == 1500, 'queue and engine time reported')
+    check(stats['estimated_cost_usd'] > 0, 'cost estimate reported')
+
+    stats, client = run('failure', outcome='FAILED')
+    check(stats['state'] == 'FAILED' and not client.stopped, 'failure is returned, not cancelled')
+
+    stats, client = run('timeout', timeout=30, run_s=1000)
+    check(stats['state'] == 'CANCELLED' and stats['timed_out'], 'query past the deadline is reported as timed out')
+    check(client.stopped == ['q-1'], 'query past the deadline is cancelled')
+    check(stats['wall_ms'] == 30000, 'polling stops at the deadline')
+
+    stats, client = run('lambda budget', timeout=600, context_limit=20, run_s=1000)
+    check(stats['timed_out'] and stats['wall_ms'] == 15000, 'deadline capped by remaining Lambda time')
+
+    stats, client = run('throttled', throttle=3)
+    check(stats['state'] == 'SUCCEEDED' and client.polls > 3, 'throttled polls are retried')
+
+    print("\nhandlers")
+    for module_name, targets in (('2_get_output', ['ml_data.csv']),
+                                 ('5_avg_info_property', list(REPORT_KEYS.values())),
+                                 ('8_PriceRange', list(REPORT_KEYS.values()))):
+        handler = importlib.import_module(module_name)
+        clock = SimulatedClock()
+        s3 = StandInS3()
+        athena = StandInAthena(clock, s3=s3, result_body=REPORTS_RESULT)
+        handler.query_runner = AthenaQueryRunner(athena, clock=clock, sleep=clock.sleep)
+        handler.s3 = handler.result_cache.s3 = s3
+        result = handler.lambda_handler({}, LambdaContext(clock, 900))
+        check(result['statusCode'] == 200 and len(athena.queries) == 1
+              and all(('myresult-sc171', t) in s3.objects for t in targets),
+              f"{module_name} writes {', '.join(targets)} from one query")
+
+    # s3 now holds both reports from 8_PriceRange.
+    for module_name, key in (('6_checkcsv', REPORT_KEYS['property_insights']),
+                             ('9_checkcsv', REPORT_KEYS['price_range'])):
+        handler = importlib.import_module(module_name)
+        handler.s3 = s3
+        result = handler.lambda_handler({}, None)
+        check(not result['csvIsEmpty'] and result['csvCheck']['schema_ok']
+              and result['csvCheck']['sample_is_whole_file'], f"{module_name} accepts {key}")
+        original = s3.objects[('myresult-sc171', key)]['Body']
+        for label, body in (('a missing', None), ('an empty', b''),
+                            ('a header-only', original.split(b'\n', 1)[0] + b'\n'),
+                            ('a renamed-column', original.replace(b'avg_value', b'value', 1))):
+            if body is None:
+                del s3.objects[('myresult-sc171', key)]
+            else:
+                s3.put('myresult-sc171', key, body)
+            check(handler.lambda_handler({}, None)['csvIsEmpty'], f"{module_name} rejects {label} {key}")
+        s3.put('myresult-sc171', key, original.split(b'\n', 1)[0] + b'\n' + b'"x","1","9.5","9.5"\n' * 100000)
+        check_result = handler.lambda_handler({}, None)['csvCheck']
+        check(check_result['bytes_read'] < 16384 and not check_result['sample_is_whole_file'],
+              f"{module_name} reads only the head of a large {key}")
+        s3.put('myresult-sc171', key, original)
+
+    print(f"\n{'query s':>8} {'fixed polls':>12} {'fixed lag s':>12} {'backoff polls':>14} {'backoff lag s':>14}")
+    for run_s in (0.5, 1.5, 5, 20, 120):
+        polls, lag = fixed_loop(run_s)
+        stats, _ = run('latency', run_s=run_s, timeout=600)
+        backoff_lag = stats['wall_ms'] / 1000 - (0.3 + run_s)
+        print(f"{run_s:>8} {polls:>12} {lag:>12.2f} {stats['polls']:>14} {backoff_lag:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from check_athena_runner import check
+from synthetic_airbnb import raw_airbnb_frame
+
+# Runs etl_job --mode incremental over daily drops that disagree on columns
+# and dtypes, against an in-memory S3, and checks that every output has the
+# same header and the same Parquet schema.
+#   python check_etl_incremental.py
+
+
+class StandInS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        body = self.objects[Key]
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(body)}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        yield {'Contents': [{'Key': key, 'ETag': '"' + hashlib.md5(body).hexdigest() + '"'}
+                            for key, body in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+
+def raw_csv(df):
+    return df.to_csv(index=False).encode('latin1')
+
+
+def daily_drops():
+    # day1: bedrooms all present (int). day2: no Host Response Rate or
+    # Review Scores Value columns, and some bedrooms missing (float), which
+    # widens day1's bedrooms after it was written.
+    day1 = raw_airbnb_frame(400, seed=1)
+    day2 = raw_airbnb_frame(400, seed=2).drop(columns=['Host Response Rate', 'Review Scores Value'])
+    day2['Bedrooms'] = day2['Bedrooms'].astype('float64')
+    day2.loc[::7, 'Bedrooms'] = np.nan
+    return {'daily/day1.csv': raw_csv(day1), 'daily/day2.csv': raw_csv(day2)}
+
+
+def outputs(s3, suffix):
+    return sorted(key for key in s3.objects if key.startswith('processed/') and key.endswith(suffix))
+
+
+def main():
+    import etl_job
+    import pyarrow.parquet as pq
+
+    s3 = StandInS3()
+    s3.objects.update(daily_drops())
+    etl_job.s3 = s3
+
+    print("csv")
+    etl_job.run_incremental('daily/', output_format='csv')
+    manifest = json.loads(s3.objects[etl_job.manifest_key])
+    frames = {key: pd.read_csv(io.BytesIO(s3.objects[key])) for key in outputs(s3, '.csv')}
+    check(len(frames) == 2, 'one output per raw object')
+    check(all(list(df.columns) == manifest['columns'] for df in frames.values()),
+          'every output has the manifest column list, in order')
+    check(manifest['columns'] == etl_job.ETL_COLUMNS + etl_job.DERIVED_COLUMNS,
+          'the column list is ETL_COLUMNS plus the derived columns')
+    day1, day2 = (frames[key] for key in sorted(frames))
+    check(day2['host_response_rate'].isna().all() and day2['review_scores_value'].notna().all(),
+          'a column missing from an object is empty, a missing score is filled')
+    check(np.isclose(day2['review_scores_value'].iloc[0], day1['review_scores_value'].mean()),
+          'the fill value comes from the history')
+    check(manifest['kinds']['bedrooms'] == 'float' and day1['bedrooms'].astype(str).str.endswith('.0').all(),
+          'a widened column is rewritten in the earlier object')
+    check(all(entry['kinds']['bedrooms'] == 'float' for entry in manifest['objects'].values()),
+          'the manifest records the kinds each object was written with')
+
+    before = dict(s3.objects)
+    etl_job.run_incremental('daily/', output_format='csv')
+    check(s3.objects == before, 'an unchanged prefix rewrites nothing')
+
+    manifest.pop('kinds')
+    for entry in manifest['objects'].values():
+        entry.pop('kinds')
+    s3.objects[etl_job.manifest_key] = json.dumps(manifest).encode('utf-8')
+    etl_job.run_incremental('daily/', output_format='csv')
+    check('kinds' in json.loads(s3.objects[etl_job.manifest_key]),
+          'a manifest without a recorded layout is rebuilt')
+
+    print("\nparquet")
+    etl_job.run_incremental('daily/', output_format='parquet')
+    schemas = {key: pq.read_schema(io.BytesIO(s3.objects[key])) for key in outputs(s3, '.parquet')}
+    first = next(iter(schemas.values()))
+    check(len(schemas) > 2 and not outputs(s3, '.csv'), 'the format switch replaced every output')
+    check(all(schema.equals(first) for schema in schemas.values()),
+          f'all {len(schemas)} Parquet files have one schema')
+    check(str(first.field('bedrooms').type) == 'double' and str(first.field('host_response_rate').type) == 'string',
+          'bedrooms is double and the missing text column is string everywhere')
+
+
+if __name__ == '__main__':
+    main()
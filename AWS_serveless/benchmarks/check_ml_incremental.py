@@ -0,0 +1,145 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'machine_learning_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from bench_ml_preprocess import write_ml_data
+from check_athena_runner import check
+
+# Chains runs of ml_code.py's main() the way the pipeline does, each one's
+# ml_model.pkl and training_state.pkl becoming the next one's previous
+# model, and checks which rows the saved state counts as trained: a full
+# retrain and an extension hold rows out, a run that keeps the model adds
+# none, and two small batches in a row are both trained on once together
+# they are enough. It also checks that extend() leaves a booster that
+# predicts the previous model plus the residual trees, with its iteration
+# count in step, and only scikit-learn classes in its pickle.
+#   python check_ml_incremental.py
+
+
+def synthetic(rows, seed):
+    path = os.path.join(tempfile.gettempdir(), f'ml_data_{rows}_{seed}.csv')
+    if not os.path.exists(path):
+        write_ml_data(path, rows, seed)
+    return pd.read_csv(path)
+
+
+def run(ml_code, df, mode):
+    # One job on df; returns its state, its ml_incremental record and the row hashes.
+    df.to_csv(ml_code.input_path, index=False)
+    ml_code.hyperparameters = dict(ml_code.hyperparameters, mode=mode)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ml_code.main()
+    records = [json.loads(line) for line in out.getvalue().splitlines() if line.startswith('{')]
+    incremental = next((r for r in records if r['Step'] == 'ml_incremental'), None)
+    state = joblib.load(ml_code.state_path)
+    previous = tempfile.mkdtemp(prefix='previous_')
+    for path in (ml_code.output_path, ml_code.state_path):
+        shutil.copy(path, previous)
+    ml_code.previous_path = previous
+    columns = pd.read_csv(ml_code.input_path, nrows=0).columns
+    hashes = ml_code.row_hashes(pd.read_csv(ml_code.input_path, dtype=ml_code.compact_dtypes(columns)))
+    return state, incremental, hashes
+
+
+def pickled_modules(obj):
+    modules = set()
+
+    class Recorder(pickle.Unpickler):
+        def find_class(self, module, name):
+            modules.add(module.split('.')[0])
+            return super().find_class(module, name)
+    Recorder(io.BytesIO(pickle.dumps(obj))).load()
+    return modules
+
+
+def check_extend(ml_code, history, batch):
+    from sklearn.base import clone
+    X, y = history.drop(columns=[ml_code.TARGET_COL]), history[ml_code.TARGET_COL]
+    X_new, y_new = batch.drop(columns=[ml_code.TARGET_COL]), batch[ml_code.TARGET_COL]
+    pipeline = ml_code.build_pipeline(X, ml_code.hyperparameters)
+    pipeline.named_steps['regressor'].set_params(early_stopping=True)
+    pipeline.fit(X, y)
+    previous = copy.deepcopy(pipeline)
+    regressor, base = pipeline.named_steps['regressor'], pipeline.named_steps['regressor'].n_iter_
+
+    reason = ml_code.extend(pipeline, X_new, y_new, 7)
+    check(reason is None and regressor.n_iter_ == regressor.max_iter == base + 7
+          and len(regressor.train_score_) == len(regressor.validation_score_) == base + 8,
+          'extend keeps n_iter_, max_iter and the scores in step')
+    encode = previous.named_steps['preprocessor'].transform
+    residual = clone(previous.named_steps['regressor']).set_params(max_iter=7, early_stopping=False)
+    residual.fit(encode(X_new), y_new - previous.predict(X_new))
+    check(np.allclose(pipeline.predict(X), previous.predict(X) + residual.predict(encode(X))),
+          'the extended model predicts the previous one plus the residual trees, on other rows too')
+    check(pickled_modules(pipeline) <= {'sklearn', 'numpy', 'builtins', 'copyreg', '_codecs'},
+          'its pickle holds only scikit-learn and numpy classes')
+
+    broken = copy.deepcopy(previous)
+    broken.named_steps['regressor']._predictors = tuple(broken.named_steps['regressor']._predictors)
+    check((ml_code.extend(broken, X_new, y_new, 7) or '').startswith('scikit-learn'),
+          'a booster it cannot extend gives a reason for a full retrain')
+
+
+def accounted(state, hashes):
+    return np.isin(hashes, state['row_hashes']) | np.isin(hashes, state['held_out'])
+
+
+def main():
+    import ml_code
+
+    work = tempfile.mkdtemp(prefix='ml_job_')
+    ml_code.parquet_path = os.path.join(work, 'ml_data')
+    ml_code.input_path = os.path.join(work, 'ml_data.csv')
+    ml_code.output_path = os.path.join(work, 'ml_model.pkl')
+    ml_code.state_path = os.path.join(work, 'training_state.pkl')
+    ml_code.previous_path = os.path.join(work, 'previous')
+    size = ml_code.hyperparameters['test_size']
+
+    history = synthetic(1000, 0)
+    state, _, hashes = run(ml_code, history, 'train')
+    check(len(state['row_hashes']) == round(len(history) * (1 - size)) and len(state['held_out']) == len(history) * size
+          and accounted(state, hashes).all(), 'a full retrain records its training rows, and holds out the rest')
+
+    trained = state['row_hashes']
+    state, record, hashes = run(ml_code, history, 'incremental')
+    check(record['FullRetrain'] is None and record['RowsProcessed'] == len(history) * size
+          and np.isin(trained, state['row_hashes']).all() and len(state['row_hashes']) > len(trained)
+          and accounted(state, hashes).all(), 'the next run trains on the rows the full retrain held out')
+    check(len(state['held_out']) < ml_code.INCREMENTAL_MIN_ROWS, 'of which it holds out fewer than a batch')
+
+    batches = synthetic(70, 5)
+    first, second = batches.iloc[:30], batches.iloc[30:]
+    before = state
+    state, record, hashes = run(ml_code, pd.concat([history, first]), 'incremental')
+    check(record['FullRetrain'] is None and np.array_equal(state['row_hashes'], before['row_hashes'])
+          and np.array_equal(state['held_out'], before['held_out']),
+          'a small batch keeps the model and the state as they were')
+    check(not np.isin(hashes[-len(first):], state['row_hashes']).any(), "so the batch's rows are still new")
+
+    pending = len(before['held_out']) + len(first) + len(second)
+    state, record, hashes = run(ml_code, pd.concat([history, first, second]), 'incremental')
+    check(pending >= ml_code.INCREMENTAL_MIN_ROWS and record['FullRetrain'] is None
+          and record['RowsProcessed'] == pending, 'a second small batch extends the model with both')
+    new_rows = hashes[-len(first) - len(second):]
+    check(accounted(state, hashes).all() and np.isin(new_rows, state['row_hashes']).mean() >= 1 - size - 0.05,
+          'the rows of both batches are trained on or held out, none is lost')
+
+    check_extend(ml_code, history, batches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'machine_learning_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from bench_ml_preprocess import write_ml_data
+from check_athena_runner import check
+
+# Runs the successive-halving search of ml_code.py's mode "tune" on a small
+# synthetic ml_data.csv: its rounds, their ml_tune_round records, the
+# tune_seconds deadline and the pipeline it returns.
+#   python check_ml_tuning.py
+
+
+def search(ml_code, X, y, **overrides):
+    hyperparameters = dict(ml_code.hyperparameters, tune_candidates=12, **overrides)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        model, result = ml_code.tune(ml_code.build_pipeline(X, hyperparameters), X, y, hyperparameters)
+    records = [json.loads(line) for line in out.getvalue().splitlines() if line.startswith('{')]
+    return model, result, [r for r in records if r['Step'] == 'ml_tune_round']
+
+
+def main():
+    import ml_code
+
+    path = os.path.join(tempfile.gettempdir(), 'ml_data_6000.csv')
+    if not os.path.exists(path):
+        write_ml_data(path, 6000)
+    columns = pd.read_csv(path, nrows=0).columns
+    df = pd.read_csv(path, dtype=ml_code.compact_dtypes(columns))
+    X, y = df.drop(columns=[ml_code.TARGET_COL]), df[ml_code.TARGET_COL]
+
+    model, result, records = search(ml_code, X, y)
+    rounds = result['rounds']
+    check([r['candidates'] for r in rounds] == [12, 4, 2], 'each round keeps the best third')
+    check(rounds[-1]['samples'] == len(X) and all(b['samples'] // 3 == a['samples'] for a, b in zip(rounds, rounds[1:])),
+          'each round has three times the rows of the one before, the last all of them')
+    check([(r['Iteration'], r['Candidates'], r['Samples'], r['RowsProcessed']) for r in records]
+          == [(i, r['candidates'], r['samples'], r['samples']) for i, r in enumerate(rounds)],
+          'one ml_tune_round record per round')
+    check(not result['stopped_early'] and set(result['best_params']) == set(ml_code.SEARCH_SPACE)
+          and json.dumps(result['best_params']) and result['cv_rmse'] > 0, 'the best parameters are JSON')
+    check(model.named_steps['regressor'].get_params()['max_leaf_nodes'] == result['best_params']['max_leaf_nodes']
+          and len(model.predict(X.head(10))) == 10, 'the pipeline holds the refitted best regressor')
+    again = search(ml_code, X, y)[1]
+    check(again['best_params'] == result['best_params'], 'the search is reproducible')
+
+    model, result, records = search(ml_code, X, y, tune_seconds=0)
+    check(result['stopped_early'] and len(result['rounds']) == len(records) == 1,
+          'tune_seconds stops the search after the round that passes it')
+    check(len(model.predict(X.head(10))) == 10, 'the best of that round is still refitted')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import hashlib
+import importlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from botocore.exceptions import ClientError, ParamValidationError
+from check_athena_runner import check
+from check_orchestration import StandInGlue, StandInSageMaker, follow, no_sleep
+from model_cache import HYPERPARAMETERS, MODEL_BUCKET, MODEL_FILE, TRAINING_CODE_URI, ModelCache, split_uri
+
+# Exercises model_cache.py and the cache paths of 1_ingest_data.py and
+# 3_ml_process.py against a stand-in S3 that honours If-None-Match / If-Match.
+#   python check_model_cache.py
+
+DATA_URI = "s3://myresult-sc171/ml_data.csv"
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class StandInS3:
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def add(self, uri, body):
+        self.objects[split_uri(uri)] = body
+
+    def etag(self, body):
+        return '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def lookup(self, Bucket, Key, operation):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('404' if operation == 'HeadObject' else 'NoSuchKey', operation)
+        return self.objects[(Bucket, Key)]
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(('head', Key))
+        body = self.lookup(Bucket, Key, 'HeadObject')
+        return {'ETag': self.etag(body), 'ContentLength': len(body)}
+
+    def get_object(self, Bucket, Key):
+        self.calls.append(('get', Key))
+        body = self.lookup(Bucket, Key, 'GetObject')
+        return {'ETag': self.etag(body), 'Body': io.BytesIO(body)}
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None):
+        self.calls.append(('put', Key))
+        current = self.objects.get((Bucket, Key))
+        if IfNoneMatch == '*' and current is not None:
+            raise client_error('PreconditionFailed', 'PutObject')
+        if IfMatch and (current is None or self.etag(current) != IfMatch):
+            raise client_error('PreconditionFailed', 'PutObject')
+        self.objects[(Bucket, Key)] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append(('delete', Key))
+        self.objects.pop((Bucket, Key), None)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.calls.append(('copy', Key))
+        self.objects[(Bucket, Key)] = self.lookup(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key, 'ETag': s3.etag(body), 'Size': len(body)}
+                                    for (bucket, key), body in sorted(s3.objects.items())
+                                    if bucket == Bucket and key.startswith(Prefix)]}
+        return Paginator()
+
+
+class UnconditionalS3(StandInS3):
+    # The client of a boto3 older than model_cache.CONDITIONAL_WRITES_BOTO3.
+    def put_object(self, Bucket, Key, Body, **condition):
+        if condition:
+            raise ParamValidationError(report=f"Unknown parameter in input: {next(iter(condition))!r}")
+        super().put_object(Bucket, Key, Body)
+
+
+class TrainingSageMaker(StandInSageMaker):
+    # Leaves the model in the job's output prefix once it reports Completed.
+    def __init__(self, statuses, s3):
+        super().__init__(statuses)
+        self.s3 = s3
+        self.outputs = {}
+
+    def create_processing_job(self, **kwargs):
+        output = kwargs['ProcessingOutputConfig']['Outputs'][0]['S3Output']['S3Uri']
+        self.outputs[kwargs['ProcessingJobName']] = output
+        return super().create_processing_job(**kwargs)
+
+    def describe_processing_job(self, ProcessingJobName):
+        desc = super().describe_processing_job(ProcessingJobName)
+        if desc['ProcessingJobStatus'] == 'Completed':
+            self.s3.add(self.outputs[ProcessingJobName] + MODEL_FILE, b"model " + ProcessingJobName.encode())
+        return desc
+
+
+class FailingSageMaker(StandInSageMaker):
+    def create_processing_job(self, **kwargs):
+        raise client_error('ResourceLimitExceeded', 'CreateProcessingJob')
+
+
+def seeded_s3():
+    s3 = StandInS3()
+    s3.add(DATA_URI, b"price,brand\n100,a\n")
+    s3.add(TRAINING_CODE_URI, b"print('train')\n")
+    return s3
+
+
+def main():
+    print("fingerprint")
+    s3 = seeded_s3()
+    cache = ModelCache(s3, StandInSageMaker([]))
+    base, document = cache.fingerprint(DATA_URI)
+    check(base == cache.fingerprint(DATA_URI)[0], 'same inputs give the same fingerprint')
+    check(document['data']['objects'][0][0] == 'ml_data.csv', 'document lists the data objects')
+    s3.add(DATA_URI, b"price,brand\n101,a\n")
+    changed_data = cache.fingerprint(DATA_URI)[0]
+    s3.add(DATA_URI, b"price,brand\n100,a\n")
+    s3.add(TRAINING_CODE_URI, b"print('train v2')\n")
+    changed_code = cache.fingerprint(DATA_URI)[0]
+    s3.add(TRAINING_CODE_URI, b"print('train')\n")
+    changed_params = cache.fingerprint(DATA_URI, hyperparameters={'rare_threshold': 0.02})[0]
+    check(len({base, changed_data, changed_code, changed_params}) == 4,
+          'data, code and hyperparameters each change the fingerprint')
+    s3.add("s3://myresult-sc171/ml_data_parquet/part-0.parquet", b"PAR1")
+    prefix = cache.fingerprint("s3://myresult-sc171/ml_data_parquet/")[1]['data']['objects']
+    check(len(prefix) == 1, 'a prefix fingerprints every object under it')
+
+    print("\nclaim")
+    s3 = seeded_s3()
+    sagemaker = StandInSageMaker(['InProgress', 'Failed'])
+    cache = ModelCache(s3, sagemaker)
+    fp, document = cache.fingerprint(DATA_URI)
+    check(cache.claim(fp, 'job-a', document) is None, 'first launch claims the fingerprint')
+    check(cache.claim(fp, 'job-b', document) == 'job-a', 'second launch follows the running job')
+    check(cache.claim(fp, 'job-c', document) is None, 'a failed holder is taken over')
+    check(sagemaker.described == 2, 'the holder is only described on a conflict')
+    cache.release(fp)
+    check((MODEL_BUCKET, cache.job_key(fp)) not in s3.objects, 'release drops the claim')
+
+    print("\nclaim without conditional writes")
+    s3 = UnconditionalS3()
+    s3.add(DATA_URI, b"price,brand\n100,a\n")
+    s3.add(TRAINING_CODE_URI, b"print('train')\n")
+    cache = ModelCache(s3, StandInSageMaker(['InProgress', 'Failed']))
+    fp, document = cache.fingerprint(DATA_URI)
+    check(cache.claim(fp, 'job-a', document) is None and (MODEL_BUCKET, cache.job_key(fp)) in s3.objects,
+          'an older boto3 still claims a new fingerprint')
+    check(cache.claim(fp, 'job-b', document) == 'job-a', 'and follows the running job')
+    check(cache.claim(fp, 'job-c', document) is None and b'job-c' in s3.objects[(MODEL_BUCKET, cache.job_key(fp))],
+          'and takes over a failed one')
+
+    print("\nincremental")
+    s3 = seeded_s3()
+    cache = ModelCache(s3, StandInSageMaker([]))
+    incremental = dict(HYPERPARAMETERS, mode='incremental')
+    fp, document, base = cache.plan(DATA_URI, incremental)
+    check(base is None and 'base_model' not in document, 'with no current model the job trains in full')
+    cache.claim(fp, 'job-a', document)
+    s3.add(cache.output_uri(fp) + MODEL_FILE, b"model job-a")
+    cache.promote(fp)
+    check(cache.current() == fp, 'promote records the current model')
+    check(cache.plan(DATA_URI, incremental)[0] == fp, 'unchanged data reuses the current model')
+    s3.add(DATA_URI, b"price,brand\n100,a\n120,b\n")
+    extended, document, base = cache.plan(DATA_URI, incremental)
+    check(base == fp and document['base_model'] == fp and extended != cache.plan(DATA_URI)[0],
+          'new data extends the current model, which is part of the fingerprint')
+    inputs = cache.previous_model_inputs(base)
+    check(len(inputs) == 1 and inputs[0]['S3Input']['S3Uri'] == cache.output_uri(fp)
+          and not cache.previous_model_inputs(None), 'only an incremental job gets the previous model')
+
+    time.sleep, sleep = no_sleep, time.sleep
+    try:
+        for module in ('1_ingest_data', '3_ml_process'):
+            print(f"\n{module}")
+            handler = importlib.import_module(module)
+            handler.glue = StandInGlue()
+            s3 = seeded_s3()
+
+            handler.sagemaker = sagemaker = TrainingSageMaker(['InProgress', 'Completed'], s3)
+            handler.cache = cache = ModelCache(s3, sagemaker)
+            results = follow(handler, {})
+            fp = results[0]['model_fingerprint']
+            job = sagemaker.created[0]
+            check(len(sagemaker.created) == 1 and job.startswith('ml-' + fp[:16]),
+                  'a new fingerprint trains under a name that carries it')
+            check(sagemaker.outputs[job] == f"s3://{MODEL_BUCKET}/models/{fp}/", 'job writes under the fingerprint')
+            check(results[-1]['statusCode'] == 200 and results[-1]['model_uri'].endswith(f"{fp}/{MODEL_FILE}"),
+                  'the completed job promotes its model')
+
+            handler.sagemaker = sagemaker = StandInSageMaker([])
+            handler.cache = cache = ModelCache(s3, sagemaker)
+            s3.calls.clear()
+            result = handler.lambda_handler({}, None)
+            check(result['statusCode'] == 200 and not sagemaker.created and result['processing_job'] is None,
+                  'unchanged data, code and hyperparameters skip SageMaker')
+            check(s3.objects[(MODEL_BUCKET, MODEL_FILE)] == b"model " + job.encode()
+                  and result['model_uri'].endswith(f"{fp}/{MODEL_FILE}"), 'the cached model is promoted')
+            check(('put', cache.job_key(fp)) not in s3.calls, 'a cache hit writes no claim')
+
+            s3.add(DATA_URI, b"price,brand\n250,b\n")
+            handler.sagemaker = sagemaker = StandInSageMaker(['InProgress'] * 4)
+            handler.cache = ModelCache(s3, sagemaker)
+            first = handler.lambda_handler({}, None)
+            second = handler.lambda_handler({}, None)
+            check(len(sagemaker.created) == 1 and second['statusCode'] == 202
+                  and second['processing_job'] == first['processing_job'],
+                  'an identical launch in flight is followed, not duplicated')
+
+            s3.add(DATA_URI, b"price,brand\n300,c\n")
+            handler.sagemaker = FailingSageMaker([])
+            handler.cache = cache = ModelCache(s3, handler.sagemaker)
+            try:
+                result = handler.lambda_handler({}, None)
+            except ClientError:
+                result = {'statusCode': 500}
+            fp = cache.fingerprint(DATA_URI)[0]
+            check(result['statusCode'] == 500 and (MODEL_BUCKET, cache.job_key(fp)) not in s3.objects,
+                  'a job that fails to start releases its claim')
+    finally:
+        time.sleep = sleep
+
+
+if __name__ == '__main__':
+    main()
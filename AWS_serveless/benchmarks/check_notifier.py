@@ -0,0 +1,149 @@
+import importlib
+import json
+import os
+import sys
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from notifier import MAX_BATCH_BYTES, MAX_BATCH_ENTRIES, MAX_MESSAGE_BYTES, Notifier, notification
+from check_athena_runner import check
+
+# Exercises the run digest of notifier.py and 7_sendsns.py against a
+# stand-in SNS client, the notifications 1_ingest_data.py and 3_ml_process.py
+# return instead of publishing, and the NotifyRun wiring of the state machine.
+#   python check_notifier.py
+
+STEPS = os.path.join(os.path.dirname(__file__), '..', 'step_function_json', 'steps.json')
+
+
+class StandInSNS:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def publish(self, **kwargs):
+        raise AssertionError("publish called; notifications go through publish_batch")
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.calls.append((TopicArn, PublishBatchRequestEntries))
+        if self.fail:
+            return {'Successful': [], 'Failed': [{'Id': e['Id'], 'Code': 'InternalError', 'Message': 'boom',
+                                                  'SenderFault': False} for e in PublishBatchRequestEntries]}
+        return {'Successful': [{'Id': e['Id'], 'MessageId': f"m-{e['Id']}"} for e in PublishBatchRequestEntries],
+                'Failed': []}
+
+
+class StandInSageMaker:
+    def create_processing_job(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ResourceLimitExceeded', 'Message': 'quota'}}, 'CreateProcessingJob')
+
+
+class FailedJobSageMaker:
+    def describe_processing_job(self, ProcessingJobName):
+        return {'ProcessingJobStatus': 'Failed', 'FailureReason': 'AlgorithmError: out of memory'}
+
+
+def states(definition):
+    # Every state, branches included, by name.
+    for name, state in definition['States'].items():
+        yield name, state
+        for branch in state.get('Branches', []):
+            yield from states(branch)
+
+
+def main():
+    print("digest")
+    handler = importlib.import_module('7_sendsns')
+    handler.sns = sns = StandInSNS()
+    result = handler.lambda_handler({}, None)
+    entry = sns.calls[0][1][0]
+    check(len(sns.calls) == 1 and entry['Subject'] == 'CSV File Processed Successfully'
+          and 's3://myresult-sc171/property_insights.csv has been generated' in entry['Message'],
+          'standalone 7_sendsns sends the old property_insights message')
+    price = importlib.import_module('10_sensns')
+    price.sns = sns = StandInSNS()
+    price.lambda_handler({}, None)
+    check('price_range.csv' in sns.calls[0][1][0]['Message'], 'standalone 10_sensns sends the price_range message')
+
+    run = {'run_id': 'run-1', 'error': None, 'notifications': [
+        notification('ingest_completed', subject='Pipeline Completed Successfully', message='Job done.'),
+        notification('report_ready', bucket='myresult-sc171', key='property_insights.csv'),
+        notification('report_ready', bucket='myresult-sc171', key='price_range.csv'),
+    ]}
+    handler.sns = sns = StandInSNS()
+    result = handler.lambda_handler(run, None)
+    check(len(sns.calls) == 1 and len(sns.calls[0][1]) == 1 and result['published']['notifications'] == 3,
+          'three notifications of a run go out as one message in one call')
+
+    failed = dict(run, error={'Error': 'States.TaskFailed', 'Cause': 'RDS unreachable'})
+    failed['notifications'] = run['notifications'] + [notification(
+        'crawler_failed', 'error', subject='Glue Crawler Failed', message='Failed to start Glue Crawler')]
+    handler.sns = sns = StandInSNS()
+    handler.lambda_handler(failed, None)
+    entry = sns.calls[0][1][0]
+    body = entry['Message'].splitlines()
+    check(entry['Subject'].startswith('Pipeline run-1: 2 of 5') and body[3].startswith('[ERROR]')
+          and body[5].startswith('[ERROR]') and 'States.TaskFailed: RDS unreachable' in entry['Message'],
+          'run error and failures lead the digest')
+
+    many = [notification('big', message=('x' * 1000 + '\n') * 100) for _ in range(40)]
+    sns = StandInSNS()
+    result = Notifier(sns).publish_digest('arn:topic', 'run-2', many)
+    sizes = [sum(len(e['Message'].encode()) + len(e['Subject']) for e in batch) for _, batch in sns.calls]
+    messages = [e['Message'] for _, batch in sns.calls for e in batch]
+    check(result['messages'] > 1 and all(len(m.encode()) <= MAX_MESSAGE_BYTES for m in messages)
+          and all(s <= MAX_BATCH_BYTES for s in sizes)
+          and all(len(batch) <= MAX_BATCH_ENTRIES for _, batch in sns.calls)
+          and ''.join(messages).count('x' * 1000) == 4000,
+          f"a {sum(len(m) for m in messages) // 1024} KB digest is split into {result['messages']} parts "
+          f"within the SNS limits")
+
+    handler.sns = StandInSNS(fail=True)
+    try:
+        handler.lambda_handler(run, None)
+        raised = False
+    except RuntimeError:
+        raised = True
+    check(raised, 'rejected batch entries fail the invocation')
+
+    print("\n1_ingest_data")
+    ingest = importlib.import_module('1_ingest_data')
+    ingest.sagemaker = StandInSageMaker()
+    result = ingest.lambda_handler({}, None)
+    check(result['statusCode'] == 500 and result['notifications'][0]['severity'] == 'error'
+          and result['notifications'][0]['subject'] == 'SageMaker Job Launch Failed'
+          and not hasattr(ingest, 'sns'),
+          'launch failure is returned as a notification, not published')
+
+    print("\n3_ml_process")
+    ml = importlib.import_module('3_ml_process')
+    ml.sagemaker = FailedJobSageMaker()
+    result = ml.lambda_handler({'processing_job': 'ml-job', 'model_fingerprint': 'fp'}, None)
+    check(result['statusCode'] == 500 and result['notifications'][0]['severity'] == 'error'
+          and result['notifications'][0]['subject'] == 'SageMaker Job Failed: ml-job'
+          and 'out of memory' in result['notifications'][0]['message'] and not hasattr(ml, 'sns'),
+          'a failed job is returned as a notification, not published')
+
+    print("\nstate machine")
+    with open(STEPS) as f:
+        definition = json.load(f)
+    by_name = dict(states(definition))
+    invoked = {state['Arguments']['FunctionName'].split(':function:')[1].split(':')[0]: state
+               for state in by_name.values() if state.get('Resource') == 'arn:aws:states:::lambda:invoke'}
+    check('10_sensns' not in invoked and invoked['7_sendsns'] is by_name['NotifyRun'],
+          '7_sendsns runs once per run, from NotifyRun')
+    check(by_name['NotifyRun']['Arguments']['InvocationType'] == 'Event', 'NotifyRun does not wait for SNS')
+    check(by_name['Parallel']['Next'] == 'NotifyRun'
+          and by_name['Parallel']['Catch'][0]['Next'] == 'NotifyRun', 'failed runs are notified too')
+    check('mlJobNotifications' in by_name['MLprocess']['Assign'] and 'mlNotifications' in by_name['Parallel']['Assign']
+          and '$mlNotifications' in by_name['NotifyRun']['Arguments']['Payload']['notifications'],
+          "3_ml_process's notifications reach NotifyRun")
+    targets = {t for s in by_name.values() for t in [s.get('Next'), s.get('Default')]
+               + [c['Next'] for c in s.get('Choices', []) + s.get('Catch', [])] if t}
+    check(targets <= set(by_name), 'every transition has a target state')
+
+
+if __name__ == '__main__':
+    main()
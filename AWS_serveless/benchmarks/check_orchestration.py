@@ -0,0 +1,122 @@
+import importlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from check_athena_runner import check
+from check_notifier import states
+
+# Exercises the start / check invocations of 1_ingest_data.py and
+# 3_ml_process.py against stand-in clients, and the status loops of the
+# state machine that replaced its fixed Wait states.
+#   python check_orchestration.py
+
+STEPS = os.path.join(os.path.dirname(__file__), '..', 'step_function_json', 'steps.json')
+
+
+class StandInSageMaker:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.created = []
+        self.described = 0
+
+    def create_processing_job(self, **kwargs):
+        self.created.append(kwargs['ProcessingJobName'])
+        return {'ProcessingJobArn': 'arn:job'}
+
+    def describe_processing_job(self, ProcessingJobName):
+        self.described += 1
+        status = self.statuses.pop(0)
+        return {'ProcessingJobStatus': status, 'FailureReason': 'out of memory'}
+
+
+class StandInGlue:
+    class exceptions:
+        class CrawlerRunningException(Exception):
+            pass
+
+    def __init__(self):
+        self.crawls = 0
+
+    def start_crawler(self, Name):
+        self.crawls += 1
+
+
+def no_sleep(seconds):
+    raise AssertionError(f"handler slept {seconds} s")
+
+
+def follow(handler, event, limit=10):
+    # What the state machine does: re-invoke with the result while the job runs.
+    results = [handler.lambda_handler(event, None)]
+    while results[-1].get('job_status') in ('InProgress', 'Stopping') and len(results) < limit:
+        results.append(handler.lambda_handler(dict(results[-1], run_id='exec-1'), None))
+    return results
+
+
+def stand_in(handler, statuses):
+    # The job trains a fingerprint with no stored model, so every launch starts one.
+    from check_model_cache import TrainingSageMaker, seeded_s3
+    s3 = seeded_s3()
+    handler.sagemaker = sagemaker = TrainingSageMaker(statuses, s3)
+    handler.cache = handler.ModelCache(s3, sagemaker)
+    return sagemaker
+
+
+def main():
+    time.sleep, sleep = no_sleep, time.sleep
+    try:
+        print("1_ingest_data")
+        ingest = importlib.import_module('1_ingest_data')
+        sagemaker = stand_in(ingest, ['InProgress', 'InProgress', 'Completed'])
+        ingest.glue = glue = StandInGlue()
+        results = follow(ingest, {'run_id': 'exec-1'})
+        check(results[0]['statusCode'] == 202 and len(sagemaker.created) == 1 and sagemaker.described == 3,
+              'first invocation starts the job and returns')
+        check(len(results) == 4 and results[-1]['statusCode'] == 200 and glue.crawls == 1
+              and results[-1]['notifications'][0]['event'] == 'ingest_completed',
+              'each check describes once; the one that sees Completed starts the crawler')
+        check(all(r['processing_job'] == sagemaker.created[0] for r in results), 'results carry the job name')
+
+        stand_in(ingest, ['InProgress', 'Failed'])
+        ingest.glue = glue = StandInGlue()
+        results = follow(ingest, {})
+        check(results[-1]['statusCode'] == 500 and results[-1]['job_status'] == 'Failed' and glue.crawls == 0
+              and results[-1]['notifications'][0]['event'] == 'sagemaker_job_failed',
+              'failed job ends the loop with its notification')
+
+        print("\n3_ml_process")
+        ml = importlib.import_module('3_ml_process')
+        sagemaker = stand_in(ml, ['InProgress', 'Stopping', 'Completed'])
+        results = follow(ml, {'export_format': 'csv'})
+        check(results[0]['statusCode'] == 202 and len(results) == 4 and results[-1]['statusCode'] == 200
+              and sagemaker.described == 3, 'start, then one describe per check until Completed')
+    finally:
+        time.sleep = sleep
+
+    print("\nstate machine")
+    with open(STEPS) as f:
+        definition = json.load(f)
+    by_name = dict(states(definition))
+    waits = {name: state for name, state in by_name.items() if state['Type'] == 'Wait'}
+
+    def reaches(start, target, seen=()):
+        # Whether target can be reached from start without passing target.
+        state = by_name[start]
+        nexts = [state.get('Next'), state.get('Default')] + [c['Next'] for c in state.get('Choices', [])]
+        return any(n == target or (n and n not in seen and reaches(n, target, seen + (n,))) for n in nexts)
+
+    seconds = ', '.join(f"{name} {state['Seconds']} s" for name, state in waits.items())
+    check(all(state['Seconds'] <= 30 for state in waits.values()), f"no fixed wait: {seconds}")
+    check(all(reaches(name, name) for name in waits), 'every Wait is part of a status loop')
+    check(by_name['WaitForIngestJob']['Next'] == 'IngestData' and by_name['WaitForMLJob']['Next'] == 'MLprocess',
+          'SageMaker jobs are checked by re-invoking their handler')
+    check(by_name['ETLDone']['Default'] == 'ETLFailed' and by_name['Parallel (1)']['Catch'][0]['Next'] == 'NotifyRun',
+          'a failed ETL run fails the run and is notified')
+
+
+if __name__ == '__main__':
+    main()
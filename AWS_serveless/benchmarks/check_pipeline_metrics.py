@@ -0,0 +1,195 @@
+import io
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import boto3
+import pipeline_metrics
+from check_athena_runner import check
+from check_notifier import states
+from pipeline_metrics import METRICS, instrumented
+
+# Exercises the EMF records of pipeline_metrics.py: their structure, nested
+# steps, the S3 calls and bytes an instrumented client reports (against a
+# small local S3 endpoint), the run id from the event, the steps of
+# etl_job.py --mode full and the run_id in every Lambda payload of the state
+# machine.
+#   python check_pipeline_metrics.py
+
+STEPS = os.path.join(os.path.dirname(__file__), '..', 'step_function_json', 'steps.json')
+
+
+class LocalS3(BaseHTTPRequestHandler):
+    # Path-style GetObject (with Range), PutObject, ListObjectsV2 and
+    # DeleteObjects over a dict; enough for etl_job.py --mode full.
+    # HTTP/1.1 so that PutObject's Expect: 100-continue is answered.
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _target(self):
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        return bucket, unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_PUT(self):
+        bucket, key, _ = self._target()
+        self.objects[(bucket, key)] = self._body()
+        self._send(200, headers={'ETag': f'"{len(self.objects[(bucket, key)]):x}"'})
+
+    def do_GET(self):
+        bucket, key, query = self._target()
+        if 'list-type' in query:
+            prefix = query.get('prefix', [''])[0]
+            contents = ''.join(f"<Contents><Key>{escape(k)}</Key><ETag>\"{len(v):x}\"</ETag>"
+                               f"<Size>{len(v)}</Size></Contents>"
+                               for (b, k), v in sorted(self.objects.items()) if b == bucket and k.startswith(prefix))
+            self._send(200, f"<ListBucketResult><Name>{bucket}</Name><IsTruncated>false</IsTruncated>"
+                            f"{contents}</ListBucketResult>".encode())
+            return
+        body = self.objects.get((bucket, key))
+        if body is None:
+            self._send(404, b"<Error><Code>NoSuchKey</Code><Message>missing</Message></Error>")
+            return
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(body) - 1), len(body) - 1)
+            self._send(206, body[start:end + 1], {'Content-Range': f'bytes {start}-{end}/{len(body)}'})
+        else:
+            self._send(200, body)
+
+    def do_POST(self):
+        bucket, _, query = self._target()
+        if 'delete' in query:
+            keys = re.findall(rb'<Key>(.*?)</Key>', self._body())
+            for key in keys:
+                self.objects.pop((bucket, key.decode()), None)
+            self._send(200, b"<DeleteResult></DeleteResult>")
+        else:
+            self._send(400)
+
+    def log_message(self, *args):
+        pass
+
+
+def records(lines):
+    return [json.loads(line) for line in lines]
+
+
+def valid_emf(record):
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    names = [m['Name'] for m in directive['Metrics']]
+    return (isinstance(record['_aws']['Timestamp'], int)
+            and names == [name for name, _ in METRICS]
+            and all(isinstance(record[name], (int, float)) for name in names)
+            and all(dim in record for dims in directive['Dimensions'] for dim in dims))
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalS3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    s3 = pipeline_metrics.instrument(boto3.client(
+        's3', endpoint_url=f'http://127.0.0.1:{server.server_port}', aws_access_key_id='check',
+        aws_secret_access_key='check', config=boto3.session.Config(s3={'addressing_style': 'path'},
+                                                                    retries={'max_attempts': 1})))
+
+    print("handler step")
+    lines = []
+
+    @instrumented('WriteThenRead')
+    def handler(event, context):
+        with pipeline_metrics.Step('upload', emit=lines.append):
+            s3.put_object(Bucket='b', Key='k', Body=b'x' * 1000)
+            pipeline_metrics.add(rows=10)
+        s3.get_object(Bucket='b', Key='k')['Body'].read()
+        try:
+            s3.get_object(Bucket='b', Key='missing')
+        except s3.exceptions.NoSuchKey:
+            pass
+        return {'statusCode': 200}
+
+    out = io.StringIO()
+    sys.stdout, saved = out, sys.stdout
+    try:
+        handler({'run_id': 'exec-1'}, None)
+    finally:
+        sys.stdout = saved
+    child, parent = records(lines)[0], records(out.getvalue().splitlines())[0]
+    check(valid_emf(child) and valid_emf(parent), 'records are valid EMF with every metric')
+    check(child['RunId'] == parent['RunId'] == 'exec-1' and child['Parent'] == 'WriteThenRead',
+          'run id comes from the event and nested steps inherit it')
+    check(child['BytesWritten'] == 1000 and child['AwsCalls'] == 1 and child['RowsProcessed'] == 10,
+          'upload step counts its PutObject and rows')
+    check(parent['AwsCalls'] == 3 and parent['AwsCallErrors'] == 1 and parent['BytesRead'] == 1000
+          and parent['BytesWritten'] == 1000 and parent['AwsCallsByOperation']['s3.GetObject']['calls'] == 2,
+          f"handler rolls up the nested calls: {parent['AwsCallsByOperation']}")
+    check(parent['RowsProcessed'] == 0, 'rows stay with the step that counted them')
+    check(pipeline_metrics.current() is None, 'no step left running')
+
+    lines = []
+    try:
+        with pipeline_metrics.Step('broken', 'exec-2', emit=lines.append):
+            raise ValueError('boom')
+    except ValueError:
+        pass
+    broken = records(lines)[0]
+    check(broken['Status'] == 'error' and broken['Error'] == 'ValueError', 'failed step is recorded and re-raised')
+    s3.get_object(Bucket='b', Key='k')
+    check(pipeline_metrics.current() is None, 'calls outside any step are ignored')
+
+    print("\netl_job --mode full")
+    import etl_job
+    from synthetic_airbnb import raw_airbnb_frame
+    frame = raw_airbnb_frame(2000, seed=3)
+    raw = frame.to_csv(index=False).encode('latin1', 'replace')
+    s3.put_object(Bucket=etl_job.bucket, Key=etl_job.input_key, Body=raw)
+    etl_job.s3 = s3
+    out = io.StringIO()
+    sys.stdout, saved, argv = out, sys.stdout, sys.argv
+    sys.argv = ['etl_job.py', '--mode', 'full', '--run_id', 'exec-3']
+    try:
+        etl_job.main()
+    finally:
+        sys.stdout, sys.argv = saved, argv
+    steps = {r['Step']: r for r in records(line for line in out.getvalue().splitlines() if line.startswith('{'))}
+    job = steps.get('etl_job', {})
+    check(list(steps) == ['etl_read', 'etl_clean', 'etl_write', 'etl_job'] and valid_emf(job),
+          f"one record per phase and one for the job: {list(steps)}")
+    check(all(r['RunId'] == 'exec-3' for r in steps.values()) and job['Mode'] == 'full',
+          'job records carry --run_id and the mode')
+    written = LocalS3.objects[(etl_job.bucket, etl_job.output_key)]
+    check(job['BytesRead'] >= len(raw) and job['BytesWritten'] >= len(written)
+          and steps['etl_read']['RowsProcessed'] == len(frame) and job['RowsProcessed'] == steps['etl_write']['RowsProcessed'],
+          f"job read {job['BytesRead']} B, wrote {job['BytesWritten']} B, {job['RowsProcessed']} rows")
+
+    print("\nstate machine")
+    with open(STEPS) as f:
+        definition = json.load(f)
+    payloads = [json.dumps(state['Arguments']['Payload']) for _, state in states(definition)
+                if state.get('Resource') == 'arn:aws:states:::lambda:invoke']
+    check(payloads and all('run_id' in payload for payload in payloads),
+          f"all {len(payloads)} Lambda payloads carry run_id")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_code'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL_job_code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import athena_reports
+
+# Runs the two report queries the handlers used to send to Athena and the
+# combined GROUPING SETS query on a synthetic processed table in DuckDB,
+# splits the combined result with athena_reports.split_reports and checks
+# that both reports match row for row.
+#   python check_single_scan_reports.py --rows 1000000
+
+PREVIOUS_QUERIES = {
+    'property_insights': """
+    SELECT
+        property_type,
+        COUNT(*) AS number_of_listings,
+        AVG(review_scores_accuracy) AS avg_accuracy,
+        AVG(review_scores_communication) AS avg_communication,
+        AVG(review_scores_location) AS avg_location,
+        AVG(review_scores_value) AS avg_value
+    FROM processed
+    WHERE number_of_reviews > 5
+    GROUP BY property_type
+    ORDER BY number_of_listings DESC;
+    """,
+    'price_range': """
+    SELECT
+    CASE
+        WHEN price < 50 THEN 'Budget (Under $50)'
+        WHEN price >= 50 AND price < 150 THEN 'Mid-range ($50-$149)'
+        WHEN price >= 150 AND price < 300 THEN 'Upper Mid-range ($150-$299)'
+        ELSE 'Luxury ($300+)'
+        END AS price_tier,
+        COUNT(*) AS number_of_listings,
+        AVG(review_scores_accuracy) AS avg_accuracy,
+        AVG(review_scores_value) AS avg_value
+    FROM
+        processed
+    WHERE
+        number_of_reviews > 5 AND price IS NOT NULL
+    GROUP BY
+        CASE
+            WHEN price < 50 THEN 'Budget (Under $50)'
+            WHEN price >= 50 AND price < 150 THEN 'Mid-range ($50-$149)'
+            WHEN price >= 150 AND price < 300 THEN 'Upper Mid-range ($150-$299)'
+            ELSE 'Luxury ($300+)'
+        END
+    ORDER BY
+        MIN(price);
+    """,
+}
+
+
+def processed_frame(rows):
+    import etl_job
+    from synthetic_airbnb import raw_airbnb_frame
+
+    raw = raw_airbnb_frame(rows, seed=7)
+    # A few NULL property types exercise the GROUPING() split.
+    raw.loc[raw.sample(frac=0.001, random_state=1).index, 'Property type'] = np.nan
+    buffer = io.StringIO()
+    raw.to_csv(buffer, index=False)
+    buffer.seek(0)
+    return etl_job.clean_airbnb_data(etl_job.read_frame(buffer, raw.columns.tolist()))
+
+
+def athena_csv(df):
+    # Result file as Athena writes it: all values quoted, NULL left empty.
+    values = df.astype(object).where(df.notna(), None)
+    lines = [athena_reports.athena_csv_line(df.columns.tolist())]
+    for row in values.itertuples(index=False):
+        lines.append(athena_reports.athena_csv_line(['' if v is None else repr(v) if isinstance(v, float)
+                                                     else str(v) for v in row]))
+    return ''.join(lines)
+
+
+def same_report(expected, actual, key):
+    if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+        return False
+    if key == 'property_type':
+        # Ties in number_of_listings have no defined order in either query.
+        expected = expected.sort_values(['number_of_listings', key], ascending=[False, True], na_position='last')
+        actual = actual.sort_values(['number_of_listings', key], ascending=[False, True], na_position='last')
+    expected, actual = expected.reset_index(drop=True), actual.reset_index(drop=True)
+    for col in expected.columns:
+        if pd.api.types.is_float_dtype(expected[col]):
+            if not np.allclose(expected[col], actual[col], equal_nan=True):
+                return False
+        elif not expected[col].astype(str).equals(actual[col].astype(str)):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    processed = processed_frame(args.rows)
+    con = duckdb.connect()
+    con.register('processed', processed)
+
+    start = time.perf_counter()
+    previous = {name: con.execute(sql).df() for name, sql in PREVIOUS_QUERIES.items()}
+    two_queries = time.perf_counter() - start
+
+    start = time.perf_counter()
+    combined = con.execute(athena_reports.REPORTS_QUERY).df()
+    one_query = time.perf_counter() - start
+    reports = {name: pd.read_csv(io.StringIO(text))
+               for name, text in athena_reports.split_reports(athena_csv(combined)).items()}
+
+    ok = True
+    for name, key in (('property_insights', 'property_type'), ('price_range', 'price_tier')):
+        match = same_report(previous[name], reports[name], key)
+        ok &= match
+        print(f"{name:<18} {len(reports[name]):>3} rows  {'match' if match else 'MISMATCH'}")
+    print(f"\n{len(processed)} processed rows: 2 queries (2 scans) {two_queries * 1000:.0f} ms, "
+          f"combined query (1 scan) {one_query * 1000:.0f} ms")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic stand-in for airbnb_ratings_new.csv with the raw column names of
+# the Kaggle dump, including the wide text columns the pipeline never reads.
+
+CITIES = ['Austin', 'Boston', 'Denver', 'Los Angeles', 'Nashville', 'New Orleans',
+          'New York', 'Portland', 'San Diego', 'San Francisco', 'Seattle', 'Washington']
+STATES = ['TX', 'MA', 'CO', 'CA', 'TN', 'LA', 'NY', 'OR', 'CA', 'CA', 'WA', 'DC']
+PROPERTY_TYPES = ['Apartment', 'House', 'Condominium', 'Loft', 'Townhouse', 'Guest suite',
+                  'Villa', 'Bungalow', 'Boat', 'Dorm', 'Camper/RV', 'Other']
+ROOM_TYPES = ['Entire home/apt', 'Private room', 'Shared room']
+AMENITIES = ['TV', 'Wireless Internet', 'Air Conditioning', 'Kitchen', 'Heating',
+             'Washer', 'Dryer', 'Shampoo', 'Essentials', 'Hair Dryer', 'Elevator',
+             'Gym', 'Pool', 'Free Parking on Premises', 'Smoke Detector']
+
+
+def amenities_strings(rng, n):
+    flags = rng.random((n, len(AMENITIES))) < 0.45
+    patterns = {}
+    codes = flags @ (1 << np.arange(len(AMENITIES)))
+    out = np.empty(n, dtype=object)
+    for i, code in enumerate(codes):
+        text = patterns.get(code)
+        if text is None:
+            items = [a if ' ' not in a else f'"{a}"' for j, a in enumerate(AMENITIES) if code >> j & 1]
+            text = patterns[code] = '{' + ','.join(items) + '}'
+        out[i] = text
+    return out
+
+
+def with_nans(rng, values, rate):
+    values = values.astype('float64')
+    values[rng.random(len(values)) < rate] = np.nan
+    return values
+
+
+def raw_airbnb_frame(n, seed=0, duplicate_rate=0.01):
+    rng = np.random.default_rng(seed)
+    city_idx = rng.integers(0, len(CITIES), n)
+    price = np.round(rng.lognormal(4.8, 0.8, n))
+    df = pd.DataFrame({
+        'Listing ID': np.arange(1, n + 1),
+        'Name': [f'Cozy place #{i}' for i in range(n)],
+        'Summary': 'Bright and quiet space close to downtown, cafes and public transport. ' * 3,
+        'Description': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 8,
+        'Host ID': rng.integers(1, n // 3 + 2, n),
+        'Host Name': rng.choice(['Alex', 'Sam', 'Jordan', 'Taylor', 'Chris'], n),
+        'Host Since': '2015-06-01',
+        'Host Response Rate': rng.choice(['100%', '90%', '80%', 'N/A'], n),
+        'Host Is Superhost': rng.choice(['t', 'f'], n, p=[0.2, 0.8]),
+        'Host total listings count': rng.integers(1, 30, n),
+        'Street': 'Main Street',
+        'City': np.array(CITIES)[city_idx],
+        'Neighbourhood cleansed': rng.choice(['Downtown', 'Midtown', 'Uptown', 'Riverside'], n),
+        'State': np.array(STATES)[city_idx],
+        'Country': 'United States',
+        'latitude': np.round(rng.uniform(25, 48, n), 6),
+        'longitude': np.round(rng.uniform(-123, -71, n), 6),
+        'Property type': rng.choice(PROPERTY_TYPES, n),
+        'Room type': rng.choice(ROOM_TYPES, n, p=[0.6, 0.35, 0.05]),
+        'Accommodates': rng.integers(1, 12, n),
+        'Bathrooms': rng.choice([1.0, 1.5, 2.0, 2.5, 3.0], n),
+        'Bedrooms': rng.integers(0, 6, n),
+        'Beds': rng.integers(1, 8, n),
+        'Amenities': amenities_strings(rng, n),
+        'Price': with_nans(rng, price, 0.01),
+        'Minimum nights': rng.integers(1, 30, n),
+        'Maximum nights': rng.integers(30, 1125, n),
+        'Availability 365': rng.integers(0, 366, n),
+        'Calendar last scraped': '2017-05-03',
+        'Number of reviews': rng.integers(0, 300, n),
+        'Last Review Date': '2017-04-30',
+        'Review Scores Rating': with_nans(rng, rng.integers(20, 101, n), 0.15),
+        'Review Scores Accuracy': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Review Scores Cleanliness': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Review Scores Checkin': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Review Scores Communication': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Review Scores Location': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Review Scores Value': with_nans(rng, rng.integers(2, 11, n), 0.15),
+        'Reviews per month': np.round(rng.exponential(1.5, n), 2),
+        'License': np.nan,
+    })
+    dup_count = int(n * duplicate_rate)
+    if dup_count:
+        df = pd.concat([df, df.sample(dup_count, random_state=seed)], ignore_index=True)
+    return df
+
+
+def write_raw_csv(path, n, seed=0, chunk_rows=250000):
+    # Written in slices so multi-million-row files do not need one huge frame.
+    written = 0
+    part = 0
+    while written < n:
+        rows = min(chunk_rows, n - written)
+        df = raw_airbnb_frame(rows, seed=seed + part)
+        df['Listing ID'] += written
+        df.to_csv(path, mode='w' if part == 0 else 'a', header=part == 0,
+                  index=False, encoding='latin1')
+        written += rows
+        part += 1
+    return path
@@ -1,33 +1,36 @@
-import json
-import boto3
+import os
+from aws_clients import lazy_client
+from notifier import DEFAULT_TOPIC_ARN, Notifier, notification
+from pipeline_metrics import instrumented
 
-sns = boto3.client('sns')
+sns = lazy_client('sns')
 
 FIXED_OUTPUT_BUCKET = 'myresult-sc171'
 FIXED_TARGET_KEY = 'price_range.csv'
-SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:514475511198:query_result'
+SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', DEFAULT_TOPIC_ARN)
 
+@instrumented('NotifyPriceRange')
 def lambda_handler(event, context):
-    subject = "CSV File Processed Successfully"
-    message = f"The CSV file s3://{FIXED_OUTPUT_BUCKET}/{FIXED_TARGET_KEY} has been generated and contains content. Setup is complete."
+    # NotifyRun passes the notifications of the whole run (and its error, if
+    # it failed); run standalone, this sends the report_ready of price_range.csv.
+    notifications = event.get('notifications')
+    if notifications is None:
+        notifications = [notification('report_ready', bucket=FIXED_OUTPUT_BUCKET, key=FIXED_TARGET_KEY)]
+    notifications = list(notifications)
+    if event.get('error'):
+        notifications.append(notification('run_failed', 'error', error=event['error'].get('Error'),
+                                          cause=event['error'].get('Cause')))
 
     try:
         print(f"Publishing SNS to: {SNS_TOPIC_ARN}")
-        print(f"Message: {message}")
-
-        response = sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Message=message,
-            Subject=subject
-        )
-
-        print("SNS Publish Response:", response)
+        result = Notifier(sns).publish_digest(SNS_TOPIC_ARN, event.get('run_id'), notifications)
 
         return {
             'status': 'Success notification sent',
-            'message': message
+            'message': result['subject'],
+            'published': result
         }
 
     except Exception as e:
         print(f"Error sending SNS notification: {str(e)}")
-        raise e
\ No newline at end of file
+        raise e
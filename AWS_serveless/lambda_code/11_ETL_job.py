@@ -1,29 +1,44 @@
 import json
-import boto3
+from aws_clients import lazy_client
 import os
+from pipeline_metrics import CODE_URI, current_run_id, instrumented
 
 
-glue = boto3.client('glue')
+glue = lazy_client('glue')
 
 
 GLUE_JOB_NAME = os.environ.get('GLUE_JOB_NAME', 'etl_job')
+ETL_MODE = os.environ.get('ETL_MODE', 'full')
+ETL_OUTPUT_FORMAT = os.environ.get('ETL_OUTPUT_FORMAT', 'csv')
+RAW_PREFIX = os.environ.get('RAW_PREFIX', '')
+ETL_WORKERS = os.environ.get('ETL_WORKERS', '0')
 
 
 INPUT_PATH = 's3://raw-data-sc171/airbnb_ratings_new.csv'
 OUTPUT_PATH = 's3://raw-data-sc171/airbnb_ratings_new.csv'
 
+@instrumented('ETLprocess')
 def lambda_handler(event, context):
     try:
         response = glue.start_job_run(
             JobName=GLUE_JOB_NAME,
             Arguments={
                 '--input_path': INPUT_PATH,
-                '--output_path': OUTPUT_PATH
+                '--output_path': OUTPUT_PATH,
+                '--mode': event.get('etl_mode', ETL_MODE),
+                '--output_format': event.get('etl_output_format', ETL_OUTPUT_FORMAT),
+                '--raw_prefix': event.get('raw_prefix', RAW_PREFIX),
+                '--workers': str(event.get('etl_workers', ETL_WORKERS)),
+                '--run_id': current_run_id(),
+                '--extra-py-files': CODE_URI
             }
         )
 
+        # jobName and jobRunId let the state machine follow the run (GetETLRun).
         return {
             'statusCode': 200,
+            'jobName': GLUE_JOB_NAME,
+            'jobRunId': response['JobRunId'],
             'body': json.dumps({
                 'message': 'Glue ETL job started successfully.',
                 'jobName': GLUE_JOB_NAME,
@@ -1,11 +1,12 @@
 import json
-import pymysql
-import boto3
-import csv
-from io import StringIO
+from aws_clients import lazy_client
+import rds_loader
+from rds_connection import RdsConnectionManager
+from pipeline_metrics import instrumented
 
-rds_client = boto3.client('rds')
-s3_client = boto3.client('s3')
+rds_client = lazy_client('rds')
+s3_client = lazy_client('s3')
+rds_connections = RdsConnectionManager(rds_client)
 
 
 DEFAULT_BUCKET = 'myresult-sc171'
@@ -16,6 +17,7 @@ DEFAULT_DB_USER = 'admin'
 DEFAULT_DB_PASSWORD = 'csj123456'
 DEFAULT_RDS_INSTANCE_ID = 'myresult-db'
 
+@instrumented('WritePropertyToRDS')
 def lambda_handler(event, context):
     try:
         # ✅ Step 1
@@ -26,65 +28,44 @@ def lambda_handler(event, context):
         table_name = event.get('table', DEFAULT_TABLE_NAME)
         bucket = event.get('bucket', DEFAULT_BUCKET)
         key = event.get('key', DEFAULT_KEY)
+        load_mode = event.get('load_mode', rds_loader.DEFAULT_LOAD_MODE)
+        batch_size = event.get('batch_size')
+        infer_types = event.get('infer_schema', True)
+        write_mode = event.get('write_mode', 'replace')
+        force_reload = event.get('force_reload', False)
 
-        # ✅ Step 2
-        print(f"🔍 Fetching endpoint for RDS instance '{rds_instance_id}'...")
-        rds_response = rds_client.describe_db_instances(DBInstanceIdentifier=rds_instance_id)
-        db_host = rds_response['DBInstances'][0]['Endpoint']['Address']
+        # ✅ Step 2: endpoint is cached across warm invocations
+        db_host = rds_connections.endpoint(rds_instance_id)
         print(f"✅ RDS endpoint: {db_host}")
 
-        # ✅ Step 3
-        init_conn = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database='mysql',
-            connect_timeout=10
-        )
-        with init_conn.cursor() as cursor:
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name};")
-        init_conn.close()
-
-        # ✅ Step 4
-        conn = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            connect_timeout=10
+        # ✅ Step 3/4: reuses the live connection; CREATE DATABASE runs once per container
+        conn = rds_connections.connection(
+            rds_instance_id, db_user, db_password, db_name,
+            local_infile=(load_mode == 'infile')
         )
 
         # ✅ Step 5
         response = s3_client.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8')
-        csv_data = csv.reader(StringIO(content))
-        header = next(csv_data)
-
-        with conn.cursor() as cursor:
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                {', '.join(f'`{col}` VARCHAR(255)' for col in header)}
-            );
-            """
-            cursor.execute(create_table_sql)
-
-            insert_sql = f"""
-            INSERT INTO {table_name} ({', '.join(f'`{col}`' for col in header)})
-            VALUES ({', '.join(['%s'] * len(header))});
-            """
-            for row in csv_data:
-                cursor.execute(insert_sql, row)
-
-        conn.commit()
-        conn.close()
+        result = rds_loader.load_s3_csv(
+            conn, response, table_name, f's3://{bucket}/{key}',
+            write_mode=write_mode, load_mode=load_mode, batch_size=batch_size,
+            infer_types=infer_types, force=force_reload
+        )
+        if result['skipped']:
+            print(f"⏭️ s3://{bucket}/{key} unchanged (ETag {result['version']}), load skipped")
+        elif result['column_types']:
+            print(f"✅ Inferred schema: {result['column_types']}")
 
         return {
-            'status': 'success',
+            'status': 'skipped' if result['skipped'] else 'success',
             'endpoint': db_host,
+            'rows_loaded': result['rows_loaded'],
+            'source_version': result['version'],
             'message': f'✅ {table_name} imported from {bucket}/{key} into {db_name} @ {db_host}'
         }
 
     except Exception as e:
+        rds_connections.discard()
         return {
             'status': 'error',
             'message': str(e)
@@ -1,12 +1,13 @@
-import boto3
-import pymysql
-import time
-import csv
-from io import StringIO
+from aws_clients import lazy_client
+import rds_loader
+from rds_connection import RdsConnectionManager
+from pipeline_metrics import instrumented
 
-rds = boto3.client('rds')
-s3 = boto3.client('s3')
+rds = lazy_client('rds')
+s3 = lazy_client('s3')
+rds_connections = RdsConnectionManager(rds)
 
+@instrumented('WriteRangeToRDS')
 def lambda_handler(event, context):
 
     instance_id = event.get('rds_instance_id', 'myresult-db')
@@ -20,6 +21,11 @@ def lambda_handler(event, context):
     subnet_group = event.get('subnet_group', 'public-db-subnet-group')
     db_engine = event.get('engine', 'mysql')
     db_class = event.get('instance_class', 'db.t3.micro')
+    load_mode = event.get('load_mode', rds_loader.DEFAULT_LOAD_MODE)
+    batch_size = event.get('batch_size')
+    infer_types = event.get('infer_schema', True)
+    write_mode = event.get('write_mode', 'replace')
+    force_reload = event.get('force_reload', False)
 
 
     if not bucket or not key or not sg_id:
@@ -31,8 +37,7 @@ def lambda_handler(event, context):
     try:
 
         try:
-            rds.describe_db_instances(DBInstanceIdentifier=instance_id)
-            print(f"✅ RDS instance '{instance_id}' already exists")
+            endpoint = rds_connections.endpoint(instance_id)
         except rds.exceptions.DBInstanceNotFoundFault:
             print(f"🚀 Creating RDS instance '{instance_id}'...")
             rds.create_db_instance(
@@ -49,67 +54,37 @@ def lambda_handler(event, context):
                 BackupRetentionPeriod=1,
                 MultiAZ=False
             )
-
-
-
-
-        endpoint = rds.describe_db_instances(DBInstanceIdentifier=instance_id)['DBInstances'][0]['Endpoint']['Address']
+            endpoint = rds_connections.endpoint(instance_id)
         print(f"✅ RDS endpoint: {endpoint}")
 
 
-        conn_init = pymysql.connect(
-            host=endpoint,
-            user=db_user,
-            password=db_password,
-            database='mysql',
-            connect_timeout=10
-        )
-        with conn_init.cursor() as cursor:
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name};")
-        conn_init.close()
-
-
-        conn = pymysql.connect(
-            host=endpoint,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            connect_timeout=10
+        conn = rds_connections.connection(
+            instance_id, db_user, db_password, db_name,
+            local_infile=(load_mode == 'infile')
         )
 
 
         response = s3.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8')
-        csv_data = csv.reader(StringIO(content))
-        header = next(csv_data)
-
-        with conn.cursor() as cursor:
-            
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                {', '.join(f'`{col}` VARCHAR(255)' for col in header)}
-            );
-            """
-            cursor.execute(create_table_sql)
-
-            
-            insert_sql = f"""
-            INSERT INTO {table_name} ({', '.join(f'`{col}`' for col in header)})
-            VALUES ({', '.join(['%s'] * len(header))});
-            """
-            for row in csv_data:
-                cursor.execute(insert_sql, row)
-
-        conn.commit()
-        conn.close()
+        result = rds_loader.load_s3_csv(
+            conn, response, table_name, f's3://{bucket}/{key}',
+            write_mode=write_mode, load_mode=load_mode, batch_size=batch_size,
+            infer_types=infer_types, force=force_reload
+        )
+        if result['skipped']:
+            print(f"⏭️ s3://{bucket}/{key} unchanged (ETag {result['version']}), load skipped")
+        elif result['column_types']:
+            print(f"✅ Inferred schema: {result['column_types']}")
 
         return {
-            "status": "success",
+            "status": "skipped" if result['skipped'] else "success",
             "message": f"✅ RDS {db_name}.{table_name} loaded from s3://{bucket}/{key}",
-            "endpoint": endpoint
+            "endpoint": endpoint,
+            "rows_loaded": result['rows_loaded'],
+            "source_version": result['version']
         }
 
     except Exception as e:
+        rds_connections.discard()
         return {
             "status": "error",
             "message": str(e)
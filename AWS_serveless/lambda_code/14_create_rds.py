@@ -1,8 +1,10 @@
-import boto3
+from aws_clients import lazy_client
+from pipeline_metrics import instrumented
 
+rds = lazy_client('rds')
+
+@instrumented('CreateRDS')
 def lambda_handler(event, context):
-    rds = boto3.client('rds')
-    
     try:
         response = rds.create_db_instance(
             DBInstanceIdentifier='myresult-db',
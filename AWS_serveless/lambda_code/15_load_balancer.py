@@ -1,8 +1,10 @@
-import boto3
+from aws_clients import lazy_client
+from pipeline_metrics import instrumented
 
-elbv2 = boto3.client('elbv2')
-ec2 = boto3.client('ec2')
+elbv2 = lazy_client('elbv2')
+ec2 = lazy_client('ec2')
 
+@instrumented('CreateLoadBalancer')
 def lambda_handler(event, context):
     try:
 
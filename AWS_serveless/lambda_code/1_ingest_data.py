@@ -1,108 +1,165 @@
-import boto3
+from aws_clients import lazy_client
+from model_cache import HYPERPARAMETERS, TRAINING_CODE_URI, TRAINING_IMAGE, ModelCache
+from notifier import notification
 import time
-import os
 import json
+from pipeline_metrics import CODE_URI, current_run_id, instrumented
 
 # Initialize AWS service clients
-sagemaker = boto3.client("sagemaker")
-s3 = boto3.client("s3")
-glue = boto3.client("glue")
-sns = boto3.client("sns")
+sagemaker = lazy_client("sagemaker")
+s3 = lazy_client("s3")
+glue = lazy_client("glue")
+cache = ModelCache(s3, sagemaker)
 
+JOB_ENDED = ("Completed", "Failed", "Stopped")
+ML_DATA_URI = "s3://myresult-sc171/ml_data.csv"
+data_crawler = "data_crawler"
+
+@instrumented('IngestData')
 def lambda_handler(event, context):
-    timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
-    job_name = f"ml-process-job-{timestamp}"
-    data_crawler = "data_crawler"
+    # The first invocation starts the job and returns. The state machine then
+    # invokes the handler again with processing_job (WaitForIngestJob) until
+    # job_status shows the job has ended, so no invocation waits on it.
+    if event.get("processing_job"):
+        return check_job(event["processing_job"], event.get("model_fingerprint"))
 
-    sns_topic_arn = os.getenv("SNS_TOPIC_ARN")  # Optional for notifications
+    timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
 
     # Define SageMaker processing configuration
     try:
-        response = sagemaker.create_processing_job(
-            ProcessingJobName=job_name,
-            RoleArn="arn:aws:iam::514475511198:role/LabRole",
-            AppSpecification={
-                "ImageUri": "683313688378.dkr.ecr.us-east-1.amazonaws.com/sagemaker-scikit-learn:1.2-1",
-                "ContainerEntrypoint": ["python3", "/opt/ml/processing/input/code/ml_code.py"]
+        # Same data, code and hyperparameters as a stored model: reuse it.
+        fingerprint, document, base = cache.plan(ML_DATA_URI)
+        if cache.cached(fingerprint):
+            print(f"♻️ Model {fingerprint[:12]} is already trained, skipping SageMaker.")
+            return job_completed(None, fingerprint)
+
+        job_name = f"ml-{fingerprint[:16]}-{timestamp}"
+        running = cache.claim(fingerprint, job_name, document)
+        if running:
+            print(f"⏳ SageMaker job {running} is already training this model, following it.")
+            return {"statusCode": 202, "processing_job": running, "model_fingerprint": fingerprint,
+                    "job_status": "InProgress"}
+
+        try:
+            start_job(job_name, fingerprint, base)
+        except Exception:
+            cache.release(fingerprint)
+            raise
+
+        print(f"🚀 SageMaker job {job_name} started successfully.")
+
+    except Exception as e:
+        print(f"❌ SageMaker job failed to start: {str(e)}")
+        # Notifications go back in the result for the run's digest (NotifyRun)
+        return {"statusCode": 500, "message": str(e), "notifications": [notification(
+            "sagemaker_launch_failed", "error",
+            subject="SageMaker Job Launch Failed",
+            message=f"Failed to start processing job: {str(e)}"
+        )]}
+
+    return {"statusCode": 202, "processing_job": job_name, "model_fingerprint": fingerprint,
+            "job_status": "InProgress"}
+
+
+def start_job(job_name, fingerprint, base):
+    sagemaker.create_processing_job(
+        ProcessingJobName=job_name,
+        RoleArn="arn:aws:iam::514475511198:role/LabRole",
+        AppSpecification={
+            "ImageUri": TRAINING_IMAGE,
+            "ContainerEntrypoint": ["python3", "/opt/ml/processing/input/code/ml_code.py"]
+        },
+        Environment={
+            "PIPELINE_RUN_ID": current_run_id(),
+            "ML_HYPERPARAMETERS": json.dumps(HYPERPARAMETERS, sort_keys=True)
+        },
+        ProcessingResources={
+            "ClusterConfig": {
+                "InstanceCount": 1,
+                "InstanceType": "ml.m5.large",
+                "VolumeSizeInGB": 20
+            }
+        },
+        ProcessingInputs=[
+            {
+                "InputName": "code",
+                "S3Input": {
+                    "S3Uri": TRAINING_CODE_URI,
+                    "LocalPath": "/opt/ml/processing/input/code/",
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File"
+                }
             },
-            ProcessingResources={
-                "ClusterConfig": {
-                    "InstanceCount": 1,
-                    "InstanceType": "ml.m5.large",
-                    "VolumeSizeInGB": 20
+            {
+                "InputName": "metrics-code",
+                "S3Input": {
+                    "S3Uri": CODE_URI,
+                    "LocalPath": "/opt/ml/processing/input/lib/",
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File"
                 }
             },
-            ProcessingInputs=[
-                {
-                    "InputName": "code",
-                    "S3Input": {
-                        "S3Uri": "s3://my-code-sc171/ml_code.py",
-                        "LocalPath": "/opt/ml/processing/input/code/",
-                        "S3DataType": "S3Prefix",
-                        "S3InputMode": "File"
-                    }
-                },
+            {
+                "InputName": "input-data",
+                "S3Input": {
+                    "S3Uri": ML_DATA_URI,
+                    "LocalPath": "/opt/ml/processing/input/",
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File"
+                }
+            }
+        ] + cache.previous_model_inputs(base),
+        ProcessingOutputConfig={
+            "Outputs": [
                 {
-                    "InputName": "input-data",
-                    "S3Input": {
-                        "S3Uri": "s3://myresult-sc171/ml_data.csv",
-                        "LocalPath": "/opt/ml/processing/input/",
-                        "S3DataType": "S3Prefix",
-                        "S3InputMode": "File"
+                    "OutputName": "model-output",
+                    "S3Output": {
+                        "S3Uri": cache.output_uri(fingerprint),
+                        "LocalPath": "/opt/ml/processing/output/",
+                        "S3UploadMode": "EndOfJob"
                     }
                 }
-            ],
-            ProcessingOutputConfig={
-                "Outputs": [
-                    {
-                        "OutputName": "model-output",
-                        "S3Output": {
-                            "S3Uri": "s3://ml-model-sc171/",
-                            "LocalPath": "/opt/ml/processing/output/",
-                            "S3UploadMode": "EndOfJob"
-                        }
-                    }
-                ]
-            }
-        )
+            ]
+        }
+    )
 
-        print(f"🚀 SageMaker job {job_name} started successfully.")
 
-    except Exception as e:
-        print(f"❌ SageMaker job failed to start: {str(e)}")
-        if sns_topic_arn:
-            sns.publish(
-                TopicArn=sns_topic_arn,
-                Subject="SageMaker Job Launch Failed",
-                Message=f"Failed to start processing job: {str(e)}"
-            )
-        return {"statusCode": 500, "message": str(e)}
-
-    # Wait until job finishes
-    print("⌛ Waiting for SageMaker job to complete...")
-    while True:
-        desc = sagemaker.describe_processing_job(ProcessingJobName=job_name)
-        status = desc["ProcessingJobStatus"]
-        if status in ["Completed", "Failed", "Stopped"]:
-            break
-        time.sleep(30)
+def check_job(job_name, fingerprint):
+    desc = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+    status = desc["ProcessingJobStatus"]
+    if status not in JOB_ENDED:
+        print(f"⌛ SageMaker job {job_name} is {status}")
+        return {"statusCode": 202, "processing_job": job_name, "model_fingerprint": fingerprint,
+                "job_status": status}
 
     print(f"✅ SageMaker job {job_name} finished with status: {status}")
 
     # Error handling for SageMaker job
     if status != "Completed":
         reason = desc.get("FailureReason", "Unknown")
-        if sns_topic_arn:
-            sns.publish(
-                TopicArn=sns_topic_arn,
-                Subject=f"SageMaker Job Failed: {job_name}",
-                Message=f"Job {job_name} failed. Reason: {reason}"
-            )
         return {
             "statusCode": 500,
-            "message": f"Job failed or stopped. Reason: {reason}"
+            "processing_job": job_name,
+            "job_status": status,
+            "message": f"Job failed or stopped. Reason: {reason}",
+            "notifications": [notification(
+                "sagemaker_job_failed", "error",
+                subject=f"SageMaker Job Failed: {job_name}",
+                message=f"Job {job_name} failed. Reason: {reason}"
+            )]
         }
 
+    return job_completed(job_name, fingerprint)
+
+
+def job_completed(job_name, fingerprint):
+    # job_name is None when the model came from the cache.
+    model_uri = cache.promote(fingerprint) if fingerprint else None
+    if job_name:
+        job_message = f"SageMaker job '{job_name}' completed successfully."
+    else:
+        job_message = f"Model {model_uri} reused, no SageMaker job needed."
+
     # Start Glue Crawler after successful job
     try:
         glue.start_crawler(Name=data_crawler)
@@ -112,27 +169,32 @@ def lambda_handler(event, context):
         status_message = f"Crawler '{data_crawler}' already running."
     except Exception as e:
         print(f"❌ Failed to start Glue Crawler: {str(e)}")
-        if sns_topic_arn:
-            sns.publish(
-                TopicArn=sns_topic_arn,
-                Subject="Glue Crawler Failed",
-                Message=f"Failed to start Glue Crawler: {str(e)}"
-            )
-        return {"statusCode": 500, "message": str(e)}
+        return {
+            "statusCode": 500,
+            "processing_job": job_name,
+            "job_status": "Completed",
+            "message": str(e),
+            "notifications": [notification(
+                "crawler_failed", "error",
+                subject="Glue Crawler Failed",
+                message=f"Failed to start Glue Crawler: {str(e)}"
+            )]
+        }
     else:
         status_message = f"Glue Crawler '{data_crawler}' launched."
 
-    # Optional: publish notification when all succeeds
-    if sns_topic_arn:
-        sns.publish(
-            TopicArn=sns_topic_arn,
-            Subject="Pipeline Completed Successfully",
-            Message=f"SageMaker job '{job_name}' completed successfully. {status_message}"
-        )
-
     return {
         "statusCode": 200,
+        "processing_job": job_name,
+        "model_fingerprint": fingerprint,
+        "model_uri": model_uri,
+        "job_status": "Completed",
         "body": json.dumps({
-            "message": f"✅ Job '{job_name}' completed successfully and {status_message}"
-        })
+            "message": f"✅ {job_message} {status_message}"
+        }),
+        "notifications": [notification(
+            "ingest_completed",
+            subject="Pipeline Completed Successfully",
+            message=f"{job_message} {status_message}"
+        )]
     }
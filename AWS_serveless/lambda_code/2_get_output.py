@@ -1,67 +1,183 @@
 import json
-import boto3
-import time
-from urllib.parse import urlparse
+import os
+import uuid
 
-athena = boto3.client('athena')
-s3 = boto3.client('s3')
+import query_backend
+from amenity_features import AMENITY_FEATURES, feature_columns, load_dictionary
+from athena_cache import AthenaResultCache
+from athena_runner import split_s3_uri
+from botocore.exceptions import ClientError
+from pipeline_metrics import instrumented
 
+# QUERY_BACKEND=duckdb runs the same SQL on local files under LOCAL_DATA_ROOT.
+s3, query_runner = query_backend.create_backend()
+result_cache = AthenaResultCache(s3, 'myresult-sc171')
+
+# The has_* flags come from amenity_features: bit tests on the ETL's
+# amenity_mask, or LIKE over the amenities text before the ETL has one.
+ML_DATA_QUERY_TEMPLATE = """
+    SELECT 
+        city,
+        accommodates,
+        room_type,
+        bathrooms,
+        bedrooms,
+        CASE WHEN host_is_superhost = true THEN 1 ELSE 0 END AS is_superhost,
+        {amenity_columns},
+        price
+        FROM processed
+        WHERE price > 15 AND price IS NOT NULL;
+"""
+
+
+def ml_data_query(dictionary=None):
+    return ML_DATA_QUERY_TEMPLATE.format(amenity_columns=',\n        '.join(feature_columns(dictionary)))
+
+
+ML_DATA_QUERY = ml_data_query()
+
+# ML_EXPORT_FORMAT=parquet (or export_format in the event) UNLOADs the
+# training set as Snappy Parquet files under ml_data_parquet/ instead of
+# copying Athena's CSV result to ml_data.csv.
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_FORMAT = os.environ.get('ML_EXPORT_FORMAT', 'csv')
+PARQUET_PREFIX = 'ml_data_parquet/'
+PARQUET_MARKER = 'ml_data_parquet.json'
+UNLOAD_PREFIX = 'ml_data_unload/'
+
+# Column types written to Parquet, so ml_code.py reads them back as is.
+ML_DATA_TYPES = {
+    'city': 'VARCHAR', 'accommodates': 'INTEGER', 'room_type': 'VARCHAR',
+    'bathrooms': 'DOUBLE', 'bedrooms': 'INTEGER', 'is_superhost': 'TINYINT',
+    **{feature: 'TINYINT' for feature in AMENITY_FEATURES},
+    'price': 'DOUBLE',
+}
+
+
+def typed_query(query):
+    return "SELECT\n{}\nFROM ({}\n)".format(
+        ',\n'.join(f"    CAST({col} AS {sql_type}) AS {col}" for col, sql_type in ML_DATA_TYPES.items()),
+        query.rstrip().rstrip(';'))
+
+
+def current_export():
+    # Cache key of the data in ml_data_parquet/, from its marker object.
+    try:
+        marker = s3.get_object(Bucket='myresult-sc171', Key=PARQUET_MARKER)['Body'].read()
+        return json.loads(marker).get('cache_key')
+    except ClientError:
+        return None
+
+
+def list_objects(prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    return [obj for page in paginator.paginate(Bucket='myresult-sc171', Prefix=prefix)
+            for obj in page.get('Contents', [])]
+
+
+def publish_unload(unload_prefix):
+    # UNLOAD needs an empty target, so it writes to a fresh prefix; the files
+    # are then copied into ml_data_parquet/ before the previous ones are
+    # deleted, so the training input is never empty.
+    files = list_objects(unload_prefix)
+    new_keys = []
+    for obj in files:
+        key = PARQUET_PREFIX + obj['Key'].rsplit('/', 1)[-1]
+        s3.copy_object(Bucket='myresult-sc171', CopySource={'Bucket': 'myresult-sc171', 'Key': obj['Key']}, Key=key)
+        new_keys.append(key)
+    stale = [obj['Key'] for obj in list_objects(PARQUET_PREFIX) if obj['Key'] not in new_keys]
+    stale += [obj['Key'] for obj in files]
+    for i in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket='myresult-sc171',
+                          Delete={'Objects': [{'Key': key} for key in stale[i:i + 1000]]})
+    return new_keys, sum(obj['Size'] for obj in files)
+
+
+def export_parquet(event, context, query):
+    # The marker records which SQL and processed/ version the files hold.
+    query = typed_query(query)
+    cache_key = result_cache.key('ml_data_parquet', query, 'data_db')
+    if cache_key and not event.get('refresh_cache') and current_export() == cache_key:
+        return {
+            'statusCode': 200,
+            'export_format': 'parquet',
+            'body': json.dumps({
+                'status': 'success',
+                'result_location': f's3://myresult-sc171/{PARQUET_PREFIX}',
+                'cache': 'hit'
+            })
+        }
+
+    unload_prefix = f'{UNLOAD_PREFIX}{uuid.uuid4()}/'
+    stats = query_runner.unload(query, 'data_db', 's3://myresult-sc171/',
+                                f's3://myresult-sc171/{unload_prefix}', label='ml_data', context=context)
+    if stats['state'] != 'SUCCEEDED':
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'status': 'failed', 'reason': stats['state'], 'query_stats': stats})
+        }
+
+    keys, size = publish_unload(unload_prefix)
+    s3.put_object(Bucket='myresult-sc171', Key=PARQUET_MARKER, Body=json.dumps({
+        'cache_key': cache_key,
+        'query_execution_id': stats['query_execution_id'],
+        'files': keys,
+        'bytes': size,
+    }).encode('utf-8'))
+    print(f"✅ Exported {len(keys)} Parquet files ({size} bytes) to s3://myresult-sc171/{PARQUET_PREFIX}")
+
+    return {
+        'statusCode': 200,
+        'export_format': 'parquet',
+        'body': json.dumps({
+            'status': 'success',
+            'result_location': f's3://myresult-sc171/{PARQUET_PREFIX}',
+            'files': len(keys),
+            'bytes': size,
+            'cache': 'miss',
+            'query_stats': stats
+        })
+    }
+
+
+@instrumented('MLdata')
 def lambda_handler(event, context):
-    query = """
-        SELECT 
-            city,
-            accommodates,
-            room_type,
-            bathrooms,
-            bedrooms,
-            CASE WHEN host_is_superhost = true THEN 1 ELSE 0 END AS is_superhost,
-            CASE WHEN amenities LIKE '%Wireless%' THEN 1 ELSE 0 END AS has_wifi,
-            CASE WHEN amenities LIKE '%Air Conditioning%' THEN 1 ELSE 0 END AS has_ac,
-            CASE WHEN amenities LIKE '%Kitchen%' THEN 1 ELSE 0 END AS has_kitchen,
-            CASE WHEN amenities LIKE '%Heating%' THEN 1 ELSE 0 END AS has_heating,
-            CASE WHEN amenities LIKE '%Washer%' THEN 1 ELSE 0 END AS has_washer,
-            CASE WHEN amenities LIKE '%Dryer%' THEN 1 ELSE 0 END AS has_dryer,
-            CASE WHEN amenities LIKE '%TV%' THEN 1 ELSE 0 END AS has_tv,
-            CASE WHEN amenities LIKE '%Shampoo%' THEN 1 ELSE 0 END AS has_shampoo,
-            CASE WHEN amenities LIKE '%Essentials%' THEN 1 ELSE 0 END AS has_essentials,
-            CASE WHEN amenities LIKE '%Hair Dryer%' THEN 1 ELSE 0 END AS has_hair_dryer,
-            CASE WHEN amenities LIKE '%Elevator%' THEN 1 ELSE 0 END AS has_elevator,
-            CASE WHEN amenities LIKE '%Gym%' THEN 1 ELSE 0 END AS has_gym,
-            price
-            FROM processed
-            WHERE price > 15 AND price IS NOT NULL;
-    """
+    export_format = event.get('export_format', EXPORT_FORMAT)
+    if export_format not in EXPORT_FORMATS:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'status': 'failed', 'reason': f"export_format must be one of {EXPORT_FORMATS}"})
+        }
+    query = ml_data_query(load_dictionary(s3))
+    if export_format == 'parquet':
+        return export_parquet(event, context, query)
 
     output_location = 's3://myresult-sc171/'
 
-    # Start Athena query
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={'Database': 'data_db'},
-        ResultConfiguration={'OutputLocation': output_location}
-    )
-
-    query_execution_id = response['QueryExecutionId']
+    # Same SQL over the same processed/ objects: reuse the cached result.
+    cache_key = result_cache.key('ml_data', query, 'data_db')
+    if cache_key and not event.get('refresh_cache') and result_cache.fetch(cache_key, 'myresult-sc171', 'ml_data.csv'):
+        return {
+            'statusCode': 200,
+            'export_format': 'csv',
+            'body': json.dumps({
+                'status': 'success',
+                'result_location': 's3://myresult-sc171/ml_data.csv',
+                'cache': 'hit'
+            })
+        }
 
-    # Wait for query to complete
-    while True:
-        result = athena.get_query_execution(QueryExecutionId=query_execution_id)
-        state = result['QueryExecution']['Status']['State']
-        if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            break
-        time.sleep(2)
+    # Run the query (backed-off polling on Athena, cancelled at the deadline)
+    stats = query_runner.run(query, 'data_db', output_location, label='ml_data', context=context)
 
-    if state != 'SUCCEEDED':
+    if stats['state'] != 'SUCCEEDED':
         return {
             'statusCode': 500,
-            'body': json.dumps({'status': 'failed', 'reason': state})
+            'body': json.dumps({'status': 'failed', 'reason': stats['state'], 'query_stats': stats})
         }
 
     # Get result path and parse it
-    result_path = result['QueryExecution']['ResultConfiguration']['OutputLocation']
-    parsed = urlparse(result_path)
-    bucket_name = parsed.netloc
-    source_key = parsed.path.lstrip('/')
+    bucket_name, source_key = split_s3_uri(stats['output_location'])
     target_key = 'ml_data.csv'
 
     # Copy to fixed file name
@@ -78,11 +194,17 @@ def lambda_handler(event, context):
             'body': json.dumps({'status': 'failed to copy', 'error': str(e)})
         }
 
+    if cache_key:
+        result_cache.store(cache_key, bucket_name, source_key)
+
     return {
         'statusCode': 200,
+        'export_format': 'csv',
         'body': json.dumps({
             'status': 'success',
-            'result_location': f's3://{bucket_name}/{target_key}'
+            'result_location': f's3://{bucket_name}/{target_key}',
+            'cache': 'miss',
+            'query_stats': stats
         })
     }
 
@@ -1,24 +1,81 @@
-import boto3
 import time
 import os
+import json
+from aws_clients import lazy_client
+from model_cache import HYPERPARAMETERS, TRAINING_CODE_URI, TRAINING_IMAGE, ModelCache
+from notifier import notification
+from pipeline_metrics import CODE_URI, current_run_id, instrumented
 
+sagemaker = lazy_client("sagemaker")
+s3 = lazy_client("s3")
+cache = ModelCache(s3, sagemaker)
+
+# Training input per export format of 2_get_output (passed on in its
+# result as export_format): S3 source and where ml_code.py finds it.
+ML_EXPORT_FORMAT = os.environ.get("ML_EXPORT_FORMAT", "csv")
+ML_INPUTS = {
+    "csv": ("s3://myresult-sc171/ml_data.csv", "/opt/ml/processing/input/"),
+    "parquet": ("s3://myresult-sc171/ml_data_parquet/", "/opt/ml/processing/input/ml_data/"),
+}
+
+JOB_ENDED = ("Completed", "Failed", "Stopped")
+
+@instrumented('MLprocess')
 def lambda_handler(event, context):
+    # Starts the job and returns; the state machine invokes the handler again
+    # with processing_job (WaitForMLJob) until job_status shows it has ended.
+    if event.get("processing_job"):
+        return check_job(event["processing_job"], event.get("model_fingerprint"))
+
     timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
-    job_name = f"ml-process-job-{timestamp}"
+    input_uri, input_path = ML_INPUTS[event.get("export_format", ML_EXPORT_FORMAT)]
+
+    # Step 1: Reuse the model trained on the same data, code and
+    # hyperparameters, or follow the job already training it
+    fingerprint, document, base = cache.plan(input_uri)
+    if cache.cached(fingerprint):
+        model_uri = cache.promote(fingerprint)
+        print(f"Model {model_uri} is already trained, skipping SageMaker.")
+        return {
+            "statusCode": 200,
+            "processing_job": None,
+            "model_fingerprint": fingerprint,
+            "model_uri": model_uri,
+            "job_status": "Completed",
+            "body": f"Reused model {model_uri}."
+        }
+
+    job_name = f"ml-{fingerprint[:16]}-{timestamp}"
+    running = cache.claim(fingerprint, job_name, document)
+    if running:
+        print(f"Job {running} is already training this model, following it.")
+        return {"statusCode": 202, "processing_job": running, "model_fingerprint": fingerprint,
+                "job_status": "InProgress"}
+
+    # Step 2: Start Processing Job
+    try:
+        start_job(job_name, fingerprint, base, input_uri, input_path)
+    except Exception:
+        cache.release(fingerprint)
+        raise
 
-    sagemaker = boto3.client("sagemaker")
-    sns = boto3.client("sns")  # used for notifications (optional)
+    print(f"Job {job_name} started.")
+    return {"statusCode": 202, "processing_job": job_name, "model_fingerprint": fingerprint,
+            "job_status": "InProgress"}
 
-    sns_topic_arn = os.getenv("SNS_TOPIC_ARN", None)
 
-    # Step 1: Start Processing Job
-    response = sagemaker.create_processing_job(
+def start_job(job_name, fingerprint, base, input_uri, input_path):
+    sagemaker.create_processing_job(
         ProcessingJobName=job_name,
         RoleArn="arn:aws:iam::514475511198:role/LabRole",
         AppSpecification={
-            "ImageUri": "683313688378.dkr.ecr.us-east-1.amazonaws.com/sagemaker-scikit-learn:1.2-1",
+            "ImageUri": TRAINING_IMAGE,
             "ContainerEntrypoint": ["python3", "/opt/ml/processing/input/code/ml_code.py"]
         },
+        Environment={
+            "PIPELINE_RUN_ID": current_run_id(),
+            "ML_HYPERPARAMETERS": json.dumps(HYPERPARAMETERS, sort_keys=True)
+        },
         ProcessingResources={
             "ClusterConfig": {
                 "InstanceCount": 1,
@@ -30,28 +87,37 @@ def lambda_handler(event, context):
             {
                 "InputName": "code",
                 "S3Input": {
-                    "S3Uri": "s3://my-code-sc171/ml_code.py",
+                    "S3Uri": TRAINING_CODE_URI,
                     "LocalPath": "/opt/ml/processing/input/code/",
                     "S3DataType": "S3Prefix",
                     "S3InputMode": "File"
                 }
             },
+            {
+                "InputName": "metrics-code",
+                "S3Input": {
+                    "S3Uri": CODE_URI,
+                    "LocalPath": "/opt/ml/processing/input/lib/",
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File"
+                }
+            },
             {
                 "InputName": "input-data",
                 "S3Input": {
-                    "S3Uri": "s3://myresult-sc171/ml_data.csv",
-                    "LocalPath": "/opt/ml/processing/input/",
+                    "S3Uri": input_uri,
+                    "LocalPath": input_path,
                     "S3DataType": "S3Prefix",
                     "S3InputMode": "File"
                 }
             }
-        ],
+        ] + cache.previous_model_inputs(base),
         ProcessingOutputConfig={
             "Outputs": [
                 {
                     "OutputName": "model-output",
                     "S3Output": {
-                        "S3Uri": "s3://ml-model-sc171/",
+                        "S3Uri": cache.output_uri(fingerprint),
                         "LocalPath": "/opt/ml/processing/output/",
                         "S3UploadMode": "EndOfJob"
                     }
@@ -60,39 +126,43 @@ def lambda_handler(event, context):
         }
     )
 
-    print(f"Job {job_name} started. Monitoring progress...")
 
-    # Step 2: Monitor until job completes
-    while True:
-        desc = sagemaker.describe_processing_job(ProcessingJobName=job_name)
-        status = desc["ProcessingJobStatus"]
-        if status in ["Completed", "Failed", "Stopped"]:
-            break
-        time.sleep(30)
+def check_job(job_name, fingerprint):
+    # Step 3: Check on the job
+    desc = sagemaker.describe_processing_job(ProcessingJobName=job_name)
+    status = desc["ProcessingJobStatus"]
+    if status not in JOB_ENDED:
+        print(f"Job {job_name} is {status}.")
+        return {"statusCode": 202, "processing_job": job_name, "model_fingerprint": fingerprint,
+                "job_status": status}
 
     print(f"Job {job_name} ended with status: {status}")
 
-    # Step 3: Error handling and notifications
+    # Step 4: Error handling and notifications
     if status != "Completed":
         failure_reason = desc.get("FailureReason", "Unknown")
         print(f"Error: Job failed or stopped. Reason: {failure_reason}")
 
-        # Optional: send SNS alert
-        if sns_topic_arn:
-            sns.publish(
-                TopicArn=sns_topic_arn,
-                Subject=f"SageMaker Job {status}: {job_name}",
-                Message=f"The job {job_name} ended with status {status}. Reason: {failure_reason}"
-            )
-
-        # Return error response
+        # Return error response; the alert goes out in the run's digest
         return {
             "statusCode": 500,
-            "body": f"Job {job_name} failed/stopped. Reason: {failure_reason}"
+            "processing_job": job_name,
+            "job_status": status,
+            "body": f"Job {job_name} failed/stopped. Reason: {failure_reason}",
+            "notifications": [notification(
+                "sagemaker_job_failed", "error",
+                subject=f"SageMaker Job {status}: {job_name}",
+                message=f"The job {job_name} ended with status {status}. Reason: {failure_reason}"
+            )]
         }
 
-    # Step 4: Success return
+    # Step 5: Publish the model and return
+    model_uri = cache.promote(fingerprint) if fingerprint else None
     return {
         "statusCode": 200,
+        "processing_job": job_name,
+        "model_fingerprint": fingerprint,
+        "model_uri": model_uri,
+        "job_status": status,
         "body": f"SageMaker Processing Job {job_name} completed successfully."
     }
@@ -1,8 +1,10 @@
-import boto3
+from aws_clients import lazy_client
+from pipeline_metrics import instrumented
 
-autoscaling = boto3.client('autoscaling')
-ec2 = boto3.client('ec2')
+autoscaling = lazy_client('autoscaling')
+ec2 = lazy_client('ec2')
 
+@instrumented('RefreshAutoScaleGroup')
 def lambda_handler(event, context):
     try:
         asg_name = 'asg_ml'
@@ -1,38 +1,34 @@
 import json
-import boto3
-import pandas as pd
-import io
+from aws_clients import lazy_client
+from athena_reports import REPORT_COLUMNS
+from csv_check import check_csv
+from pipeline_metrics import instrumented
 
-s3 = boto3.client('s3')
+s3 = lazy_client('s3')
 
 FIXED_OUTPUT_BUCKET = 'myresult-sc171'
 FIXED_TARGET_KEY = 'property_insights.csv'
 
+@instrumented('CheckCSV')
 def lambda_handler(event, context):
-    is_empty_flag = True
-
+    # One ranged GET of the first few KB; no pandas.
     try:
-        response = s3.get_object(Bucket=FIXED_OUTPUT_BUCKET, Key=FIXED_TARGET_KEY)
-        content = response['Body'].read()
-        df = pd.read_csv(io.BytesIO(content))
-
-
-        if not df.empty and df.shape[0] > 1:
-            is_empty_flag = False
-
-    except s3.exceptions.NoSuchKey:
-        print(f"File not found: s3://{FIXED_OUTPUT_BUCKET}/{FIXED_TARGET_KEY}")
+        check = check_csv(s3, FIXED_OUTPUT_BUCKET, FIXED_TARGET_KEY, REPORT_COLUMNS['property_insights'])
     except Exception as e:
         print(f"Error processing file: {str(e)}")
+        check = {'is_empty': True, 'error': str(e)}
 
+    if check.get('missing_columns') or check.get('unexpected_columns'):
+        print(f"Unexpected header in s3://{FIXED_OUTPUT_BUCKET}/{FIXED_TARGET_KEY}: "
+              f"missing {check['missing_columns']}, unexpected {check['unexpected_columns']}")
 
     result = {
-        "csvIsEmpty": is_empty_flag,
+        "csvIsEmpty": check['is_empty'],
         "bucket": FIXED_OUTPUT_BUCKET,
-        "key": FIXED_TARGET_KEY
+        "key": FIXED_TARGET_KEY,
+        "csvCheck": check
     }
 
-    print("Lambda output:", json.dumps(result))  
+    print("Lambda output:", json.dumps(result))
 
     return result
-
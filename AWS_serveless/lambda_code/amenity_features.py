@@ -0,0 +1,69 @@
+import json
+
+from botocore.exceptions import ClientError
+
+# has_* flags of the ML feature query: a listing has the feature when one of
+# its amenities contains the substring, as with the old
+# `amenities LIKE '%<substring>%'`. A new flag is one more entry here.
+AMENITY_FEATURES = {
+    'has_wifi': 'Wireless',
+    'has_ac': 'Air Conditioning',
+    'has_kitchen': 'Kitchen',
+    'has_heating': 'Heating',
+    'has_washer': 'Washer',
+    'has_dryer': 'Dryer',
+    'has_tv': 'TV',
+    'has_shampoo': 'Shampoo',
+    'has_essentials': 'Essentials',
+    'has_hair_dryer': 'Hair Dryer',
+    'has_elevator': 'Elevator',
+    'has_gym': 'Gym',
+}
+
+# Published by etl_job.py next to its manifest; amenities[i] is bit i % 63
+# of the processed mask column i // 63 (amenity_mask, amenity_mask_1, ...),
+# as laid out by the ETL's AMENITY_MASK_BITS.
+DICTIONARY_BUCKET = 'raw-data-sc171'
+DICTIONARY_KEY = 'etl_manifest/amenity_dictionary.json'
+MASK_BITS = 63
+
+
+def mask_column(word):
+    return f'amenity_mask_{word}' if word else 'amenity_mask'
+
+
+def load_dictionary(s3, bucket=DICTIONARY_BUCKET, key=DICTIONARY_KEY):
+    # None until the ETL has written amenity_mask; the flags then fall back
+    # to LIKE over the amenities text.
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except ClientError as e:
+        print(f"⚠️ No amenity dictionary at s3://{bucket}/{key} ({e.response['Error']['Code']}), using LIKE")
+        return None
+
+
+def feature_masks(dictionary):
+    # feature -> {mask column: bits}. The substring match runs over the
+    # dictionary's names, not over every row.
+    masks = {}
+    for feature, pattern in AMENITY_FEATURES.items():
+        masks[feature] = {}
+        for i, name in enumerate(dictionary['amenities']):
+            if pattern in name:
+                column = mask_column(i // MASK_BITS)
+                masks[feature][column] = masks[feature].get(column, 0) | 1 << (i % MASK_BITS)
+    return masks
+
+
+def feature_columns(dictionary=None):
+    masks = feature_masks(dictionary) if dictionary else {}
+    columns = []
+    for feature, pattern in AMENITY_FEATURES.items():
+        if masks.get(feature):
+            tests = ' OR '.join(f"bitwise_and({column}, {mask}) <> 0" for column, mask in masks[feature].items())
+            columns.append(f"CASE WHEN {tests} THEN 1 ELSE 0 END AS {feature}")
+        else:
+            if dictionary:
+                print(f"⚠️ No amenity in dictionary v{dictionary['version']} matches {pattern!r}, using LIKE for {feature}")
+            columns.append(f"CASE WHEN amenities LIKE '%{pattern}%' THEN 1 ELSE 0 END AS {feature}")
+    return columns
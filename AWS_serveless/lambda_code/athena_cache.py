@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+# Report results are cached under CACHE_PREFIX in the result bucket, one
+# object per (report, SQL, source data version):
+#   athena_cache/<label>/<sha256>.csv
+# The source version is a hash of the keys and ETags under the table's S3
+# location, so any ETL run that rewrites processed/ misses the cache.
+CACHE_PREFIX = os.environ.get('ATHENA_CACHE_PREFIX', 'athena_cache/')
+SOURCE_BUCKET = os.environ.get('ATHENA_SOURCE_BUCKET', 'raw-data-sc171')
+SOURCE_PREFIX = os.environ.get('ATHENA_SOURCE_PREFIX', 'processed/')
+# Entries older than CACHE_TTL_SECONDS are ignored and deleted; at most
+# CACHE_MAX_ENTRIES per report are kept, newest first.
+CACHE_TTL_SECONDS = int(os.environ.get('ATHENA_CACHE_TTL', 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('ATHENA_CACHE_MAX_ENTRIES', 3))
+
+QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")")
+COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+
+
+def normalize_sql(query):
+    # Case and whitespace are folded outside quoted literals, comments and a
+    # trailing semicolon are dropped; 'Villa' and 'villa' stay different.
+    parts = []
+    for i, part in enumerate(QUOTED_RE.split(query)):
+        if i % 2:
+            parts.append(part)
+        else:
+            parts.append(' '.join(COMMENT_RE.sub(' ', part).lower().split()))
+    return ' '.join(p for p in parts if p).rstrip(' ;')
+
+
+def is_missing(error):
+    return error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound')
+
+
+class AthenaResultCache:
+    # Create once at module scope. Cache failures never fail a report: they
+    # are logged and treated as a miss.
+
+    def __init__(self, s3_client, bucket, prefix=CACHE_PREFIX,
+                 source_bucket=SOURCE_BUCKET, source_prefix=SOURCE_PREFIX,
+                 ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.source_bucket = source_bucket
+        self.source_prefix = source_prefix
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def source_fingerprint(self):
+        digest = hashlib.sha256()
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.source_bucket, Prefix=self.source_prefix):
+            for obj in page.get('Contents', []):
+                digest.update(f"{obj['Key']}\0{obj['ETag']}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def key(self, label, query, database):
+        # None when the source cannot be listed; the report then runs uncached.
+        try:
+            fingerprint = self.source_fingerprint()
+        except ClientError as e:
+            print(f"⚠️ Could not fingerprint s3://{self.source_bucket}/{self.source_prefix}: {e}")
+            return None
+        digest = hashlib.sha256(
+            f"{database}\n{normalize_sql(query)}\n{fingerprint}".encode('utf-8')).hexdigest()
+        return f"{self.prefix}{label}/{digest}.csv"
+
+    def lookup(self, cache_key):
+        # True when a fresh entry exists; an expired one is deleted.
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=cache_key)
+            if self._expired(head['LastModified']):
+                self.s3.delete_object(Bucket=self.bucket, Key=cache_key)
+                print(f"⌛ Cache entry {cache_key} expired")
+                return False
+            return True
+        except ClientError as e:
+            if not is_missing(e):
+                print(f"⚠️ Cache lookup failed for {cache_key}: {e}")
+            return False
+
+    def fetch(self, cache_key, target_bucket, target_key):
+        # On a hit, copies the cached CSV to the target and returns True.
+        if not self.lookup(cache_key):
+            return False
+        try:
+            self.s3.copy_object(
+                Bucket=target_bucket,
+                CopySource={'Bucket': self.bucket, 'Key': cache_key},
+                Key=target_key
+            )
+        except ClientError as e:
+            print(f"⚠️ Could not copy {cache_key} to {target_key}: {e}")
+            return False
+        print(f"✅ Cache hit: copied {cache_key} to {target_key}")
+        return True
+
+    def store(self, cache_key, source_bucket, source_key):
+        try:
+            self.s3.copy_object(
+                Bucket=self.bucket,
+                CopySource={'Bucket': source_bucket, 'Key': source_key},
+                Key=cache_key
+            )
+            self.evict(cache_key.rsplit('/', 1)[0] + '/')
+        except ClientError as e:
+            print(f"⚠️ Could not cache {source_key} as {cache_key}: {e}")
+
+    def evict(self, label_prefix):
+        entries = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=label_prefix):
+            entries.extend(page.get('Contents', []))
+        entries.sort(key=lambda obj: obj['LastModified'], reverse=True)
+        stale = [obj['Key'] for i, obj in enumerate(entries)
+                 if i >= self.max_entries or self._expired(obj['LastModified'])]
+        if stale:
+            self.s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in stale], 'Quiet': True})
+            print(f"🧹 Evicted {len(stale)} cache entries under {label_prefix}")
+
+    def _expired(self, last_modified):
+        age = (datetime.now(timezone.utc) - last_modified).total_seconds()
+        return age > self.ttl
@@ -0,0 +1,104 @@
+import csv
+import io
+
+import pipeline_metrics
+from athena_runner import split_s3_uri
+
+# property_insights.csv and price_range.csv come from one GROUPING SETS
+# query, so the analytics branch scans processed once instead of twice and
+# evaluates the price tier CASE once per row. GROUPING(property_type) tells
+# the two groupings apart even when property_type itself is NULL.
+REPORTS_QUERY = """
+SELECT
+    CASE WHEN GROUPING(property_type) = 0 THEN 'property_insights' ELSE 'price_range' END AS report,
+    property_type,
+    tier AS price_tier,
+    COUNT(*) AS number_of_listings,
+    AVG(review_scores_accuracy) AS avg_accuracy,
+    AVG(review_scores_communication) AS avg_communication,
+    AVG(review_scores_location) AS avg_location,
+    AVG(review_scores_value) AS avg_value,
+    MIN(price) AS min_price
+FROM (
+    SELECT
+        property_type,
+        review_scores_accuracy,
+        review_scores_communication,
+        review_scores_location,
+        review_scores_value,
+        price,
+        CASE
+            WHEN price IS NULL THEN NULL
+            WHEN price < 50 THEN 'Budget (Under $50)'
+            WHEN price < 150 THEN 'Mid-range ($50-$149)'
+            WHEN price < 300 THEN 'Upper Mid-range ($150-$299)'
+            ELSE 'Luxury ($300+)'
+        END AS tier
+    FROM processed
+    WHERE number_of_reviews > 5
+)
+GROUP BY GROUPING SETS ((property_type), (tier));
+"""
+
+REPORT_COLUMNS = {
+    'property_insights': ['property_type', 'number_of_listings', 'avg_accuracy',
+                          'avg_communication', 'avg_location', 'avg_value'],
+    'price_range': ['price_tier', 'number_of_listings', 'avg_accuracy', 'avg_value'],
+}
+REPORT_KEYS = {
+    'property_insights': 'property_insights.csv',
+    'price_range': 'price_range.csv',
+}
+
+
+def athena_csv_line(values):
+    # Same layout as Athena's own result files: every value quoted, NULL empty.
+    return ','.join('"' + v.replace('"', '""') + '"' if v != '' else '' for v in values) + '\n'
+
+
+def split_reports(text):
+    # Rebuilds the two original result sets, including their ORDER BY:
+    # property_insights by number_of_listings DESC, price_range by MIN(price).
+    # The price_tier group of NULL prices is what `price IS NOT NULL` used to drop.
+    rows = list(csv.DictReader(io.StringIO(text)))
+    reports = {
+        'property_insights': sorted(
+            (r for r in rows if r['report'] == 'property_insights'),
+            key=lambda r: int(r['number_of_listings']), reverse=True),
+        'price_range': sorted(
+            (r for r in rows if r['report'] == 'price_range' and r['price_tier'] != ''),
+            key=lambda r: float(r['min_price'])),
+    }
+    out = {}
+    for name, report_rows in reports.items():
+        columns = REPORT_COLUMNS[name]
+        out[name] = athena_csv_line(columns) + ''.join(
+            athena_csv_line([r[c] for c in columns]) for r in report_rows)
+    return out
+
+
+def generate_reports(s3, query_runner, result_cache, bucket, database, output_location,
+                     context=None, refresh=False):
+    # Runs (or reuses from the cache) the combined query and writes both
+    # report CSVs to bucket. Returns the state, cache outcome and query stats.
+    cache_key = result_cache.key('reports', REPORTS_QUERY, database)
+    stats = None
+    if cache_key and not refresh and result_cache.lookup(cache_key):
+        source_bucket, source_key, cache = result_cache.bucket, cache_key, 'hit'
+    else:
+        stats = query_runner.run(REPORTS_QUERY, database, output_location,
+                                 label='reports', context=context)
+        if stats['state'] != 'SUCCEEDED':
+            return {'state': stats['state'], 'cache': 'miss', 'query_stats': stats}
+        source_bucket, source_key = split_s3_uri(stats['output_location'])
+        cache = 'miss'
+
+    body = s3.get_object(Bucket=source_bucket, Key=source_key)['Body'].read().decode('utf-8')
+    for name, text in split_reports(body).items():
+        s3.put_object(Bucket=bucket, Key=REPORT_KEYS[name], Body=text.encode('utf-8'))
+        print(f"✅ Wrote {text.count(chr(10)) - 1} rows to s3://{bucket}/{REPORT_KEYS[name]}")
+        pipeline_metrics.add(rows=text.count(chr(10)) - 1)
+
+    if cache == 'miss' and cache_key:
+        result_cache.store(cache_key, source_bucket, source_key)
+    return {'state': 'SUCCEEDED', 'cache': cache, 'query_stats': stats}
@@ -0,0 +1,140 @@
+import json
+import os
+import time
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+import pipeline_metrics
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+THROTTLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException')
+
+# Polling starts fast for short report queries and backs off to MAX_POLL_SECONDS.
+INITIAL_POLL_SECONDS = 0.2
+MAX_POLL_SECONDS = 3.0
+BACKOFF_FACTOR = 1.5
+DEFAULT_TIMEOUT_SECONDS = int(os.environ.get('ATHENA_QUERY_TIMEOUT', 600))
+# Stop polling this long before the Lambda itself would be killed, so the
+# query can still be cancelled.
+LAMBDA_SAFETY_SECONDS = 5
+
+# Athena bills scanned bytes rounded up to the MB, with a 10 MB minimum.
+PRICE_PER_TB = float(os.environ.get('ATHENA_PRICE_PER_TB', 5.0))
+MIN_BILLED_BYTES = 10 * 1024 * 1024
+
+
+def split_s3_uri(uri):
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+def estimated_cost(scanned_bytes):
+    billed = max(MIN_BILLED_BYTES, -(-scanned_bytes // (1024 * 1024)) * 1024 * 1024)
+    return round(billed / 1024 ** 4 * PRICE_PER_TB, 6)
+
+
+def query_stats(execution, label, polls, wall_seconds, timed_out):
+    status = execution.get('Status', {})
+    statistics = execution.get('Statistics', {})
+    scanned = statistics.get('DataScannedInBytes', 0)
+    return {
+        'label': label,
+        'query_execution_id': execution.get('QueryExecutionId'),
+        'state': status.get('State'),
+        'state_change_reason': status.get('StateChangeReason'),
+        'timed_out': timed_out,
+        'output_location': execution.get('ResultConfiguration', {}).get('OutputLocation'),
+        'data_scanned_bytes': scanned,
+        'estimated_cost_usd': estimated_cost(scanned),
+        'queue_ms': statistics.get('QueryQueueTimeInMillis'),
+        'planning_ms': statistics.get('QueryPlanningTimeInMillis'),
+        'engine_execution_ms': statistics.get('EngineExecutionTimeInMillis'),
+        'service_processing_ms': statistics.get('ServiceProcessingTimeInMillis'),
+        'total_execution_ms': statistics.get('TotalExecutionTimeInMillis'),
+        'wall_ms': int(wall_seconds * 1000),
+        'polls': polls,
+    }
+
+
+class AthenaQueryRunner:
+    # Runs a query to completion with backed-off polling and a deadline, and
+    # returns its statistics. A query still running at the deadline is
+    # cancelled and reported with state CANCELLED and timed_out true.
+
+    def __init__(self, athena_client, timeout=DEFAULT_TIMEOUT_SECONDS,
+                 initial_poll=INITIAL_POLL_SECONDS, max_poll=MAX_POLL_SECONDS,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.athena = athena_client
+        self.timeout = timeout
+        self.initial_poll = initial_poll
+        self.max_poll = max_poll
+        self.clock = clock
+        self.sleep = sleep
+
+    def run(self, query, database, output_location, label=None, context=None, timeout=None):
+        started = self.clock()
+        deadline = started + self._budget(context, timeout)
+        response = self.athena.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={'Database': database},
+            ResultConfiguration={'OutputLocation': output_location}
+        )
+        query_execution_id = response['QueryExecutionId']
+
+        polls = 0
+        delay = self.initial_poll
+        timed_out = False
+        while True:
+            execution = self._get_execution(query_execution_id)
+            polls += 1
+            if execution and execution['Status']['State'] in TERMINAL_STATES:
+                break
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                execution = self._cancel(query_execution_id) or execution
+                # It may have finished between the last poll and the cancel.
+                timed_out = not (execution and execution['Status']['State'] == 'SUCCEEDED')
+                break
+            self.sleep(min(delay, remaining))
+            delay = min(delay * BACKOFF_FACTOR, self.max_poll)
+
+        stats = query_stats(execution or {'QueryExecutionId': query_execution_id},
+                            label, polls, self.clock() - started, timed_out)
+        if timed_out:
+            stats['state'] = 'CANCELLED'
+        print(f"📊 Athena {label or query_execution_id}: {json.dumps(stats)}")
+        pipeline_metrics.add(bytes_read=stats['data_scanned_bytes'])
+        return stats
+
+    def unload(self, query, database, output_location, target_location, label=None,
+               context=None, timeout=None):
+        # Writes the result as Snappy Parquet files under target_location
+        # (which must be empty) instead of a CSV in output_location.
+        statement = (f"UNLOAD ({query.strip().rstrip(';')}) TO '{target_location}' "
+                     f"WITH (format = 'PARQUET', compression = 'SNAPPY')")
+        return self.run(statement, database, output_location, label, context, timeout)
+
+    def _budget(self, context, timeout):
+        budget = self.timeout if timeout is None else timeout
+        if context is not None:
+            remaining = context.get_remaining_time_in_millis() / 1000 - LAMBDA_SAFETY_SECONDS
+            budget = min(budget, max(remaining, 0))
+        return budget
+
+    def _get_execution(self, query_execution_id):
+        try:
+            return self.athena.get_query_execution(
+                QueryExecutionId=query_execution_id)['QueryExecution']
+        except ClientError as e:
+            # A throttled poll is just a longer wait.
+            if e.response['Error']['Code'] in THROTTLE_ERRORS:
+                return None
+            raise
+
+    def _cancel(self, query_execution_id):
+        try:
+            self.athena.stop_query_execution(QueryExecutionId=query_execution_id)
+        except ClientError as e:
+            print(f"⚠️ Could not cancel {query_execution_id}: {e}")
+        return self._get_execution(query_execution_id)
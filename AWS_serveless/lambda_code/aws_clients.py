@@ -0,0 +1,48 @@
+import threading
+
+import pipeline_metrics
+
+# boto3 clients shared by the handlers. Importing boto3 and building a client
+# are the largest part of a cold start, so handlers hold a LazyClient at
+# module level and the real client is created on its first use, once per
+# (service, region) for the life of the execution environment. boto3 itself
+# is only imported then. Every client reports its API calls to
+# pipeline_metrics.
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service, region=None):
+    key = (service, region)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                client = boto3.client(service, region_name=region)
+                _clients[key] = pipeline_metrics.instrument(client)
+    return client
+
+
+def created_clients():
+    return sorted(_clients)
+
+
+class LazyClient:
+    # Stands in for boto3.client(service) at module level; attribute access
+    # (methods, .exceptions, .meta) goes to the shared client.
+
+    def __init__(self, service, region=None):
+        self.service = service
+        self.region = region
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service, self.region), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service!r}, {self.region!r})"
+
+
+def lazy_client(service, region=None):
+    return LazyClient(service, region)
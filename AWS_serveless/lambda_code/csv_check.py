@@ -0,0 +1,75 @@
+import csv
+import io
+import time
+
+from botocore.exceptions import ClientError
+
+import pipeline_metrics
+
+# The check reads the head of the object with ranged GETs instead of
+# downloading and parsing all of it: RANGE_BYTES at first, doubling until
+# enough complete rows are in hand or the object ends. The object size comes
+# from the Content-Range of the first response, so a small report costs a
+# single request.
+RANGE_BYTES = 8192
+MAX_RANGE_BYTES = 1024 * 1024
+
+
+def read_head(s3, bucket, key, min_rows, range_bytes=RANGE_BYTES):
+    # Returns the complete lines of the sampled head, whether it is the whole
+    # object, and the GET response of the last read. Anything after the last
+    # newline of a partial read is cut.
+    while True:
+        response = s3.get_object(Bucket=bucket, Key=key, Range=f'bytes=0-{range_bytes - 1}')
+        body = response['Body'].read()
+        content_range = response.get('ContentRange')
+        size = int(content_range.rsplit('/', 1)[1]) if content_range else len(body)
+        whole = len(body) >= size
+        if not whole:
+            body = body[:body.rfind(b'\n') + 1]
+        lines = body.decode('utf-8', errors='replace').splitlines()
+        if whole or len(lines) > min_rows or range_bytes >= MAX_RANGE_BYTES:
+            return lines, whole, dict(response, size=size, bytes_read=len(body))
+        range_bytes *= 2
+
+
+def check_csv(s3, bucket, key, expected_columns, min_rows=2):
+    # Header against expected_columns, at least min_rows data rows, and
+    # per-row quality signals over the sampled rows.
+    started = time.perf_counter()
+    result = {'exists': False, 'size': 0, 'bytes_read': 0, 'schema_ok': False,
+              'missing_columns': [], 'unexpected_columns': [], 'rows_sampled': 0,
+              'sample_is_whole_file': False, 'ragged_rows': 0, 'empty_values': 0}
+    try:
+        lines, whole, response = read_head(s3, bucket, key, min_rows)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'InvalidRange':
+            # S3 answers any range on a zero-byte object with 416.
+            result['exists'] = True
+        elif code in ('404', 'NoSuchKey', 'NotFound'):
+            print(f"File not found: s3://{bucket}/{key}")
+        else:
+            raise
+        return finish(result, min_rows, started)
+
+    rows = list(csv.reader(io.StringIO('\n'.join(lines))))
+    header, data = (rows[0], rows[1:]) if rows else ([], [])
+    result.update(exists=True, size=response['size'], etag=response.get('ETag', '').strip('"'),
+                  bytes_read=response['bytes_read'], sample_is_whole_file=whole, header=header,
+                  missing_columns=[c for c in expected_columns if c not in header],
+                  unexpected_columns=[c for c in header if c not in expected_columns],
+                  rows_sampled=len(data),
+                  ragged_rows=sum(1 for row in data if len(row) != len(header)),
+                  empty_values=sum(1 for row in data for value in row if value == ''))
+    result['schema_ok'] = header == list(expected_columns)
+    pipeline_metrics.add(rows=len(data))
+    return finish(result, min_rows, started)
+
+
+def finish(result, min_rows, started):
+    # Empty for the state machine: too few rows, or rows it cannot load.
+    result['is_empty'] = not (result['schema_ok'] and result['rows_sampled'] >= min_rows
+                              and not result['ragged_rows'])
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError, ParamValidationError
+
+# Trained models are stored by what went into them:
+#   s3://ml-model-sc171/models/<sha256>/ml_model.pkl
+# The fingerprint covers the training data (key, ETag and size of every
+# object), ml_code.py, the container image and the hyperparameters. A launch
+# whose fingerprint already has a model copies it to ml_model.pkl, which the
+# web tier loads, instead of training again. models/<sha256>/job.json names
+# the job training that fingerprint; it is written with If-None-Match, so
+# only one launch can start it and the others follow that job.
+# models/current.json names the fingerprint last promoted; with
+# ML_HYPERPARAMETERS mode "incremental" the job extends that model, and its
+# fingerprint is then part of the new one.
+MODEL_BUCKET = os.environ.get('MODEL_BUCKET', 'ml-model-sc171')
+MODEL_PREFIX = os.environ.get('MODEL_PREFIX', 'models/')
+MODEL_FILE = 'ml_model.pkl'
+FINGERPRINT_VERSION = 1
+
+# What both launch handlers train with; part of the fingerprint.
+TRAINING_IMAGE = "683313688378.dkr.ecr.us-east-1.amazonaws.com/sagemaker-scikit-learn:1.2-1"
+TRAINING_CODE_URI = "s3://my-code-sc171/ml_code.py"
+# Read by ml_code.py from ML_HYPERPARAMETERS.
+HYPERPARAMETERS = dict({
+    "rare_threshold": 0.01,
+    "test_size": 0.2,
+    "random_state": 42,
+}, **json.loads(os.environ.get("ML_HYPERPARAMETERS", "{}")))
+
+JOB_RUNNING = ("InProgress", "Stopping")
+# First boto3 whose PutObject takes both IfNoneMatch and IfMatch (pinned in
+# requirements.txt). An older one rejects them before the call; claim then
+# falls back to a read followed by a plain write, which two launches racing
+# within that gap can both pass.
+CONDITIONAL_WRITES_BOTO3 = "1.36.0"
+# Keys of a fingerprint document that say what a model was trained on and
+# with which code. An incremental launch whose current model has the same
+# reuses it, whatever mode trained it.
+INPUT_KEYS = ('version', 'data', 'code', 'image')
+
+
+def split_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def is_missing(error):
+    return error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound')
+
+
+def is_conflict(error):
+    return error.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412')
+
+
+class ModelCache:
+    # Create once at module scope.
+
+    def __init__(self, s3_client, sagemaker_client, bucket=MODEL_BUCKET, prefix=MODEL_PREFIX):
+        self.s3 = s3_client
+        self.sagemaker = sagemaker_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def objects(self, uri):
+        # (key, ETag, size) of one object, or of every object under a prefix
+        # when the URI ends in '/'.
+        bucket, key = split_uri(uri)
+        if not key.endswith('/'):
+            head = self.s3.head_object(Bucket=bucket, Key=key)
+            return [(key, head['ETag'], head['ContentLength'])]
+        found = []
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=key):
+            found.extend((obj['Key'], obj['ETag'], obj['Size']) for obj in page.get('Contents', []))
+        return found
+
+    def fingerprint(self, data_uri, code_uri=TRAINING_CODE_URI, image=TRAINING_IMAGE,
+                    hyperparameters=HYPERPARAMETERS, base_model=None):
+        # The digest and the document it was taken of.
+        document = {
+            'version': FINGERPRINT_VERSION,
+            'data': {'uri': data_uri, 'objects': self.objects(data_uri)},
+            'code': {'uri': code_uri, 'objects': self.objects(code_uri)},
+            'image': image,
+            'hyperparameters': hyperparameters,
+        }
+        if base_model:
+            document['base_model'] = base_model
+        canonical = json.dumps(document, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest(), document
+
+    def plan(self, data_uri, hyperparameters=HYPERPARAMETERS):
+        # (fingerprint, document, base_model). base_model is the fingerprint
+        # an incremental job extends, or None for a full training.
+        base = self.current() if hyperparameters.get('mode') == 'incremental' else None
+        fingerprint, document = self.fingerprint(data_uri, hyperparameters=hyperparameters, base_model=base)
+        if base:
+            # job.json went through JSON, so compare the documents as JSON.
+            inputs = json.loads(json.dumps({key: document[key] for key in INPUT_KEYS}))
+            if self.trained_on(base) == inputs:
+                # The current model was trained on exactly this data.
+                return base, document, None
+        return fingerprint, document, base
+
+    def current(self):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.current_key())['Body'].read()
+        except ClientError as e:
+            if is_missing(e):
+                return None
+            raise
+        return json.loads(body)['fingerprint']
+
+    def trained_on(self, fingerprint):
+        # The inputs of the model of fingerprint, from its job.json.
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.job_key(fingerprint))['Body'].read()
+        except ClientError as e:
+            if is_missing(e):
+                return None
+            raise
+        claim = json.loads(body)
+        return {key: claim.get(key) for key in INPUT_KEYS}
+
+    def previous_model_inputs(self, base_model):
+        # ProcessingInputs of an incremental job: the model it extends and
+        # that model's training_state.pkl.
+        if not base_model:
+            return []
+        return [{
+            "InputName": "previous-model",
+            "S3Input": {
+                "S3Uri": self.output_uri(base_model),
+                "LocalPath": "/opt/ml/processing/input/previous/",
+                "S3DataType": "S3Prefix",
+                "S3InputMode": "File"
+            }
+        }]
+
+    def current_key(self):
+        return f"{self.prefix}current.json"
+
+    def model_key(self, fingerprint):
+        return f"{self.prefix}{fingerprint}/{MODEL_FILE}"
+
+    def output_uri(self, fingerprint):
+        # ProcessingOutput S3Uri; ml_code.py writes MODEL_FILE into it.
+        return f"s3://{self.bucket}/{self.prefix}{fingerprint}/"
+
+    def job_key(self, fingerprint):
+        return f"{self.prefix}{fingerprint}/job.json"
+
+    def cached(self, fingerprint):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.model_key(fingerprint))
+            return True
+        except ClientError as e:
+            if is_missing(e):
+                return False
+            raise
+
+    def claim(self, fingerprint, job_name, document):
+        # None when this launch may start job_name, else the name of the job
+        # already training this fingerprint. A claim left by a job that
+        # ended without a model (failed, stopped) is taken over.
+        body = json.dumps(dict(document, fingerprint=fingerprint, job=job_name,
+                               claimed_at=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+                          indent=1, sort_keys=True).encode('utf-8')
+        key = self.job_key(fingerprint)
+        if self.write_claim(key, body, IfNoneMatch='*'):
+            return None
+        response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        holder = json.loads(response['Body'].read())['job']
+        if self.job_status(holder) in JOB_RUNNING:
+            return holder
+        if self.write_claim(key, body, IfMatch=response['ETag']):
+            return None
+        # Another launch took it over between the read and the write.
+        return json.loads(self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read())['job']
+
+    def write_claim(self, key, body, **condition):
+        # False when the condition (IfNoneMatch='*' or IfMatch=<etag>) fails.
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=body, **condition)
+            return True
+        except ParamValidationError:
+            print(f"⚠️ This botocore has no conditional PutObject (boto3 >= {CONDITIONAL_WRITES_BOTO3} "
+                  f"has), claiming {key} without it")
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            return False
+        try:
+            etag = self.s3.head_object(Bucket=self.bucket, Key=key)['ETag']
+        except ClientError as e:
+            if not is_missing(e):
+                raise
+            etag = None
+        if etag != condition.get('IfMatch'):
+            return False
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+        return True
+
+    def release(self, fingerprint):
+        # After a launch that claimed the fingerprint failed to start its job.
+        self.s3.delete_object(Bucket=self.bucket, Key=self.job_key(fingerprint))
+
+    def job_status(self, job_name):
+        try:
+            return self.sagemaker.describe_processing_job(ProcessingJobName=job_name)['ProcessingJobStatus']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('ValidationException', 'ResourceNotFound'):
+                return None
+            raise
+
+    def promote(self, fingerprint):
+        # Makes the model of fingerprint the one the web tier loads.
+        self.s3.copy_object(Bucket=self.bucket, Key=MODEL_FILE,
+                            CopySource={'Bucket': self.bucket, 'Key': self.model_key(fingerprint)})
+        self.s3.put_object(Bucket=self.bucket, Key=self.current_key(),
+                           Body=json.dumps({'fingerprint': fingerprint}).encode('utf-8'))
+        return f"s3://{self.bucket}/{self.model_key(fingerprint)}"
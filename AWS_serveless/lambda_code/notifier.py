@@ -0,0 +1,130 @@
+# Pipeline notifications. Handlers return notification() dicts in their
+# result instead of calling sns.publish; the state machine collects the ones
+# of a run and invokes 7_sendsns.py once, asynchronously, at the end. That
+# handler sends them as a single digest through PublishBatch.
+DEFAULT_TOPIC_ARN = 'arn:aws:sns:us-east-1:514475511198:query_result'
+
+# SNS limits: 256 KB per message and per PublishBatch call (kept 1 KB under
+# for the subject and envelope), 10 entries per call, 100-character subjects.
+MAX_MESSAGE_BYTES = 255 * 1024
+MAX_BATCH_BYTES = 256 * 1024
+MAX_BATCH_ENTRIES = 10
+MAX_SUBJECT_CHARS = 100
+
+SEVERITIES = ('error', 'warning', 'info')
+
+# Text of the notifications that are only named by the state machine.
+EVENT_TEMPLATES = {
+    'report_ready': ("CSV File Processed Successfully",
+                     "The CSV file s3://{bucket}/{key} has been generated and contains content. "
+                     "Setup is complete."),
+    'run_failed': ("Pipeline Run Failed", "{error}: {cause}"),
+}
+
+
+def notification(event, severity='info', subject=None, message=None, **details):
+    return dict(details, event=event, severity=severity, subject=subject, message=message)
+
+
+def render(item):
+    # Subject and message of a notification, filled from EVENT_TEMPLATES
+    # when the sender only gave the event and its details.
+    subject, message = item.get('subject'), item.get('message')
+    if item.get('event') in EVENT_TEMPLATES and not (subject and message):
+        template_subject, template_message = EVENT_TEMPLATES[item['event']]
+        subject = subject or template_subject
+        message = message or template_message.format_map({k: v for k, v in item.items() if v is not None})
+    return subject or item.get('event', 'notification'), message or ''
+
+
+def digest(run_id, notifications):
+    # Errors first, then warnings and infos, each in the order they happened.
+    items = sorted(notifications, key=lambda n: SEVERITIES.index(n.get('severity', 'info')))
+    errors = sum(1 for n in items if n.get('severity') == 'error')
+    run = run_id or 'standalone'
+    if errors:
+        subject = f"Pipeline {run}: {errors} of {len(items)} notifications failed"
+    elif len(items) == 1:
+        subject = render(items[0])[0]
+    else:
+        subject = f"Pipeline {run}: {len(items)} notifications"
+    lines = [f"Pipeline run {run}", f"{len(items)} notification(s), {errors} error(s)", ""]
+    for item in items:
+        item_subject, item_message = render(item)
+        lines.append(f"[{item.get('severity', 'info').upper()}] {item_subject}")
+        lines.extend(f"  {line}" for line in item_message.splitlines())
+    return clean_subject(subject), '\n'.join(lines)
+
+
+def clean_subject(subject):
+    # SNS subjects are ASCII without line breaks.
+    subject = ' '.join(subject.encode('ascii', 'ignore').decode('ascii').split())
+    return subject[:MAX_SUBJECT_CHARS] or 'Pipeline notification'
+
+
+def split_message(message, max_bytes=MAX_MESSAGE_BYTES):
+    # Parts of at most max_bytes, cut at line ends where possible.
+    parts, current, size = [], [], 0
+    for line in message.encode('utf-8').splitlines(keepends=True):
+        while len(line) > max_bytes:
+            parts.extend([b''.join(current)] if current else [])
+            current, size = [], 0
+            cut = max_bytes
+            while cut and (line[cut] & 0xC0) == 0x80:
+                cut -= 1
+            parts.append(line[:cut])
+            line = line[cut:]
+        if size + len(line) > max_bytes:
+            parts.append(b''.join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current or not parts:
+        parts.append(b''.join(current))
+    return [part.decode('utf-8') for part in parts]
+
+
+class Notifier:
+    # Publishes digests with sns.publish_batch; a digest over the message
+    # limit is split into parts that share the batch calls.
+
+    def __init__(self, sns_client, max_message_bytes=MAX_MESSAGE_BYTES):
+        self.sns = sns_client
+        self.max_message_bytes = max_message_bytes
+
+    def publish_digest(self, topic_arn, run_id, notifications):
+        subject, message = digest(run_id, notifications)
+        parts = split_message(message, self.max_message_bytes)
+        entries = []
+        for i, part in enumerate(parts):
+            part_subject = subject if len(parts) == 1 else clean_subject(f"({i + 1}/{len(parts)}) {subject}")
+            entries.append({'Id': str(i), 'Subject': part_subject, 'Message': part})
+        calls = self.publish_batch(topic_arn, entries)
+        print(f"📣 Published {len(notifications)} notifications to {topic_arn} "
+              f"as {len(entries)} messages in {calls} calls")
+        return {'topic_arn': topic_arn, 'notifications': len(notifications),
+                'messages': len(entries), 'calls': calls, 'subject': subject}
+
+    def publish_batch(self, topic_arn, entries):
+        calls = 0
+        for batch in batches(entries):
+            response = self.sns.publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=batch)
+            calls += 1
+            failed = response.get('Failed') or []
+            if failed:
+                raise RuntimeError(f"SNS rejected {len(failed)} of {len(batch)} messages: "
+                                   f"{failed[0].get('Code')} {failed[0].get('Message')}")
+        return calls
+
+
+def batches(entries):
+    batch, size = [], 0
+    for entry in entries:
+        entry_size = len(entry['Message'].encode('utf-8')) + len(entry['Subject'])
+        if batch and (len(batch) == MAX_BATCH_ENTRIES or size + entry_size > MAX_BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
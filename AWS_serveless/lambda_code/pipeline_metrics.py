@@ -0,0 +1,228 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+
+# Per-step telemetry in CloudWatch Embedded Metric Format: every step prints
+# one JSON line, which CloudWatch Logs turns into metrics under NAMESPACE with
+# the dimension Step. The pipeline run id, the function and the per-operation
+# AWS call figures ride along as properties for Logs Insights. Steps nest -
+# a handler step around its query, an ETL job around its passes - and a
+# step's bytes and AWS calls are added to its parent's when it ends. Rows are
+# not: the phases of a job see the same rows, so each step counts its own.
+#
+# The Lambda handlers, etl_job.py (via --extra-py-files) and ml_code.py (via
+# an extra processing input) all use this module.
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AirbnbPipeline')
+# Where the Glue and SageMaker jobs load this module from.
+CODE_URI = os.environ.get('METRICS_CODE_URI', 's3://my-code-sc171/pipeline_metrics.py')
+METRICS = [
+    ('WallTime', 'Milliseconds'),
+    ('BytesRead', 'Bytes'),
+    ('BytesWritten', 'Bytes'),
+    ('RowsProcessed', 'Count'),
+    ('AwsCalls', 'Count'),
+    ('AwsCallTime', 'Milliseconds'),
+    ('AwsCallErrors', 'Count'),
+    ('PeakMemory', 'Megabytes'),
+]
+# S3 operations whose payload counts as bytes read or written.
+S3_READS = {'GetObject'}
+S3_WRITES = {'PutObject', 'UploadPart'}
+
+_steps = []
+_lock = threading.Lock()
+
+
+def new_run_id():
+    return f"local-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def run_id_from(event=None):
+    # Step Functions puts run_id (the execution name) into every Lambda
+    # payload; the Glue job gets it as --run_id and ml_code.py as
+    # PIPELINE_RUN_ID. Anything started by hand gets a local id.
+    if isinstance(event, dict) and event.get('run_id'):
+        return event['run_id']
+    return os.environ.get('PIPELINE_RUN_ID') or new_run_id()
+
+
+def peak_memory_mb():
+    # Process high-water mark so far (ru_maxrss is in KB on Linux), including
+    # finished child processes such as the ETL worker pool.
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+class Step:
+
+    def __init__(self, name, run_id=None, emit=print, **properties):
+        self.name = name
+        self.run_id = run_id
+        self.emit = emit
+        self.properties = properties
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # 'service.Operation' -> [calls, milliseconds, errors]
+        self.calls = {}
+        self.parent = None
+        self.started = None
+
+    def add(self, rows=0, bytes_read=0, bytes_written=0):
+        with _lock:
+            self.rows += rows or 0
+            self.bytes_read += bytes_read or 0
+            self.bytes_written += bytes_written or 0
+
+    def record_call(self, operation, ms, error=False):
+        with _lock:
+            entry = self.calls.setdefault(operation, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] += int(error)
+
+    def __enter__(self):
+        with _lock:
+            self.parent = _steps[-1] if _steps else None
+            if self.run_id is None:
+                self.run_id = self.parent.run_id if self.parent else run_id_from()
+            _steps.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_ms = (time.perf_counter() - self.started) * 1000
+        with _lock:
+            _steps.remove(self)
+        if self.parent:
+            self.parent.add(bytes_read=self.bytes_read, bytes_written=self.bytes_written)
+            with _lock:
+                for operation, (calls, ms, errors) in self.calls.items():
+                    entry = self.parent.calls.setdefault(operation, [0, 0.0, 0])
+                    entry[0] += calls
+                    entry[1] += ms
+                    entry[2] += errors
+        self.emit(json.dumps(self.record(wall_ms, exc_type)))
+        return False
+
+    def record(self, wall_ms, exc_type=None):
+        values = {
+            'WallTime': round(wall_ms, 1),
+            'BytesRead': self.bytes_read,
+            'BytesWritten': self.bytes_written,
+            'RowsProcessed': self.rows,
+            'AwsCalls': sum(c[0] for c in self.calls.values()),
+            'AwsCallTime': round(sum(c[1] for c in self.calls.values()), 1),
+            'AwsCallErrors': sum(c[2] for c in self.calls.values()),
+            'PeakMemory': round(peak_memory_mb(), 1),
+        }
+        return dict(
+            self.properties,
+            _aws={'Timestamp': int(time.time() * 1000),
+                  'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Step']],
+                                         'Metrics': [{'Name': n, 'Unit': u} for n, u in METRICS]}]},
+            Step=self.name,
+            RunId=self.run_id,
+            Status='error' if exc_type else 'ok',
+            Error=exc_type.__name__ if exc_type else None,
+            Parent=self.parent.name if self.parent else None,
+            AwsCallsByOperation={op: {'calls': c, 'ms': round(ms, 1), 'errors': e}
+                                 for op, (c, ms, e) in sorted(self.calls.items())},
+            **values,
+        )
+
+
+def step(name, run_id=None, **properties):
+    return Step(name, run_id, **properties)
+
+
+def current():
+    return _steps[-1] if _steps else None
+
+
+def current_run_id():
+    running = current()
+    return running.run_id if running else run_id_from()
+
+
+def add(rows=0, bytes_read=0, bytes_written=0):
+    # Counts for the innermost running step; a no-op outside any step.
+    running = current()
+    if running:
+        running.add(rows, bytes_read, bytes_written)
+
+
+def instrumented(name):
+    # Makes a Lambda handler one step, tagged with the run id of its event
+    # and the function name.
+    def wrap(handler):
+        @functools.wraps(handler)
+        def lambda_handler(event, context):
+            function = getattr(context, 'function_name', None) or handler.__module__
+            with Step(name, run_id_from(event), Function=function):
+                return handler(event, context)
+        return lambda_handler
+    return wrap
+
+
+def body_size(body):
+    # bytes, or a stream (botocore wraps bytes in BytesIO; uploads pass file chunks)
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        pass
+    try:
+        position = body.tell()
+        end = body.seek(0, 2)
+        body.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _before_call(model, params, context, **kwargs):
+    service = model.service_model.service_name
+    context['metrics_operation'] = f"{service}.{model.name}"
+    context['metrics_started'] = time.perf_counter()
+    if service == 's3' and model.name in S3_WRITES:
+        context['metrics_bytes_written'] = body_size(params.get('body'))
+
+
+def _finish_call(context, error, parsed=None):
+    running = current()
+    started = context.get('metrics_started')
+    if running is None or started is None:
+        return
+    operation = context['metrics_operation']
+    running.record_call(operation, (time.perf_counter() - started) * 1000, error)
+    if not error and operation.startswith('s3.'):
+        if operation[3:] in S3_READS:
+            running.add(bytes_read=(parsed or {}).get('ContentLength', 0))
+        elif operation[3:] in S3_WRITES:
+            running.add(bytes_written=context.get('metrics_bytes_written', 0))
+
+
+def _after_call(http_response, parsed, context, **kwargs):
+    # Error responses arrive here too, before botocore raises ClientError.
+    _finish_call(context, http_response.status_code >= 300, parsed)
+
+
+def _after_call_error(context, **kwargs):
+    # Requests that got no response (connection errors, timeouts).
+    _finish_call(context, True)
+
+
+def instrument(client):
+    # Counts and times every API call of a boto3 client against the step
+    # running at the time. Returns the client.
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+    return client
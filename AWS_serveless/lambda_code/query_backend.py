@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from athena_runner import AthenaQueryRunner, query_stats, split_s3_uri
+from aws_clients import lazy_client
+
+# Query backends for the analytics handlers (QUERY_BACKEND):
+#   athena - Athena over the Glue table, results and reports in S3 (default)
+#   duckdb - embedded DuckDB over a local copy of the buckets under
+#            LOCAL_DATA_ROOT (<root>/<bucket>/<key>); no AWS calls
+QUERY_BACKENDS = ('athena', 'duckdb')
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'athena')
+LOCAL_DATA_ROOT = os.environ.get('LOCAL_DATA_ROOT', '/tmp/local_s3')
+
+# Glue tables the handlers query, by S3 location.
+TABLE_LOCATIONS = {'processed': ('raw-data-sc171', 'processed/')}
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# Athena functions the handler SQL uses that DuckDB names differently.
+ATHENA_MACROS = [
+    "CREATE MACRO bitwise_and(x, y) AS CAST(x AS BIGINT) & CAST(y AS BIGINT)",
+]
+
+
+def create_backend(name=QUERY_BACKEND, root=LOCAL_DATA_ROOT):
+    # Returns (s3, query_runner); the pair for duckdb reads and writes local files.
+    if name == 'duckdb':
+        store = LocalBucketStore(root)
+        return store, DuckDBQueryRunner(store)
+    if name != 'athena':
+        raise ValueError(f"QUERY_BACKEND must be one of {QUERY_BACKENDS}, got {name!r}")
+    return lazy_client('s3'), AthenaQueryRunner(lazy_client('athena'))
+
+
+def sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class LocalBucketStore:
+    # The S3 client calls the analytics handlers make, over <root>/<bucket>/<key>.
+    # ETags are derived from size and mtime, which is enough to fingerprint.
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket, key=''):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _missing(self, operation, bucket, key):
+        return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': f'{bucket}/{key}'}}, operation)
+
+    def _entry(self, bucket, key):
+        stat = os.stat(self.path(bucket, key))
+        etag = hashlib.md5(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+        return {'Key': key, 'ETag': f'"{etag}"', 'Size': stat.st_size,
+                'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        try:
+            with open(self.path(Bucket, Key), 'rb') as f:
+                return {'Body': io.BytesIO(f.read())}
+        except FileNotFoundError:
+            raise self._missing('GetObject', Bucket, Key)
+
+    def head_object(self, Bucket, Key):
+        if not os.path.isfile(self.path(Bucket, Key)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return self._entry(Bucket, Key)
+
+    def put_object(self, Bucket, Key, Body):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body if isinstance(Body, bytes) else Body.encode('utf-8'))
+
+    def copy_object(self, Bucket, CopySource, Key):
+        source = self.path(CopySource['Bucket'], CopySource['Key'])
+        if not os.path.isfile(source):
+            raise self._missing('CopyObject', CopySource['Bucket'], CopySource['Key'])
+        target = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self.path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        keys = []
+        for dirpath, _, files in os.walk(self.path(Bucket)):
+            for name in files:
+                key = os.path.relpath(os.path.join(dirpath, name), self.path(Bucket)).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    keys.append(key)
+        yield {'Contents': [self._entry(Bucket, key) for key in sorted(keys)]}
+
+
+class DuckDBQueryRunner:
+    # Same run()/unload() contract as AthenaQueryRunner: executes the query
+    # against the table's files in the local store, writes the result in
+    # Athena's CSV layout (header, every value quoted, NULL empty) or as
+    # Parquet, and returns statistics in the same shape. timeout/context are
+    # not enforced.
+
+    def __init__(self, store, tables=TABLE_LOCATIONS):
+        self.store = store
+        self.tables = tables
+
+    def run(self, query, database, output_location, label=None, context=None, timeout=None):
+        bucket, prefix = split_s3_uri(output_location)
+        return self._execute(query, bucket, prefix, '(HEADER, FORCE_QUOTE *)', label)
+
+    def unload(self, query, database, output_location, target_location, label=None,
+               context=None, timeout=None):
+        # Like Athena's UNLOAD: Snappy Parquet under target_location.
+        bucket, prefix = split_s3_uri(target_location)
+        return self._execute(query, bucket, prefix, '(FORMAT parquet, COMPRESSION snappy)',
+                             label, extension='parquet')
+
+    def _execute(self, query, bucket, prefix, copy_options, label, extension='csv'):
+        import duckdb
+
+        started = time.perf_counter()
+        query_execution_id = str(uuid.uuid4())
+        result_key = f'{prefix}{query_execution_id}.{extension}'
+        result_path = self.store.path(bucket, result_key)
+        os.makedirs(os.path.dirname(result_path), exist_ok=True)
+
+        state, reason = 'SUCCEEDED', None
+        conn = duckdb.connect()
+        conn.execute("SET enable_progress_bar = false")
+        try:
+            for macro in ATHENA_MACROS:
+                conn.execute(macro)
+            for table, (table_bucket, table_prefix) in self.tables.items():
+                conn.execute(f"CREATE VIEW {table} AS {self.table_sql(table_bucket, table_prefix)}")
+            conn.execute(f"COPY ({query.strip().rstrip(';')}) TO {sql_string(result_path)} {copy_options}")
+        except (duckdb.Error, FileNotFoundError) as e:
+            state, reason = 'FAILED', str(e)
+        finally:
+            conn.close()
+
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        execution = {
+            'QueryExecutionId': query_execution_id,
+            'Status': {'State': state, 'StateChangeReason': reason},
+            'ResultConfiguration': {'OutputLocation': f's3://{bucket}/{result_key}'},
+            'Statistics': {'QueryQueueTimeInMillis': 0, 'EngineExecutionTimeInMillis': elapsed_ms,
+                           'TotalExecutionTimeInMillis': elapsed_ms},
+        }
+        stats = query_stats(execution, label, 0, elapsed_ms / 1000, False)
+        stats.update(backend='duckdb', data_scanned_bytes=None, estimated_cost_usd=0.0)
+        print(f"📊 DuckDB {label or query_execution_id}: {json.dumps(stats)}")
+        return stats
+
+    def table_sql(self, bucket, prefix):
+        # Parquet output is Hive-partitioned like the ETL writes it; CSV output
+        # may be one file or one per raw object.
+        entries = [obj['Key'] for page in self.store.paginate(bucket, prefix) for obj in page['Contents']]
+        parquet = [key for key in entries if key.endswith('.parquet')]
+        if parquet:
+            partition_columns = sorted({part.split('=', 1)[0] for key in parquet
+                                        for part in key[len(prefix):].split('/')[:-1] if '=' in part})
+            files = ', '.join(sql_string(self.store.path(bucket, key)) for key in parquet)
+            replace = ', '.join(f"NULLIF({col}, '{NULL_PARTITION}') AS {col}" for col in partition_columns)
+            return (f"SELECT * {f'REPLACE ({replace}) ' if replace else ''}"
+                    f"FROM read_parquet([{files}], hive_partitioning = true, "
+                    f"hive_types_autocast = false, union_by_name = true)")
+        csv_files = [key for key in entries if key.endswith('.csv')]
+        if not csv_files:
+            raise FileNotFoundError(f"no CSV or Parquet files under {self.store.path(bucket, prefix)}")
+        files = ', '.join(sql_string(self.store.path(bucket, key)) for key in csv_files)
+        return f"SELECT * FROM read_csv([{files}], header = true, union_by_name = true)"
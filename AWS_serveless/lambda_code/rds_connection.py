@@ -0,0 +1,79 @@
+import os
+import time
+
+import pymysql
+
+ENDPOINT_TTL_SECONDS = int(os.environ.get('RDS_ENDPOINT_TTL', 900))
+CONNECT_TIMEOUT = 10
+
+
+class RdsConnectionManager:
+    # Create once at module scope so the resolved endpoint, the bootstrapped
+    # databases and the open connections survive across warm invocations.
+
+    def __init__(self, rds_client, endpoint_ttl=ENDPOINT_TTL_SECONDS):
+        self.rds_client = rds_client
+        self.endpoint_ttl = endpoint_ttl
+        self._endpoints = {}
+        self._connections = {}
+        self._bootstrapped = set()
+
+    def endpoint(self, instance_id):
+        cached = self._endpoints.get(instance_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        response = self.rds_client.describe_db_instances(DBInstanceIdentifier=instance_id)
+        address = response['DBInstances'][0]['Endpoint']['Address']
+        self._endpoints[instance_id] = (address, time.monotonic() + self.endpoint_ttl)
+        return address
+
+    def connection(self, instance_id, user, password, database, local_infile=False):
+        key = (instance_id, user, database, local_infile)
+        conn = self._connections.get(key)
+        if conn is not None and self._healthy(conn):
+            return conn
+        self._close(key)
+
+        host = self.endpoint(instance_id)
+        try:
+            conn = self._open(host, user, password, database, local_infile)
+        except pymysql.err.OperationalError:
+            # The instance may have moved (failover, replacement); re-resolve next time.
+            self._endpoints.pop(instance_id, None)
+            raise
+        self._connections[key] = conn
+        return conn
+
+    def discard(self):
+        for key in list(self._connections):
+            self._close(key)
+
+    def _open(self, host, user, password, database, local_infile):
+        if (host, database) in self._bootstrapped:
+            return pymysql.connect(host=host, user=user, password=password,
+                                   database=database, connect_timeout=CONNECT_TIMEOUT,
+                                   local_infile=local_infile)
+
+        conn = pymysql.connect(host=host, user=user, password=password,
+                               connect_timeout=CONNECT_TIMEOUT, local_infile=local_infile)
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database};")
+        conn.select_db(database)
+        self._bootstrapped.add((host, database))
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close(self, key):
+        conn = self._connections.pop(key, None)
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
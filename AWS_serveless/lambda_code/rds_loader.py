@@ -0,0 +1,336 @@
+import codecs
+import csv
+import io
+import itertools
+import os
+import re
+import tempfile
+
+import pipeline_metrics
+
+# Load modes for the RDS loaders:
+#   row    - one INSERT per CSV row (original behaviour)
+#   batch  - multi-row INSERT via executemany, batch_size rows per round trip
+#   infile - LOAD DATA LOCAL INFILE from /tmp spill files of batch_size rows
+LOAD_MODES = ('row', 'batch', 'infile')
+DEFAULT_LOAD_MODE = 'batch'
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_INFILE_BATCH_SIZE = 50000
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Write modes:
+#   append  - add rows to the existing table (original behaviour)
+#   replace - load into a staging table and swap it in with RENAME TABLE;
+#             skipped when the S3 ETag matches the last successful load
+WRITE_MODES = ('append', 'replace')
+DEFAULT_WRITE_MODE = 'append'
+METADATA_TABLE = 'load_metadata'
+STAGING_SUFFIX = '__staging'
+OLD_SUFFIX = '__old'
+
+# Schema inference samples the first SCHEMA_SAMPLE_ROWS rows of the CSV.
+SCHEMA_SAMPLE_ROWS = 1000
+INDEX_COLUMNS = ('property_type', 'price_tier')
+NULL_VALUES = ('', 'NULL', 'null', 'NaN', 'nan')
+MAX_DECIMAL_SCALE = 6
+MAX_VARCHAR = 1024
+# InnoDB index keys are at most 3072 bytes, 768 characters in utf8mb4; wider
+# indexed VARCHARs get a prefix index of that length.
+MAX_INDEX_CHARS = 768
+
+INT_RE = re.compile(r'^[+-]?\d+$')
+DECIMAL_RE = re.compile(r'^[+-]?(\d*)\.(\d+)$')
+FLOAT_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+
+def quote_ident(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def column_list(header):
+    return ', '.join(quote_ident(col) for col in header)
+
+
+def create_table_sql(table_name, header, column_types=None, index_columns=INDEX_COLUMNS):
+    column_types = column_types or ['VARCHAR(255)'] * len(header)
+    definitions = [f'{quote_ident(col)} {col_type}' for col, col_type in zip(header, column_types)]
+    for col, col_type in zip(header, column_types):
+        if col in index_columns and not col_type.startswith('TEXT'):
+            key = quote_ident(col)
+            width = re.match(r'VARCHAR\((\d+)\)', col_type)
+            if width and int(width.group(1)) > MAX_INDEX_CHARS:
+                key += f'({MAX_INDEX_CHARS})'
+            definitions.append(f"INDEX {quote_ident('idx_' + col)} ({key})")
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        {', '.join(definitions)}
+    );
+    """
+
+
+def varchar_size(max_len):
+    size = 16
+    while size < max_len * 2:
+        size *= 2
+    return size
+
+
+def infer_column_type(values):
+    values = [v for v in values if v not in NULL_VALUES]
+    if not values:
+        return 'VARCHAR(255)'
+
+    if all(INT_RE.match(v) for v in values):
+        if all(-2 ** 31 <= int(v) < 2 ** 31 for v in values):
+            return 'INT'
+        if all(-2 ** 63 <= int(v) < 2 ** 63 for v in values):
+            return 'BIGINT'
+
+    decimals = [DECIMAL_RE.match(v) for v in values]
+    if all(m or INT_RE.match(v) for m, v in zip(decimals, values)):
+        scale = max((len(m.group(2)) for m in decimals if m), default=0)
+        digits = max(len(v.lstrip('+-').split('.')[0]) for v in values)
+        # Wide fractions (e.g. Athena AVG output) are doubles, not money.
+        if scale <= MAX_DECIMAL_SCALE and digits + scale <= 18:
+            return f'DECIMAL({digits + scale + 2},{scale})'
+        return 'DOUBLE'
+
+    if all(FLOAT_RE.match(v) for v in values):
+        return 'DOUBLE'
+
+    max_len = max(len(v) for v in values)
+    if max_len * 2 > MAX_VARCHAR:
+        return 'TEXT'
+    return f'VARCHAR({varchar_size(max_len)})'
+
+
+def infer_schema(header, sample_rows):
+    columns = zip(*sample_rows) if sample_rows else [()] * len(header)
+    return [infer_column_type(list(values)) for values in columns]
+
+
+def peek_rows(rows, n=SCHEMA_SAMPLE_ROWS):
+    # Pulls a sample off a row iterator and returns it with an iterator that
+    # still yields every row, so streaming callers can infer types first.
+    sample = list(itertools.islice(rows, n))
+    return sample, itertools.chain(sample, rows)
+
+
+def infer_table_schema(header, rows, sample_size=SCHEMA_SAMPLE_ROWS):
+    sample, rows = peek_rows(rows, sample_size)
+    column_types = infer_schema(header, sample)
+    return column_types, coerce_nulls(rows, column_types)
+
+
+def coerce_nulls(rows, column_types):
+    # Typed columns cannot take '' in strict mode; send NULL instead.
+    typed = [i for i, t in enumerate(column_types) if not t.startswith(('VARCHAR', 'TEXT'))]
+    if not typed:
+        yield from rows
+        return
+    for row in rows:
+        row = list(row)
+        for i in typed:
+            if row[i] in NULL_VALUES:
+                row[i] = None
+        yield row
+
+
+def insert_sql(table_name, header):
+    return f"""
+    INSERT INTO {table_name} ({column_list(header)})
+    VALUES ({', '.join(['%s'] * len(header))});
+    """
+
+
+def iter_text_lines(body, encoding='utf-8', chunk_size=STREAM_CHUNK_SIZE):
+    # Decodes a byte stream (e.g. an S3 StreamingBody) chunk by chunk and
+    # yields complete lines, so only one chunk plus a partial line is held.
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        cut = pending.rfind('\n') + 1
+        if cut:
+            yield from io.StringIO(pending[:cut], newline='')
+            pending = pending[cut:]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def read_csv_stream(body, encoding='utf-8', chunk_size=STREAM_CHUNK_SIZE):
+    rows = csv.reader(iter_text_lines(body, encoding, chunk_size))
+    header = next(rows)
+    return header, rows
+
+
+def resolve_batch_size(mode, batch_size=None):
+    if batch_size:
+        return max(1, int(batch_size))
+    if mode == 'infile':
+        return DEFAULT_INFILE_BATCH_SIZE
+    return DEFAULT_BATCH_SIZE
+
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_per_row(cursor, table_name, header, rows):
+    sql = insert_sql(table_name, header)
+    count = 0
+    for row in rows:
+        cursor.execute(sql, row)
+        count += 1
+    return count
+
+
+def insert_batched(cursor, table_name, header, rows, batch_size=DEFAULT_BATCH_SIZE):
+    # pymysql rewrites executemany on INSERT ... VALUES into a single
+    # multi-row INSERT, so each batch costs one round trip.
+    sql = insert_sql(table_name, header)
+    count = 0
+    for batch in iter_batches(rows, batch_size):
+        cursor.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def infile_field(value):
+    # With ESCAPED BY '' MySQL reads an unquoted NULL as SQL NULL, so every
+    # real value is enclosed and embedded quotes are doubled.
+    if value is None:
+        return 'NULL'
+    return '"' + value.replace('"', '""') + '"'
+
+
+def load_infile(cursor, table_name, header, rows, batch_size=DEFAULT_INFILE_BATCH_SIZE):
+    # Requires local_infile=True on the connection and on the server.
+    # Rows are spilled to /tmp in batch_size chunks so disk use stays bounded.
+    count = 0
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=tempfile.gettempdir())
+    os.close(fd)
+    sql = f"""
+    LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+    LINES TERMINATED BY '\\n'
+    ({column_list(header)});
+    """
+    try:
+        for batch in iter_batches(rows, batch_size):
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for row in batch:
+                    f.write(','.join(infile_field(v) for v in row) + '\n')
+            cursor.execute(sql, (path,))
+            count += len(batch)
+    finally:
+        os.remove(path)
+    return count
+
+
+def load_rows(cursor, table_name, header, rows, mode=DEFAULT_LOAD_MODE, batch_size=None):
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode '{mode}', expected one of {LOAD_MODES}")
+    batch_size = resolve_batch_size(mode, batch_size)
+    if mode == 'row':
+        return insert_per_row(cursor, table_name, header, rows)
+    if mode == 'infile':
+        return load_infile(cursor, table_name, header, rows, batch_size)
+    return insert_batched(cursor, table_name, header, rows, batch_size)
+
+
+def ensure_metadata_table(cursor):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (
+        `table_name` VARCHAR(64) PRIMARY KEY,
+        `source` VARCHAR(1024),
+        `version` VARCHAR(128),
+        `row_count` BIGINT,
+        `loaded_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    );
+    """)
+
+
+def last_loaded_version(cursor, table_name):
+    cursor.execute(f"SELECT `version` FROM {METADATA_TABLE} WHERE `table_name` = %s", (table_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def record_load(cursor, table_name, source, version, row_count):
+    cursor.execute(f"""
+    INSERT INTO {METADATA_TABLE} (`table_name`, `source`, `version`, `row_count`)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE `source` = VALUES(`source`), `version` = VALUES(`version`),
+        `row_count` = VALUES(`row_count`), `loaded_at` = CURRENT_TIMESTAMP;
+    """, (table_name, source, version, row_count))
+
+
+def table_exists(cursor, table_name):
+    cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+    return cursor.fetchone() is not None
+
+
+def swap_table(cursor, table_name, staging_name):
+    # RENAME TABLE of several tables is atomic, so readers see either the old
+    # or the new table and never a partially loaded one.
+    old_name = table_name + OLD_SUFFIX
+    cursor.execute(f"DROP TABLE IF EXISTS {old_name}")
+    if table_exists(cursor, table_name):
+        cursor.execute(f"RENAME TABLE {table_name} TO {old_name}, {staging_name} TO {table_name}")
+        cursor.execute(f"DROP TABLE {old_name}")
+    else:
+        cursor.execute(f"RENAME TABLE {staging_name} TO {table_name}")
+
+
+def load_s3_csv(conn, response, table_name, source, write_mode=DEFAULT_WRITE_MODE,
+                load_mode=DEFAULT_LOAD_MODE, batch_size=None, infer_types=True, force=False):
+    if write_mode not in WRITE_MODES:
+        raise ValueError(f"Unknown write mode '{write_mode}', expected one of {WRITE_MODES}")
+    version = response.get('ETag', '').strip('"')
+    replace = write_mode == 'replace'
+
+    if replace:
+        with conn.cursor() as cursor:
+            ensure_metadata_table(cursor)
+            unchanged = version and last_loaded_version(cursor, table_name) == version
+            if unchanged and not force and table_exists(cursor, table_name):
+                response['Body'].close()
+                return {'skipped': True, 'rows_loaded': 0, 'version': version, 'column_types': None}
+
+    header, rows = read_csv_stream(response['Body'])
+    column_types = None
+    if infer_types:
+        column_types, rows = infer_table_schema(header, rows)
+
+    target = table_name + STAGING_SUFFIX if replace else table_name
+    with conn.cursor() as cursor:
+        if replace:
+            cursor.execute(f"DROP TABLE IF EXISTS {target}")
+        cursor.execute(create_table_sql(target, header, column_types))
+        row_count = load_rows(cursor, target, header, rows, mode=load_mode, batch_size=batch_size)
+        conn.commit()
+        if replace:
+            swap_table(cursor, table_name, target)
+            record_load(cursor, table_name, source, version, row_count)
+    conn.commit()
+    pipeline_metrics.add(rows=row_count)
+
+    return {
+        'skipped': False,
+        'rows_loaded': row_count,
+        'version': version,
+        'column_types': dict(zip(header, column_types)) if column_types else None
+    }
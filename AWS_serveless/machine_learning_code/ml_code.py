@@ -1,65 +1,412 @@
 # Robert H.
+import os
+import sys
+import json
+import time
 import pandas as pd
 import numpy as np
 import joblib
-from sklearn.model_selection import train_test_split
+import sklearn
+from joblib import Parallel, delayed
+from scipy.stats import loguniform, randint
+from sklearn.model_selection import KFold, ParameterSampler, cross_validate, train_test_split
 from sklearn.preprocessing import OrdinalEncoder
 from sklearn.impute import SimpleImputer
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
+from sklearn.base import clone
 from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.metrics import mean_squared_error
 
+# pipeline_metrics.py arrives as the "metrics-code" processing input; the
+# second path is for runs from a checkout.
+sys.path.insert(0, "/opt/ml/processing/input/lib")
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+import pipeline_metrics
+
 # ✅ Step 1
-print("[Step 1] ⬇️ Loading CSV from mounted input path...")
+# Parquet export (ML_EXPORT_FORMAT=parquet): ml_data/ holds Snappy Parquet
+# files whose column types come from the query, so nothing is re-inferred.
+parquet_path = "/opt/ml/processing/input/ml_data"
 input_path = "/opt/ml/processing/input/ml_data.csv"
-df = pd.read_csv(input_path)
-print(f"[✅] Dataset loaded: {df.shape}")
-
-# Step 2
-target_col = 'price'
-X = df.drop(columns=[target_col])
-y = df[target_col]
-
-# Step 3
-categorical = X.select_dtypes(include='object').columns.tolist()
-numeric = X.select_dtypes(include=[np.number]).columns.tolist()
-
-def compress_rare_categories(series, threshold=0.01):
-    freq = series.value_counts(normalize=True)
-    rare = freq[freq < threshold].index
-    return series.apply(lambda x: 'RARE' if x in rare else x)
-
-for col in categorical:
-    X[col] = compress_rare_categories(X[col], threshold=0.01)
-
-# Step 4: Pipeline
-numeric_pipeline = Pipeline([
-    ('imputer', SimpleImputer(strategy='mean'))
-])
-categorical_pipeline = Pipeline([
-    ('imputer', SimpleImputer(strategy='most_frequent')),
-    ('encoder', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1))
-])
-preprocessor = ColumnTransformer([
-    ('num', numeric_pipeline, numeric),
-    ('cat', categorical_pipeline, categorical)
-])
-model_pipeline = Pipeline([
-    ('preprocessor', preprocessor),
-    ('regressor', HistGradientBoostingRegressor(random_state=42))
-])
-
-# Step 5: training
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-model_pipeline.fit(X_train, y_train)
-
-# Step 6: evaluation
-y_pred = model_pipeline.predict(X_test)
-rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-print(f"[📉 RMSE] {rmse:.2f}")
-
-# ✅ Step 7: 保存模型到挂载输出路径（SageMaker 会自动上传到 S3）
 output_path = "/opt/ml/processing/output/ml_model.pkl"
-joblib.dump(model_pipeline, output_path)
-print(f"[✅] 模型已保存至本地: {output_path}")
+# What the next incremental run needs, next to the model it describes.
+state_path = "/opt/ml/processing/output/training_state.pkl"
+# Mode "incremental": the model the launching Lambda extends (its
+# models/<fingerprint>/ prefix), with its ml_model.pkl and training_state.pkl.
+previous_path = "/opt/ml/processing/input/previous"
+
+# Set by the launching Lambda (model_cache.HYPERPARAMETERS); they are part of
+# the fingerprint the model is stored under, so read them from there only.
+hyperparameters = dict({"rare_threshold": 0.01, "test_size": 0.2, "random_state": 42},
+                       **json.loads(os.environ.get("ML_HYPERPARAMETERS", "{}")))
+
+TARGET_COL = 'price'
+CATEGORICAL_COLUMNS = ['city', 'room_type']
+
+# Mode "incremental" falls back to a full retrain when the new rows are more
+# than this share of the history, or the standardized mean of a column (or
+# the share of a category) has moved this far from the last full retrain.
+# Both bounds widen by DRIFT_Z standard errors of the new rows' sample, so a
+# small batch drawn like the history is not taken for drift.
+INCREMENTAL_MAX_NEW_SHARE = 0.5
+DRIFT_MAX_MEAN_SHIFT = 0.25
+DRIFT_MAX_CATEGORY_SHIFT = 0.1
+DRIFT_Z = 4
+INCREMENTAL_MIN_ROWS = 100
+
+# ML_HYPERPARAMETERS {"mode": "tune"} searches these for the regressor
+# instead of training it with its defaults. tune_candidates, tune_factor and
+# tune_cv size the search; tune_seconds, when set, ends it after the round
+# that passes that much wall time.
+SEARCH_SPACE = {
+    'learning_rate': loguniform(0.01, 0.3),
+    'max_depth': [None, 3, 5, 8, 12],
+    'max_leaf_nodes': randint(15, 128),
+    'l2_regularization': loguniform(1e-3, 10),
+}
+
+
+def is_flag(col):
+    # 0/1 columns of 2_get_output's query.
+    return col == 'is_superhost' or col.startswith('has_')
+
+
+def compact_dtypes(columns):
+    # category for the text columns and int8 for the flags, instead of
+    # object and int64.
+    dtypes = {col: 'category' for col in columns if col in CATEGORICAL_COLUMNS}
+    dtypes.update({col: 'int8' for col in columns if is_flag(col)})
+    return dtypes
+
+
+def load_dataset(parquet_path, input_path):
+    if os.path.isdir(parquet_path):
+        print("[Step 1] ⬇️ Loading Parquet from mounted input path...")
+        df = pd.read_parquet(parquet_path)
+        return df.astype(compact_dtypes(df.columns)), input_size(parquet_path)
+    print("[Step 1] ⬇️ Loading CSV from mounted input path...")
+    columns = pd.read_csv(input_path, nrows=0).columns
+    return pd.read_csv(input_path, dtype=compact_dtypes(columns)), input_size(input_path)
+
+
+def rare_category_encoder(X, categorical, threshold):
+    # Categories below threshold of a column's rows are left out of the
+    # encoder's categories, so they encode as -1 together with categories
+    # first seen at inference. The mapping is part of the saved pipeline.
+    kept = []
+    for col in categorical:
+        freq = X[col].value_counts(normalize=True, sort=False)
+        kept.append(np.array(sorted(freq.index[freq.to_numpy() >= threshold]), dtype=object))
+    return OrdinalEncoder(categories=kept, handle_unknown='use_encoded_value', unknown_value=-1)
+
+
+def build_pipeline(X, hyperparameters):
+    categorical = X.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
+    numeric = [col for col in X.select_dtypes(include=[np.number]).columns if not is_flag(col)]
+    # The flags are never missing, so they skip the imputer and its float64 copy.
+    flags = [col for col in X.columns if is_flag(col)]
+
+    numeric_pipeline = Pipeline([
+        ('imputer', SimpleImputer(strategy='mean'))
+    ])
+    categorical_pipeline = Pipeline([
+        ('imputer', SimpleImputer(strategy='most_frequent')),
+        ('encoder', rare_category_encoder(X, categorical, hyperparameters["rare_threshold"]))
+    ])
+    preprocessor = ColumnTransformer([
+        ('num', numeric_pipeline, numeric),
+        ('flags', 'passthrough', flags),
+        ('cat', categorical_pipeline, categorical)
+    ])
+    return Pipeline([
+        ('preprocessor', preprocessor),
+        ('regressor', HistGradientBoostingRegressor(random_state=hyperparameters["random_state"]))
+    ])
+
+
+def cv_score(regressor, params, X, y, cv):
+    scores = cross_validate(clone(regressor).set_params(**params), X, y, cv=cv,
+                            scoring='neg_root_mean_squared_error')['test_score']
+    return float(scores.mean())
+
+
+def halving_rounds(candidates, factor):
+    # As many rounds as it takes to keep 1/factor of the candidates each time
+    # until fewer than factor are left.
+    rounds = 1
+    while factor ** rounds <= candidates:
+        rounds += 1
+    return rounds
+
+
+def tune(pipeline, X_train, y_train, hyperparameters):
+    # Successive halving: every candidate is cross-validated on a subsample
+    # of the rows and only the best 1/tune_factor go on, with tune_factor
+    # times as many rows; the last round uses all of them. The best of the
+    # last round run is refitted on all of X_train. Candidates run in
+    # parallel on every core. The preprocessor is fitted once; the search
+    # only varies the regressor.
+    preprocessor = pipeline.named_steps['preprocessor']
+    regressor = pipeline.named_steps['regressor']
+    X, y = preprocessor.fit_transform(X_train), np.asarray(y_train)
+    factor = hyperparameters.get("tune_factor", 3)
+    cv = KFold(hyperparameters.get("tune_cv", 3))
+    deadline = hyperparameters.get("tune_seconds")
+    candidates = list(ParameterSampler(SEARCH_SPACE, hyperparameters.get("tune_candidates", 24),
+                                       random_state=hyperparameters["random_state"]))
+    rounds = halving_rounds(len(candidates), factor)
+    # Each round's rows are a prefix of one shuffle, so they grow as nested subsamples.
+    order = np.random.RandomState(hyperparameters["random_state"]).permutation(len(y))
+    search = {'rounds': [], 'stopped_early': False}
+    started = time.perf_counter()
+
+    for iteration in range(rounds):
+        samples = max(len(y) // factor ** (rounds - 1 - iteration), 2 * cv.get_n_splits())
+        rows = np.sort(order[:samples])
+        with pipeline_metrics.step('ml_tune_round', Iteration=iteration, Candidates=len(candidates),
+                                   Samples=samples) as tuning_round:
+            X_round, y_round = X[rows], y[rows]
+            scores = Parallel(n_jobs=-1)(delayed(cv_score)(regressor, params, X_round, y_round, cv)
+                                         for params in candidates)
+            pipeline_metrics.add(rows=samples)
+        print(f"[🔎 Round {iteration}] {len(candidates)} candidates on {samples} rows: "
+              f"{time.perf_counter() - tuning_round.started:.1f} s")
+        search['rounds'].append({'candidates': len(candidates), 'samples': samples})
+        ranked = np.argsort(-np.array(scores), kind='stable')
+        best_params, best_score = candidates[ranked[0]], scores[ranked[0]]
+        if iteration < rounds - 1 and deadline is not None and time.perf_counter() - started > deadline:
+            print(f"[⏱️ Tuning] {deadline} s passed after round {iteration}, keeping its best candidate")
+            search['stopped_early'] = True
+            break
+        candidates = [candidates[i] for i in ranked[:-(-len(candidates) // factor)]]
+
+    refit_started = time.perf_counter()
+    best_estimator = clone(regressor).set_params(**best_params).fit(X, y)
+    search.update(best_params={name: getattr(value, 'item', lambda: value)() for name, value in best_params.items()},
+                  cv_rmse=-best_score, refit_seconds=time.perf_counter() - refit_started)
+    return Pipeline([('preprocessor', preprocessor), ('regressor', best_estimator)]), search
+
+
+def input_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def row_hashes(df):
+    # A 64-bit hash per row, to tell the rows a model has seen.
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def reference_stats(X, y):
+    # Column means/stds and category shares of the last full retrain.
+    numeric = X.select_dtypes(include=[np.number]).assign(**{TARGET_COL: y})
+    return {
+        'mean': numeric.mean().to_dict(),
+        'std': numeric.std().replace(0, 1).fillna(1).to_dict(),
+        'shares': {col: X[col].value_counts(normalize=True).to_dict()
+                   for col in X.select_dtypes(include=['object', 'string', 'category']).columns},
+    }
+
+
+def training_state(X, y, hashes, reference=None, held_out=()):
+    # hashes are the rows a fit used. Rows held out for the RMSE, or left
+    # over by a run that kept the model as it was, stay new for the next
+    # run; held_out names the former, which the drift test has already seen.
+    return {
+        'columns': {col: str(dtype) for col, dtype in X.dtypes.items()},
+        'row_hashes': np.unique(hashes),
+        'held_out': np.unique(held_out),
+        'reference': reference or reference_stats(X, y),
+    }
+
+
+def drift_reason(reference, X_new, y_new, rare_threshold):
+    n = len(X_new)
+    numeric = X_new.select_dtypes(include=[np.number]).assign(**{TARGET_COL: y_new})
+    bound = DRIFT_MAX_MEAN_SHIFT + DRIFT_Z / np.sqrt(n)
+    for col, mean in numeric.mean().items():
+        shift = abs(mean - reference['mean'][col]) / reference['std'][col]
+        if shift > bound:
+            return f"mean of {col} moved {shift:.2f} standard deviations on {n} rows"
+    for col, shares in reference['shares'].items():
+        # The categories the encoder tells apart, and the rest as one (-1).
+        shares = pd.Series(shares, dtype='float64')
+        frequent = shares.index[shares.to_numpy() >= rare_threshold]
+        new_shares = X_new[col].value_counts(normalize=True).reindex(frequent, fill_value=0.0)
+        other = abs(shares[frequent].sum() - new_shares.sum())
+        shift = 0.5 * ((new_shares - shares[frequent]).abs().sum() + other)
+        bound = DRIFT_MAX_CATEGORY_SHIFT + DRIFT_Z * 0.5 * np.sqrt((len(frequent) + 1) / n)
+        if shift > bound:
+            return f"categories of {col} moved {shift:.0%} on {n} rows"
+    return None
+
+
+def full_retrain_reason(pipeline, state, X, new, hyperparameters):
+    # Why the previous model cannot be extended with the rows of X where
+    # new is True, or None.
+    columns = {col: str(dtype) for col, dtype in X.dtypes.items()}
+    if columns != state['columns']:
+        return f"schema changed: {sorted(set(columns.items()) ^ set(state['columns'].items()))}"
+    seen = new.size - new.sum()
+    if seen < 0.99 * len(state['row_hashes']):
+        return f"only {seen} of the {len(state['row_hashes'])} rows it was trained on are left"
+    if new.sum() > INCREMENTAL_MAX_NEW_SHARE * seen:
+        return f"{new.sum()} new rows on {seen} trained"
+    encoder = pipeline.named_steps['preprocessor'].named_transformers_['cat'].named_steps['encoder']
+    categorical = pipeline.named_steps['preprocessor'].transformers_[2][2]
+    threshold = hyperparameters["rare_threshold"]
+    for col, known in zip(categorical, encoder.categories_):
+        freq = X[col].value_counts(normalize=True)
+        frequent = set(freq.index[freq.to_numpy() >= threshold])
+        if frequent - set(known):
+            return f"new frequent {col}: {sorted(frequent - set(known))}"
+    return None
+
+
+def extend(pipeline, X_new, y_new, iterations):
+    # Adds iterations to the booster, fitted on the new rows; None, or why
+    # it could not. The fitted preprocessor, and with it the category
+    # mapping, stays as it is.
+    # HistGradientBoostingRegressor(warm_start=True) re-bins the data it is
+    # given and would then score the existing trees against the new bins,
+    # so the new trees are fitted on the residuals of the existing model
+    # with its settings and appended to it. That uses the booster's private
+    # _predictors and _baseline_prediction (scikit-learn versions in
+    # requirements.txt). Its predictions on some of the new rows are compared
+    # with the old model's plus the residual model's, so a release that
+    # changes them falls back to a full retrain instead of saving a wrong
+    # model.
+    regressor = pipeline.named_steps['regressor']
+    encoded = pipeline.named_steps['preprocessor'].transform(X_new)
+    before = regressor.predict(encoded)
+    residual = clone(regressor).set_params(max_iter=iterations, early_stopping=False, warm_start=False)
+    residual.fit(encoded, y_new - before)
+    try:
+        regressor._predictors.extend(residual._predictors)
+        regressor._baseline_prediction = regressor._baseline_prediction + residual._baseline_prediction
+    except AttributeError as e:
+        return f"scikit-learn {sklearn.__version__} booster cannot be extended: {e}"
+    # n_iter_ counts the trees; max_iter and the per-iteration scores (NaN
+    # for the added ones) follow it.
+    regressor.set_params(max_iter=regressor.n_iter_)
+    for scores in ('train_score_', 'validation_score_'):
+        if len(getattr(regressor, scores, ())):
+            setattr(regressor, scores, np.append(getattr(regressor, scores),
+                                                 np.full(len(residual._predictors), np.nan)))
+    sample = encoded[:1000]
+    if not np.allclose(regressor.predict(sample), before[:1000] + residual.predict(sample)):
+        return f"scikit-learn {sklearn.__version__} booster predicts differently once extended"
+    return None
+
+
+def incremental_update(X, y, hashes, hyperparameters):
+    # (pipeline, state, X_test, y_test, reason): the previous model extended
+    # with the rows it has not seen and its new training state, or reason
+    # for a full retrain.
+    model_file = os.path.join(previous_path, os.path.basename(output_path))
+    state_file = os.path.join(previous_path, os.path.basename(state_path))
+    if not (os.path.exists(model_file) and os.path.exists(state_file)):
+        return None, None, None, None, "no previous model with a training state"
+    pipeline, state = joblib.load(model_file), joblib.load(state_file)
+    pipeline_metrics.add(bytes_read=os.path.getsize(model_file) + os.path.getsize(state_file))
+
+    new = ~np.isin(hashes, state['row_hashes'])
+    reason = full_retrain_reason(pipeline, state, X, new, hyperparameters)
+    if reason:
+        return None, None, None, None, reason
+    pipeline_metrics.add(rows=int(new.sum()))
+    if new.sum() < INCREMENTAL_MIN_ROWS:
+        print(f"[➕ Incremental] {new.sum()} new rows, keeping the previous model")
+        return pipeline, training_state(X, y, state['row_hashes'], state['reference'],
+                                        state.get('held_out', ())), None, None, None
+    # Rows an earlier run held out are trained on now, but only the others
+    # are tested for drift.
+    fresh = new & ~np.isin(hashes, state.get('held_out', ()))
+    if fresh.any():
+        reason = drift_reason(state['reference'], X[fresh], y[fresh], hyperparameters["rare_threshold"])
+        if reason:
+            return None, None, None, None, reason
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X[new], y[new], test_size=hyperparameters["test_size"], random_state=hyperparameters["random_state"])
+    iterations = hyperparameters.get("incremental_iterations", 20)
+    reason = extend(pipeline, X_train, y_train, iterations)
+    if reason:
+        return None, None, None, None, reason
+    print(f"[➕ Incremental] {iterations} iterations on {len(X_train)} of {new.sum()} new rows")
+    trained = np.concatenate([state['row_hashes'], hashes[X.index.get_indexer(X_train.index)]])
+    state = training_state(X, y, trained, state['reference'], hashes[X.index.get_indexer(X_test.index)])
+    return pipeline, state, X_test, y_test, None
+
+
+def main():
+    mode = hyperparameters.get("mode", "train")
+    # One metrics record per stage and one for the job, tagged with the
+    # PIPELINE_RUN_ID the launching Lambda sets.
+    with pipeline_metrics.step('ml_training', Mode=mode):
+        with pipeline_metrics.step('ml_load'):
+            df, size = load_dataset(parquet_path, input_path)
+            pipeline_metrics.add(bytes_read=size, rows=len(df))
+        print(f"[✅] Dataset loaded: {df.shape}")
+        pipeline_metrics.add(rows=len(df))
+
+        # Step 2
+        X = df.drop(columns=[TARGET_COL])
+        y = df[TARGET_COL]
+        hashes = row_hashes(df)
+
+        model_pipeline = state = None
+        if mode == "incremental":
+            with pipeline_metrics.step('ml_incremental') as incremental:
+                model_pipeline, state, X_test, y_test, reason = incremental_update(
+                    X, y, hashes, hyperparameters)
+                incremental.properties['FullRetrain'] = reason
+            if reason:
+                print(f"[↩️ Full retrain] {reason}")
+
+        if model_pipeline is None:
+            with pipeline_metrics.step('ml_prepare'):
+                # Step 3-4: Pipeline, with the rare-category mapping in its encoder
+                model_pipeline = build_pipeline(X, hyperparameters)
+                pipeline_metrics.add(rows=len(X))
+
+            # Step 5: training, or the search of ML_HYPERPARAMETERS mode "tune"
+            X_train, X_test, y_train, y_test = train_test_split(
+                X, y, test_size=hyperparameters["test_size"], random_state=hyperparameters["random_state"])
+            state = training_state(X, y, hashes[X.index.get_indexer(X_train.index)],
+                                   held_out=hashes[X.index.get_indexer(X_test.index)])
+            if mode == "tune":
+                with pipeline_metrics.step('ml_tune') as tuning:
+                    model_pipeline, search = tune(model_pipeline, X_train, y_train, hyperparameters)
+                    tuning.properties.update(BestParams=search['best_params'], CvRmse=round(search['cv_rmse'], 2),
+                                             RefitSeconds=round(search['refit_seconds'], 2),
+                                             StoppedEarly=search['stopped_early'])
+                    pipeline_metrics.add(rows=len(X_train))
+                print(f"[🏆 Best] {search['best_params']} CV RMSE {search['cv_rmse']:.2f}, "
+                      f"refit {search['refit_seconds']:.1f} s")
+            else:
+                with pipeline_metrics.step('ml_train'):
+                    model_pipeline.fit(X_train, y_train)
+                    pipeline_metrics.add(rows=len(X_train))
+
+        # Step 6: evaluation
+        if X_test is not None:
+            with pipeline_metrics.step('ml_evaluate') as evaluation:
+                y_pred = model_pipeline.predict(X_test)
+                rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+                evaluation.properties['Rmse'] = round(float(rmse), 2)
+                pipeline_metrics.add(rows=len(X_test))
+            print(f"[📉 RMSE] {rmse:.2f}")
+
+        # ✅ Step 7: 保存模型到挂载输出路径（SageMaker 会自动上传到 S3）
+        with pipeline_metrics.step('ml_save'):
+            joblib.dump(model_pipeline, output_path)
+            joblib.dump(state, state_path)
+            pipeline_metrics.add(bytes_written=os.path.getsize(output_path) + os.path.getsize(state_path))
+        print(f"[✅] 模型已保存至本地: {output_path}")
+
+
+if __name__ == "__main__":
+    main()